@@ -0,0 +1,373 @@
+# Load-generation and latency benchmark for the server
+# Starts a Server in a child process on a free loopback port, serving a scratch copy of the countries file, and drives it
+# with concurrent synthetic clients (asyncio connections, spread over one or more processes) that each send a weighted
+# random mix of commands back to back for a fixed duration.
+# Reports throughput, latency percentiles, payload bytes before and after compression and the server's CPU time as JSON,
+# so that runs can be compared and regressions caught.
+
+import asyncio, csv, json, multiprocessing, os, platform, random, shutil, signal, socket, sys, tempfile, time
+from argparse import ArgumentParser
+from connection import AsyncConnection, Connection, DEFAULT_CODECS, CONNECTION_ERRORS, ServerBusyError
+from compression import CODECS
+from server import Server
+from limits import parseLimits
+from logs import setupLogging
+
+DEFAULT_MIX = "c=70,p=20,a=5,h=5" # command=weight pairs
+MIX_COMMANDS = ("c", "p", "a", "h", "b", "i", "f", "e") # commands the synthetic clients can send
+BATCH_SIZE = 10 # countries per batch lookup
+PERCENTILES = (("p50", 50), ("p90", 90), ("p99", 99), ("p999", 99.9))
+STARTUP_TIMEOUT = 30 # seconds to wait for the server to accept connections
+BUSY_DELAY = 0.05 # seconds a client turned away by the server waits before connecting again
+
+
+#Parses a command mix such as "c=70,p=20,a=5,h=5" into the weight of each command.
+#[*] Parameters:
+#   -> mix (str): Comma separated command=weight pairs.
+#[*] Returns:
+#   -> dict: command -> weight.
+#[*] Raises:
+#   -> ValueError: If a command is not one of MIX_COMMANDS, or a weight is not a positive number.
+def parseMix(mix:str) -> dict:
+    weights = dict()
+    for pair in mix.split(","):
+        command, _, weight = pair.strip().partition("=")
+        if(command not in MIX_COMMANDS):
+            raise ValueError(f"Unknown command {command!r} in mix, expected one of {', '.join(MIX_COMMANDS)}")
+        weights[command] = float(weight) if weight else 1.0
+        if(weights[command] <= 0):
+            raise ValueError(f"Weight of command {command!r} must be positive")
+    return weights
+
+
+#Works out a percentile of a sorted list of values by the nearest-rank method.
+#[*] Parameters:
+#   -> values (list): The values, sorted in ascending order. Must not be empty.
+#   -> percent (float): The percentile, from 0 to 100.
+#[*] Returns:
+#   -> float: The value at that percentile.
+def percentile(values:list, percent:float) -> float:
+    rank = max(1, -(-len(values) * percent // 100)) # ceiling of the rank, from 1
+    return values[int(rank) - 1]
+
+
+#Summarises latencies (in seconds) as milliseconds.
+#[*] Parameters:
+#   -> latencies (list): The latencies.
+#[*] Returns:
+#   -> dict: Count, mean, min, max and percentiles of the latencies.
+def summarise(latencies:list) -> dict:
+    if(not latencies):
+        return {"count":0}
+    values = sorted(latencies)
+    summary = {"count":len(values), "mean":1000 * sum(values) / len(values), "min":1000 * values[0]}
+    for name, percent in PERCENTILES:
+        summary[name] = 1000 * percentile(values, percent)
+    summary["max"] = 1000 * values[-1]
+    return summary
+
+
+#Finds a free TCP port on the given address, for the server to listen on.
+#[*] Parameters:
+#   -> address (str): The address.
+#[*] Returns:
+#   -> int: The port.
+def freePort(address:str) -> int:
+    with socket.socket() as probe:
+        probe.bind((address, 0))
+        return probe.getsockname()[1]
+
+
+#Reads the country names of the countries file, for the synthetic clients to look up.
+#[*] Parameters:
+#   -> countriesFile (str): Path to the countries file.
+#[*] Returns:
+#   -> list: The country names.
+def readCountries(countriesFile:str) -> list:
+    with open(countriesFile, newline="", encoding="utf-8") as csvFile:
+        rows = csv.reader(csvFile)
+        next(rows, None) # skip the header [Country, City]
+        return [row[0] for row in rows if len(row) >= 2]
+
+
+#Entry point of the server process: runs a Server that only logs warnings and errors.
+#[*] Parameters:
+#   -> options (dict): Keyword arguments of the Server.
+#[*] Returns: None
+def runServer(options:dict):
+    setupLogging("warning")
+    Server(**options).run()
+
+
+#Waits until the server accepts connections.
+#[*] Parameters:
+#   -> address (str): Address of the server.
+#   -> port (int): Port of the server.
+#   -> process (multiprocessing.Process): The server process, which must stay alive.
+#[*] Returns: None
+#[*] Raises:
+#   -> RuntimeError: If the server exits or does not accept connections within STARTUP_TIMEOUT seconds.
+def waitForServer(address:str, port:int, process):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while(time.monotonic() < deadline):
+        if(not process.is_alive()):
+            raise RuntimeError(f"Server exited during startup with code {process.exitcode}")
+        try:
+            socket.create_connection((address, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start accepting connections in time")
+
+
+#Stops the server process the way a user would (Ctrl+C), so that it shuts down cleanly, and waits for it to exit.
+#[*] Parameters:
+#   -> process (multiprocessing.Process): The server process.
+#[*] Returns: None
+def stopServer(process):
+    if(hasattr(signal, "SIGINT") and os.name != "nt"):
+        os.kill(process.pid, signal.SIGINT)
+    else:
+        process.terminate()
+    process.join(STARTUP_TIMEOUT)
+    if(process.is_alive()):
+        process.kill()
+        process.join()
+
+
+#Runs one synthetic client: sends commands drawn from the mix back to back until the deadline, timing each round trip.
+#   -> A request that fails is counted as an error and the client reconnects; it stops if it cannot.
+#   -> A request the server rejects as busy is counted as rejected, and a connection it turns away is opened again
+#      after a short delay.
+#[*] Parameters:
+#   -> client (int): Number of the client, used to make the countries it adds unique.
+#   -> options (dict): The benchmark options (see runClients).
+#   -> deadline (float): time.perf_counter() value at which to stop.
+#   -> results (dict): Results shared by the clients of the process, updated in place.
+#[*] Returns: None
+async def runClient(client:int, options:dict, deadline:float, results:dict):
+    generator = random.Random(options["seed"] * 1000003 + client)
+    commands, weights = list(options["mix"]), list(options["mix"].values())
+    countries = options["countries"]
+    connection = None
+    added = 0
+    while(time.perf_counter() < deadline):
+        if(connection is None):
+            connection = AsyncConnection(options["address"], options["port"], options["codecs"], options["timeout"])
+            try:
+                await connection.connect()
+            except ServerBusyError:
+                results["rejected"] += 1
+                connection = None
+                await asyncio.sleep(BUSY_DELAY)
+                continue
+            except CONNECTION_ERRORS:
+                results["errors"] += 1
+                return
+        command = generator.choices(commands, weights)[0]
+        if(command == "a"):
+            added += 1
+            contents = f"Bench{client}x{added},City{added}"
+        elif(command == "b"):
+            contents = "\n".join(generator.choices(countries, k=BATCH_SIZE))
+        elif(command in ("h", "e")):
+            contents = ""
+        elif(command == "f"):
+            country = generator.choice(countries)
+            contents = country[:generator.randint(1, len(country))] # a completion, as typed so far
+        else:
+            contents = generator.choice(countries)
+        start = time.perf_counter()
+        try:
+            await connection.request(command, contents)
+        except ServerBusyError:
+            results["rejected"] += 1
+            continue
+        except CONNECTION_ERRORS:
+            results["errors"] += 1
+            recordBytes(results, connection)
+            connection.close()
+            connection = None
+            continue
+        results["latencies"][command].append(time.perf_counter() - start)
+    if(connection is not None):
+        recordBytes(results, connection)
+        connection.close()
+
+
+#Adds the compression counters of a connection to the results of its process.
+#[*] Parameters:
+#   -> results (dict): Results shared by the clients of the process, updated in place.
+#   -> connection (AsyncConnection): The connection, once it is no longer used.
+#[*] Returns: None
+def recordBytes(results:dict, connection:AsyncConnection):
+    for direction, stats in (("sent", connection.policy.getStats()), ("received", connection.policy.getReceivedStats())):
+        counters = stats.getStats()
+        for name in ("messages", "rawBytes", "wireBytes"):
+            results["bytes"][direction][name] += counters[name]
+
+
+#Entry point of a client process: runs its share of the synthetic clients on an event loop.
+#[*] Parameters:
+#   -> options (dict): The benchmark options: address, port, codecs, timeout, mix, countries, duration, seed,
+#                      and the range of client numbers to run (firstClient, clients).
+#[*] Returns:
+#   -> dict: The latencies of each command, the number of errors and of requests rejected as busy, and payload bytes before
+#            and after compression in each direction.
+def runClients(options:dict) -> dict:
+    async def run():
+        deadline = time.perf_counter() + options["duration"]
+        await asyncio.gather(*(runClient(client, options, deadline, results)
+                               for client in range(options["firstClient"], options["firstClient"] + options["clients"])))
+    results = {"latencies":{command:list() for command in options["mix"]}, "errors":0, "rejected":0,
+               "bytes":{direction:{"messages":0, "rawBytes":0, "wireBytes":0} for direction in ("sent", "received")}}
+    asyncio.run(run())
+    return results
+
+
+#Runs the benchmark: starts the server, drives it with the clients, stops it and gathers the results.
+#[*] Parameters:
+#   -> options (dict): The benchmark options parsed from the command line.
+#[*] Returns:
+#   -> dict: The results (see README.md).
+def runBenchmark(options:dict) -> dict:
+    mix = parseMix(options["mix"])
+    address = options["address"]
+    port = freePort(address)
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as directory:
+        countriesFile = os.path.join(directory, os.path.basename(options["file"]))
+        shutil.copyfile(options["file"], countriesFile) # added countries go to the scratch copy, not the real file
+        serverOptions = {"address":address, "port":port, "countriesFile":countriesFile, "mode":options["mode"],
+                         "threads":options["threads"], "codec":options["codec"], "durable":options["durable"],
+                         "workers":options.get("workers"), "backend":options.get("backend", "memory"),
+                         "rateLimits":options.get("rate_limits"), "maxConnections":options.get("max_connections", 0)}
+        server = multiprocessing.Process(target=runServer, args=(serverOptions,), name="benchmark-server")
+        server.start()
+        try:
+            waitForServer(address, port, server)
+            clientOptions = list()
+            processes = min(options["processes"], options["clients"])
+            for process in range(processes):
+                first = options["clients"] * process // processes
+                clientOptions.append({"address":address, "port":port, "codecs":options["codecs"], "timeout":options["timeout"],
+                                      "mix":mix, "countries":readCountries(countriesFile), "duration":options["duration"],
+                                      "seed":options["seed"], "firstClient":first,
+                                      "clients":options["clients"] * (process + 1) // processes - first})
+            start = time.perf_counter()
+            if(processes == 1):
+                workerResults = [runClients(clientOptions[0])]
+            else:
+                pool = multiprocessing.Pool(processes)
+                workerResults = pool.map(runClients, clientOptions)
+                pool.close()
+                pool.join()
+            elapsed = time.perf_counter() - start
+            serverMetrics = fetchServerMetrics(address, port)
+            before = os.times() # child CPU times only include children that have been waited for, so only the server's from here
+        finally:
+            stopServer(server)
+        after = os.times()
+    report = summariseRun(options, serverOptions, workerResults, elapsed,
+                          after.children_user + after.children_system - before.children_user - before.children_system)
+    report["server"]["metrics"] = serverMetrics
+    return report
+
+
+#Asks the server for its own metrics (stats command), for the stage by stage latencies it measured.
+#[*] Parameters:
+#   -> address (str): Address of the server.
+#   -> port (int): Port of the server.
+#[*] Returns:
+#   -> dict | None: The server's stats, or None if they could not be retrieved.
+def fetchServerMetrics(address:str, port:int):
+    connection = Connection(address, port, timeout=STARTUP_TIMEOUT)
+    try:
+        connection.connect()
+        return json.loads(connection.request("s"))
+    except CONNECTION_ERRORS + (ValueError, ServerBusyError):
+        return None
+    finally:
+        connection.close()
+
+
+#Combines the results of the client processes into the report of the run.
+#[*] Parameters:
+#   -> options (dict): The benchmark options parsed from the command line.
+#   -> serverOptions (dict): The options the server was started with.
+#   -> workerResults (list): The results of each client process (see runClients).
+#   -> elapsed (float): Seconds the clients ran for.
+#   -> serverTime (float): CPU seconds (user and system) used by the server process and its workers, startup and shutdown included.
+#[*] Returns:
+#   -> dict: The report.
+def summariseRun(options:dict, serverOptions:dict, workerResults:list, elapsed:float, serverTime:float) -> dict:
+    latencies = {command:list() for command in workerResults[0]["latencies"]}
+    bytesCount = {direction:{"messages":0, "rawBytes":0, "wireBytes":0} for direction in ("sent", "received")}
+    for results in workerResults:
+        for command, values in results["latencies"].items():
+            latencies[command].extend(values)
+        for direction, counters in results["bytes"].items():
+            for name, value in counters.items():
+                bytesCount[direction][name] += value
+    for counters in bytesCount.values():
+        counters["ratio"] = counters["wireBytes"] / counters["rawBytes"] if counters["rawBytes"] else 1.0
+    requests = sum(len(values) for values in latencies.values())
+    return {"timestamp":time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "environment":{"python":platform.python_version(), "implementation":platform.python_implementation(),
+                           "platform":platform.platform(), "cpus":os.cpu_count()},
+            "config":{"clients":options["clients"], "processes":options["processes"], "duration":options["duration"],
+                      "mix":parseMix(options["mix"]), "codecs":options["codecs"], "seed":options["seed"],
+                      "server":{name:value for name, value in serverOptions.items() if name not in ("address", "port", "countriesFile")}},
+            "requests":requests,
+            "errors":sum(results["errors"] for results in workerResults),
+            "rejected":sum(results["rejected"] for results in workerResults),
+            "elapsed":elapsed,
+            "throughput":requests / elapsed if elapsed else 0.0,
+            "latency":summarise([value for values in latencies.values() for value in values]),
+            "commands":{command:summarise(values) for command, values in latencies.items()},
+            "bytes":bytesCount,
+            "server":{"cpuTime":serverTime, "cpuPerRequest":serverTime / requests if requests else None}}
+
+
+#Parses the command line arguments, runs the benchmark and writes the report as JSON.
+#[*] Parameters: None
+#[*] Returns: None
+def main():
+    parser = ArgumentParser(description="Benchmark the server under load and report the results as JSON.")
+    parser.add_argument("--clients", type=int, default=32, help="number of concurrent connections (default 32)")
+    parser.add_argument("--processes", type=int, default=1, help="number of processes the clients are spread over (default 1)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run for (default 10)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"weighted command mix (default {DEFAULT_MIX})")
+    parser.add_argument("--codecs", default=",".join(DEFAULT_CODECS), help="codecs the clients offer, in order of preference")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds before a request counts as failed (default 10)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--file", default="countries_capitals.csv", help="countries file, copied for the run")
+    parser.add_argument("--mode", choices=["async", "threads", "prefork"], default="async")
+    parser.add_argument("--workers", type=int, help="server worker processes in prefork mode (default one per core)")
+    parser.add_argument("--backend", choices=["memory", "mmap"], default="memory")
+    parser.add_argument("--threads", type=int, default=256)
+    parser.add_argument("--codec", choices=list(CODECS), default="zlib", help="server's preferred codec")
+    parser.add_argument("--durable", action="store_true")
+    parser.add_argument("--rate-limits", type=parseLimits, default=dict(), help="server's rate limits per client, e.g. a=5,*=1000")
+    parser.add_argument("--max-connections", type=int, default=0, help="server's connection limit (default none)")
+    parser.add_argument("--output", help="file to write the JSON report to (default standard output)")
+    args = parser.parse_args()
+    options = vars(args)
+    options["codecs"] = [codec.strip() for codec in args.codecs.split(",") if codec.strip() in CODECS]
+    try:
+        parseMix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    report = runBenchmark(options)
+    if(args.output):
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"[*] {report['requests']} requests, {report['throughput']:.0f} requests/s, "
+              f"p99 {report['latency'].get('p99', 0):.2f} ms, {report['errors']} errors, {report['rejected']} rejected. "
+              f"Report written to {args.output}")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
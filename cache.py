@@ -0,0 +1,107 @@
+# Cache of encoded reply frames for hot lookups
+# Lookups are heavily skewed towards a few countries, so the frames of their replies are kept, already compressed, in a
+# bounded LRU cache keyed by (command, normalised country, codec). A hit only copies the frame and patches in the request id.
+# Entries are dropped when the country is added, and the whole cache is cleared when the countries file is reloaded.
+
+import threading
+from collections import OrderedDict
+from compression import CODEC_NAMES
+
+DEFAULT_CACHE_SIZE = 4096 # maximum number of cached frames
+
+
+class ResponseCache():
+    #Initialises an empty cache.
+    #[*] Parameters:
+    #   -> capacity (int): Maximum number of cached frames. Default is 4096. A capacity of 0 disables the cache.
+    #[*] Returns: None
+    def __init__(self, capacity:int=DEFAULT_CACHE_SIZE):
+        self.capacity = capacity
+        self.lock = threading.Lock() # connection threads share the cache in thread-pool mode
+        self.entries = OrderedDict() # key -> (frame, raw payload size, codec flag), least recently used first
+        self.epoch = 0 # bumped by every invalidation, so that replies worked out before it are not cached after it
+        self.generation = None # generation of the country store the entries were worked out from
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+
+    #Looks up a cached frame, and marks it as the most recently used.
+    #[*] Parameters:
+    #   -> key (tuple): (command, normalised country, codec).
+    #[*] Returns:
+    #   -> tuple | None: (frame (bytes), raw payload size (int), codec flag of the frame (int)), or None on a miss.
+    def get(self, key:tuple):
+        with self.lock:
+            entry = self.entries.get(key)
+            if(entry is None):
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+
+    #Caches a frame, evicting the least recently used one if the cache is full.
+    #   -> The frame is dropped if the cache was invalidated since the epoch was read, as the reply may be stale.
+    #[*] Parameters:
+    #   -> key (tuple): (command, normalised country, codec).
+    #   -> entry (tuple): (frame (bytes), raw payload size (int), codec flag of the frame (int)).
+    #   -> epoch (int): The epoch read (with getEpoch) before the reply was worked out.
+    #[*] Returns: None
+    def put(self, key:tuple, entry:tuple, epoch:int):
+        with self.lock:
+            if(epoch != self.epoch or self.capacity <= 0):
+                return
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            if(len(self.entries) > self.capacity):
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+
+    #Drops the cached replies about a country, for every codec.
+    #[*] Parameters:
+    #   -> commands (iterable): The commands whose replies are cached.
+    #   -> country (str): The normalised country.
+    #[*] Returns: None
+    def invalidate(self, commands, country:str):
+        with self.lock:
+            self.epoch += 1
+            for command in commands:
+                for codec in CODEC_NAMES:
+                    if(self.entries.pop((command, country, codec), None) is not None):
+                        self.invalidations += 1
+
+
+    #Clears the cache if the country store has changed generation (it reloaded or read new lines from the countries file).
+    #[*] Parameters:
+    #   -> generation (int): The current generation of the country store.
+    #[*] Returns: None
+    def sync(self, generation:int):
+        if(generation == self.generation):
+            return
+        with self.lock:
+            if(generation != self.generation):
+                self.epoch += 1
+                self.invalidations += len(self.entries)
+                self.entries.clear()
+                self.generation = generation
+
+    def getEpoch(self) -> int:
+        return self.epoch
+
+    def isEnabled(self) -> bool:
+        return self.capacity > 0
+
+
+    #Returns the counters of the cache.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> dict: Size, capacity, hits, misses, hit ratio, evictions and invalidations.
+    def getStats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"size":len(self.entries), "capacity":self.capacity, "hits":self.hits, "misses":self.misses,
+                    "hitRatio":self.hits / lookups if lookups else 0.0, "evictions":self.evictions, "invalidations":self.invalidations}
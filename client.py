@@ -1,170 +1,283 @@
-import sys
-import socket
-from socket import SOL_SOCKET, SO_REUSEADDR
-from packet import Packet
-from argparse import ArgumentParser
-
-
-class Client():
-    #Initialize a Client instance with a specified port number.
-    #[*] Parameters:
-    #   -> port (int): The port number to connect to the server. If not provided, defaults to 6000.
-    #[*] Returns: None
-    def __init__(self, address:str = "127.0.0.1", port:int = 6000):
-        # Provides descriptions of all of the commands
-        self.commandsList = {"COMMANDS":"Show a list of commands",
-                             "GET_CITY":"Provide a country and receive its capital city",
-                             "GET_POPULATION":"Provide a country and receive its population",
-                             "ADD_NEW_COUNTRY":"Provide a country and its capital city to add to the server's database",
-                             "HEART": "Send a heartbeat to the server to verify connection",
-                             "STOP": "Stop the program"}
-
-        # Associates inputted commands with their respective functions
-        self.commandsExecution = {"COMMANDS":self.printCommands,
-                                  "GET_CITY":self.getCity,
-                                  "GET_POPULATION":self.getPopulation,
-                                  "ADD_NEW_COUNTRY":self.addNewEntry,
-                                  "HEART":self.heartbeat,
-                                  "STOP":self.stopProgram}
-
-        # Configure port settings with arguments, if one is provided. Otherwise, default to 6000.
-        parser = ArgumentParser()
-        parser.add_argument("--port")
-        parser.add_argument("--address")
-        args = parser.parse_args()
-        if(args.port):
-            self.port = int(args.port)
-        else:
-            self.port = port
-        if(args.address):
-            self.address = str(args.address)
-        else:
-            self.address = str(address)
-
-        self.clientSocket = socket.socket()
-        self.bufferSize = 1024
-
-        self.packet = Packet() # serves as a packet template to load and process received and transmitted packets
-
-
-    #Attempts to establish a socket connection with the server using the provided configuration.
-    #   -> If the connection is refused, it calls the stopProgram method with an appropriate error message.
-    #   -> If the connection is successful, it prints a success message and enters the main client loop.
-    #   -> In the main loop, it prompts the user to enter a command, executes the corresponding function,
-    #      or prints an error message if the command is invalid.
-    #[*] Parameters: None
-    #[*] Returns: None
-    def run(self):
-        # Attempt a socket connection with provided configuration
-        try:
-            self.clientSocket.connect(("127.0.0.1", self.port))
-        except ConnectionRefusedError as e:
-            self.stopProgram("Connection refused. Ensure the server is running and port numbers are matching.", type(e).__name__)
-        except OverflowError as e:
-            self.stopProgram("Port number may be too high or too low. Ensure the port number is 0-65535", type(e).__name__)
-        except OSError as e:
-            self.stopProgram("Inputted IP Address is not valid in the current context. Ensure the IP address is correct and try again.", type(e).__name__)
-        print("Connection successfully established with server!")
-
-        # Main client loop to receive and execute commands
-        self.printCommands()
-        while(True):
-            userInput = input("Enter command: ")
-            self.commandsExecution[userInput.upper()]() if userInput.upper() in self.commandsExecution else print("Invalid command entered")
-
-
-    #Transmits a message to the server using the established socket connection.
-    #   -> This function generates a packet using the current packet template,
-    #      sends the encoded message to the server, and handles any ConnectionResetError
-    #      exceptions that may occur due to the server being forcibly closed.
-    #[*] Parameters: None
-    #[*] Returns: None
-    def transmitMessage(self):
-        message = self.packet.generatePacket()
-        self.packet.emptyPacket()
-        try:
-            self.clientSocket.send(message) # packet is already encoded when compressed
-        except ConnectionResetError as e:
-            self.stopProgram("Connection was forcibly closed by server. Ensure the server is running before running the client.", type(e).__name__)
-        self.receiveMessage()
-
-
-    #This function receives a message from the server using the established socket connection.
-    #   -> If no message is received, it calls the stopProgram method with an appropriate error message.
-    #   -> Otherwise, it decodes the received message, creates a new packet from the decoded message,
-    #      prints the response from the server, and empties the packet.
-    #[*] Parameters: None
-    #[*] Returns: None
-    def receiveMessage(self):
-        try:
-            data = self.clientSocket.recv(self.bufferSize) # message is decoded when recieved
-        except ConnectionResetError as e:
-            self.stopProgram("Connection was forcibly closed by server. Ensure the server is running.", type(e).__name__)
-        if(not data):
-            self.stopProgram("Not message received from server, server may have been disconnected.")
-        self.packet.createPacketFromString(data)
-        print("Response from server: " + str(self.packet.getContents()) + "\n")
-        self.packet.emptyPacket()
-
-
-    #Prints a list of available commands for the client.
-    #[*] Parameters: None
-    #[*] Returns:None
-    def printCommands(self) -> None:
-        print("\n============")
-        for command in self.commandsList:
-            print(command + ": " + self.commandsList[command])
-        print("============\n")
-
-
-    #Takes a user input and creates packet, and transmits the packet to the server.
-    #[*] Parameters: None
-    #[*] Returns:None
-    def getCity(self):
-        country = input(" -> Enter a country: ")
-        self.packet.createNewPacket("c",country)
-        self.transmitMessage()
-
-
-    #Takes a user input and creates packet, and transmits the packet to the server.
-    #[*] Parameters: None
-    #[*] Returns:None
-    def getPopulation(self):
-        country = input(" -> Enter a country: ")
-        self.packet.createNewPacket("p",country)
-        self.transmitMessage()
-
-
-    #Takes a user input and creates packet, and transmits the packet to the server.
-    #[*] Parameters: None
-    #[*] Returns:None
-    def addNewEntry(self) -> None:
-        country = input(" -> Enter a country: ")
-        city = input(f" -> Enter {country}'s capital city: ")
-        pair = ",".join([country,city])
-        self.packet.createNewPacket("a",pair)
-        self.transmitMessage()
-
-
-    #Basic heartbeat function. It sends a simple message to the server to verify connection.
-    #[*] Parameters: None
-    #[*] Returns:None
-    def heartbeat(self) -> None:
-        self.packet.createNewPacket("h","")
-        self.transmitMessage()
-
-
-    #This function stops the server and closes the connection. It also prints a shutdown message and exits the program.
-    #[*] Parameters:
-    #   -> message (str): A custom message to be printed when the server is shut down. Default is "Program terminated."
-    #   -> *error (str): Variable length argument list to capture any error messages. This argument is not used in the function's logic.
-    #[*] Returns:
-    #   -> None: This function does not return any value. It closes the server connection, prints a shutdown message, and exits the program.
-    def stopProgram(self, message="Program terminated.", *error:str) -> None:
-        if(error):
-            sys.exit(f"[!] {error[0]} detected: {message}")
-        else:
-            sys.exit(f"[!] {message}")
-
-c = Client()
-c.run()
\ No newline at end of file
+import json, sys
+from functools import partial
+from connection import Connection, DEFAULT_CODECS, CONNECTION_ERRORS, ServerBusyError, encodeEntry
+from framing import FrameError
+from compression import CODECS
+from argparse import ArgumentParser
+
+
+class Client():
+    #Initialize a Client instance, the interactive front end of a connection from the client library (see connection.py).
+    #[*] Parameters:
+    #   -> address (str): The address of the server. If not provided, defaults to localhost.
+    #   -> port (int): The port number to connect to the server. If not provided, defaults to 6000.
+    #   -> codecs (list | None): Names of the codecs offered to the server, in order of preference. Default is DEFAULT_CODECS.
+    #   -> casefold (bool): Have GET_CITY match country names case-insensitively. Default is False.
+    #[*] Returns: None
+    def __init__(self, address:str = "127.0.0.1", port:int = 6000, codecs:list = None, casefold:bool = False):
+        # Provides descriptions of all of the commands
+        self.commandsList = {"COMMANDS":"Show a list of commands",
+                             "GET_CITY":"Provide a country and receive its capital city",
+                             "GET_CITIES":"Provide a list of countries and receive all of their capital cities in one reply",
+                             "FIND_COUNTRY":"Provide part of a country's name, or a misspelt one, and receive the closest matches",
+                             "GET_POPULATION":"Provide a country and receive its population",
+                             "ADD_NEW_COUNTRY":"Provide a country and its capital city to add to the server's database",
+                             "HEART": "Send a heartbeat to the server to verify connection",
+                             "STATS": "Show the server's request counters, latencies and compression stats",
+                             "EXPORT": "Receive every country and its capital city, as the server streams them",
+                             "STOP": "Stop the program"}
+
+        # Associates inputted commands with their respective functions
+        self.commandsExecution = {"COMMANDS":self.printCommands,
+                                  "GET_CITY":self.getCity,
+                                  "GET_CITIES":self.getCities,
+                                  "FIND_COUNTRY":self.findCountries,
+                                  "GET_POPULATION":self.getPopulation,
+                                  "ADD_NEW_COUNTRY":self.addNewEntry,
+                                  "HEART":self.heartbeat,
+                                  "STATS":self.getStats,
+                                  "EXPORT":self.exportCountries,
+                                  "STOP":self.stopProgram}
+
+        # Associates commands with the server command they send, so that those the server does not advertise are hidden
+        self.serverCommands = {"GET_CITY":"i" if casefold else "c",
+                               "GET_CITIES":"b",
+                               "FIND_COUNTRY":"f",
+                               "GET_POPULATION":"p",
+                               "ADD_NEW_COUNTRY":"a",
+                               "HEART":"h",
+                               "STATS":"s",
+                               "EXPORT":"e"}
+
+        self.address = address
+        self.port = port
+        self.casefold = casefold
+        self.connection = Connection(address, port, codecs if codecs is not None else DEFAULT_CODECS)
+
+
+    #Attempts to establish a socket connection with the server using the provided configuration.
+    #   -> If the connection is refused, it calls the stopProgram method with an appropriate error message.
+    #   -> If the connection is successful, it prints a success message and enters the main client loop.
+    #   -> In the main loop, it prompts the user to enter a command, executes the corresponding function,
+    #      or prints an error message if the command is invalid.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def run(self):
+        # Attempt a socket connection with provided configuration
+        try:
+            self.connection.connect()
+        except ConnectionRefusedError as e:
+            self.stopProgram("Connection refused. Ensure the server is running and port numbers are matching.", type(e).__name__)
+        except OverflowError as e:
+            self.stopProgram("Port number may be too high or too low. Ensure the port number is 0-65535", type(e).__name__)
+        except OSError as e:
+            self.stopProgram("Inputted IP Address is not valid in the current context. Ensure the IP address is correct and try again.", type(e).__name__)
+        except FrameError as e:
+            self.stopProgram("Invalid message received from server.", type(e).__name__)
+        except ServerBusyError as e:
+            self.stopProgram("Server is too busy to accept new connections. Try again later.", type(e).__name__)
+        print("Connection successfully established with server!")
+        print(f"Compression negotiated: {self.connection.codec}")
+        self.applyCapabilities()
+
+        # Main client loop to receive and execute commands
+        self.printCommands()
+        while(True):
+            userInput = input("Enter command: ")
+            self.commandsExecution[userInput.upper()]() if userInput.upper() in self.commandsExecution else print("Invalid command entered")
+
+
+    #Transmits a message to the server over the connection, then prints the server's response.
+    #   -> Handles the connection being closed or reset by the server, and invalid replies.
+    #   -> If the server rejects the request as busy, nothing is done and the user can try again.
+    #[*] Parameters:
+    #   -> command (str): The command of the packet.
+    #   -> contents (str): The contents of the packet.
+    #[*] Returns: None
+    def transmitMessage(self, command:str, contents:str):
+        try:
+            reply = self.connection.request(command, contents)
+        except ServerBusyError:
+            print("Server is busy, try again later.\n")
+            return
+        except ConnectionResetError as e:
+            self.stopProgram("Connection was forcibly closed by server. Ensure the server is running.", type(e).__name__)
+        except FrameError as e:
+            self.stopProgram("Invalid message received from server.", type(e).__name__)
+        except CONNECTION_ERRORS as e:
+            self.stopProgram("Not message received from server, server may have been disconnected.", type(e).__name__)
+        print("Response from server: " + str(reply) + "\n")
+
+
+    #Matches the commands of the client to those the server advertised when the connection opened: commands the server
+    #does not answer are hidden, and commands the client does not know are added under their advertised names, sending
+    #what the user enters as their contents.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def applyCapabilities(self) -> None:
+        capabilities = self.connection.capabilities
+        if(not capabilities): # nothing advertised, so every command is kept
+            return
+        for name, command in self.serverCommands.items():
+            if(not self.connection.supports(command)):
+                del self.commandsList[name], self.commandsExecution[name]
+        known = set(self.serverCommands.values()) | {"c", "i", "n", "?"} # "n" and "?" are sent by the connection itself
+        stop = self.commandsList.pop("STOP"), self.commandsExecution.pop("STOP") # kept last in the list
+        for command, capability in capabilities.items():
+            if(command not in known and capability["name"] not in self.commandsExecution):
+                self.commandsList[capability["name"]] = capability["description"]
+                self.commandsExecution[capability["name"]] = partial(self.sendCommand, command)
+        self.commandsList["STOP"], self.commandsExecution["STOP"] = stop
+
+
+    #Transmits a message to the server over the connection, then prints each frame of the server's response as it arrives,
+    #for responses the server streams.
+    #[*] Parameters:
+    #   -> command (str): The command of the packet.
+    #   -> contents (str): The contents of the packet.
+    #[*] Returns:
+    #   -> int: The number of frames received.
+    def streamMessage(self, command:str, contents:str) -> int:
+        frames = 0
+        print("Response from server:")
+        try:
+            for chunk in self.connection.stream(command, contents):
+                frames += 1
+                print(chunk)
+        except ServerBusyError:
+            print("Server is busy, try again later.\n")
+            return frames
+        except FrameError as e:
+            self.stopProgram("Invalid message received from server.", type(e).__name__)
+        except CONNECTION_ERRORS as e:
+            self.stopProgram("Not message received from server, server may have been disconnected.", type(e).__name__)
+        print()
+        return frames
+
+
+    #Prints a list of available commands for the client.
+    #[*] Parameters: None
+    #[*] Returns:None
+    def printCommands(self) -> None:
+        print("\n============")
+        for command in self.commandsList:
+            print(command + ": " + self.commandsList[command])
+        print("============\n")
+
+
+    #Takes a user input and transmits it to the server as a packet.
+    #[*] Parameters: None
+    #[*] Returns:None
+    def getCity(self):
+        country = input(" -> Enter a country: ")
+        self.transmitMessage("i" if self.casefold else "c", country)
+
+
+    #Takes part of a country's name and sends it to the server as a search.
+    #[*] Parameters: None
+    #[*] Returns:None
+    def findCountries(self):
+        query = input(" -> Enter part of a country's name: ")
+        self.transmitMessage("f", query)
+
+
+    #Takes a comma separated list of countries and sends them to the server as a single batch request.
+    #[*] Parameters: None
+    #[*] Returns:None
+    def getCities(self):
+        countries = input(" -> Enter countries separated by commas: ")
+        self.transmitMessage("b", "\n".join(country.strip() for country in countries.split(",")))
+
+
+    #Takes a user input and transmits it to the server as a packet.
+    #[*] Parameters: None
+    #[*] Returns:None
+    def getPopulation(self):
+        country = input(" -> Enter a country: ")
+        self.transmitMessage("p", country)
+
+
+    #Takes a user input and transmits it to the server as a packet.
+    #[*] Parameters: None
+    #[*] Returns:None
+    def addNewEntry(self) -> None:
+        country = input(" -> Enter a country: ")
+        city = input(f" -> Enter {country}'s capital city: ")
+        try:
+            pair = encodeEntry(country, city)
+        except ValueError as e:
+            print(f"Invalid entry: {e}")
+            return
+        self.transmitMessage("a", pair)
+
+
+    #Basic heartbeat function. It sends a simple message to the server to verify connection.
+    #[*] Parameters: None
+    #[*] Returns:None
+    def heartbeat(self) -> None:
+        self.transmitMessage("h", "")
+
+
+    #Requests every country and its capital city, and prints them as the server streams them.
+    #[*] Parameters: None
+    #[*] Returns:None
+    def exportCountries(self) -> None:
+        frames = self.streamMessage("e", "")
+        print(f"Export received in {frames} frames\n")
+
+
+    #Takes the contents of a request for a command the server advertised but the client does not know, and prints the
+    #server's response.
+    #[*] Parameters:
+    #   -> command (str): The server command.
+    #[*] Returns:None
+    def sendCommand(self, command:str) -> None:
+        contents = input(" -> Enter the contents of the request (blank for none): ")
+        self.streamMessage(command, contents)
+
+
+    #Requests the server's metrics and prints them.
+    #[*] Parameters: None
+    #[*] Returns:None
+    def getStats(self) -> None:
+        try:
+            stats = json.dumps(json.loads(self.connection.request("s")), indent=2)
+        except ServerBusyError:
+            print("Server is busy, try again later.\n")
+            return
+        except CONNECTION_ERRORS as e:
+            self.stopProgram("Not message received from server, server may have been disconnected.", type(e).__name__)
+        print("Server stats:\n" + stats + "\n")
+
+
+    #This function stops the server and closes the connection. It also prints a shutdown message and exits the program.
+    #[*] Parameters:
+    #   -> message (str): A custom message to be printed when the server is shut down. Default is "Program terminated."
+    #   -> *error (str): Variable length argument list to capture any error messages. This argument is not used in the function's logic.
+    #[*] Returns:
+    #   -> None: This function does not return any value. It closes the server connection, prints a shutdown message, and exits the program.
+    def stopProgram(self, message="Program terminated.", *error:str) -> None:
+        self.connection.close()
+        if(error):
+            sys.exit(f"[!] {error[0]} detected: {message}")
+        else:
+            sys.exit(f"[!] {message}")
+
+#Parses the command line arguments and runs the interactive client.
+#[*] Parameters: None
+#[*] Returns: None
+def main():
+    # Configure port settings with arguments, if one is provided. Otherwise, default to 6000.
+    parser = ArgumentParser()
+    parser.add_argument("--port", type=int, default=6000)
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--codecs")
+    parser.add_argument("--casefold", action="store_true")
+    args = parser.parse_args()
+    codecs = None
+    if(args.codecs):
+        codecs = [codec.strip() for codec in str(args.codecs).split(",") if codec.strip() in CODECS]
+    Client(args.address, args.port, codecs, args.casefold).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+# Registry of the commands the server answers, so that new commands can be added without changing its dispatch code
+# Each command is a single character on the wire, with a name and a description that are advertised to clients when they
+# connect. Its handler takes the contents of the request and returns the contents of the reply, and may be:
+#   -> a plain function, run inline, or in an executor if it is marked as blocking (e.g. it waits on file I/O),
+#   -> a coroutine function, awaited,
+#   -> a generator (or async generator) function, whose chunks are streamed as the frames of a multi-frame reply, every
+#      frame but the last flagged FLAG_MORE (see framing.py), so that large replies never have to be built whole.
+
+import asyncio, inspect, json, threading
+from packet import Packet, encodePacket
+from framing import PROTOCOL_VERSION, CAPABILITIES_COMMAND, byteToCommand
+from compression import CompressionPolicy
+
+DONE = object() # marks the end of the items of a generator iterated a step at a time
+
+
+#Awaits the next item of an async generator.
+#[*] Parameters:
+#   -> generator (async generator): The generator.
+#[*] Returns:
+#   -> The item, or DONE once the generator is exhausted.
+async def nextItem(generator):
+    try:
+        return await generator.__anext__()
+    except StopAsyncIteration:
+        return DONE
+
+
+class Command():
+    #Initialises a command.
+    #[*] Parameters:
+    #   -> key (str): The command character sent on the wire.
+    #   -> name (str): The name of the command, e.g. "GET_CITY".
+    #   -> handler (callable): Takes the contents of the request (and the connection's compression policy, for connection
+    #                          commands) and returns the contents of the reply, or yields them in chunks.
+    #   -> description (str): What the command does, for clients. Default is an empty string.
+    #   -> blocking (bool): The handler blocks (e.g. on file I/O), so it is run in an executor rather than on the event loop.
+    #                       Default is False.
+    #   -> connection (bool): The handler changes the state of the connection, so it also receives its compression policy.
+    #                         Default is False.
+    #[*] Returns: None
+    def __init__(self, key:str, name:str, handler, description:str="", blocking:bool=False, connection:bool=False):
+        self.key = key
+        self.name = name
+        self.handler = handler
+        self.description = description
+        self.blocking = blocking
+        self.connection = connection
+        if(inspect.isasyncgenfunction(handler)):
+            self.kind = "async-stream"
+        elif(inspect.iscoroutinefunction(handler)):
+            self.kind = "async"
+        elif(inspect.isgeneratorfunction(handler)):
+            self.kind = "stream"
+        else:
+            self.kind = "sync"
+
+
+    #Runs the handler, whatever its kind, and yields the chunks of its reply: a single one unless it streams.
+    #   -> Blocking handlers, and each chunk of blocking generators, are run in the event loop's default executor.
+    #[*] Parameters:
+    #   -> *arguments: Arguments of the handler.
+    #[*] Returns:
+    #   -> async generator of str: The chunks of the reply.
+    async def results(self, *arguments):
+        loop = asyncio.get_running_loop()
+        if(self.kind == "async-stream"):
+            async for chunk in self.handler(*arguments):
+                yield chunk
+        elif(self.kind == "async"):
+            yield await self.handler(*arguments)
+        elif(self.kind == "stream"):
+            chunks = self.handler(*arguments)
+            while(True):
+                chunk = await loop.run_in_executor(None, next, chunks, DONE) if self.blocking else next(chunks, DONE)
+                if(chunk is DONE):
+                    break
+                yield chunk
+        elif(self.blocking):
+            yield await loop.run_in_executor(None, self.handler, *arguments)
+        else:
+            yield self.handler(*arguments)
+
+
+    #Describes the command for the capabilities advertised to clients.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> dict: Its name, description, and whether its reply is streamed.
+    def describe(self) -> dict:
+        return {"name":self.name, "description":self.description, "streaming":self.isStreaming()}
+
+    def isStreaming(self) -> bool:
+        return self.kind in ("stream", "async-stream")
+
+    def isSync(self) -> bool:
+        return self.kind == "sync"
+
+
+class CommandRegistry():
+    #Initialises an empty registry.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def __init__(self):
+        self.commands = dict() # command character -> Command
+        self.advertisement = None # encoded capabilities frame, built when first needed
+
+
+    #Adds a command.
+    #[*] Parameters:
+    #   -> key (str): The command character sent on the wire.
+    #   -> name (str): The name of the command, e.g. "GET_CITY".
+    #   -> handler (callable): The handler (see Command).
+    #   -> description (str): What the command does, for clients. Default is an empty string.
+    #   -> blocking (bool): Run the handler in an executor rather than on the event loop. Default is False.
+    #   -> connection (bool): Pass the connection's compression policy to the handler too. Default is False.
+    #[*] Returns:
+    #   -> Command: The command.
+    #[*] Raises:
+    #   -> ValueError: If the key is not a single character that fits the command byte of a frame, or is already registered.
+    def register(self, key:str, name:str, handler, description:str="", blocking:bool=False, connection:bool=False) -> Command:
+        if(len(key) != 1 or not 0 < ord(key) < 256):
+            raise ValueError(f"Command {key!r} must be a single character from \\x01 to \\xff")
+        if(key in self.commands):
+            raise ValueError(f"Command {key!r} is already registered as {self.commands[key].name}")
+        command = self.commands[key] = Command(key, name, handler, description, blocking, connection)
+        self.advertisement = None
+        return command
+
+
+    #Decorator form of register, for handlers defined outside the server.
+    #[*] Parameters:
+    #   -> key (str): The command character sent on the wire.
+    #   -> name (str): The name of the command.
+    #   -> description (str): What the command does, for clients. Default is an empty string.
+    #   -> blocking (bool): Run the handler in an executor rather than on the event loop. Default is False.
+    #   -> connection (bool): Pass the connection's compression policy to the handler too. Default is False.
+    #[*] Returns:
+    #   -> callable: Registers the function it decorates, and returns it unchanged.
+    def command(self, key:str, name:str, description:str="", blocking:bool=False, connection:bool=False):
+        def decorate(handler):
+            self.register(key, name, handler, description, blocking, connection)
+            return handler
+        return decorate
+
+
+    #Removes a command.
+    #[*] Parameters:
+    #   -> key (str): The command character.
+    #[*] Returns: None
+    def unregister(self, key:str):
+        if(self.commands.pop(key, None) is not None):
+            self.advertisement = None
+
+    def get(self, key:str):
+        return self.commands.get(key)
+
+
+    #Describes the commands of the registry, as advertised to clients and returned by the capabilities command.
+    #[*] Parameters:
+    #   -> *externalMessage (tuple): Not used. It is included so that this is also the handler of the capabilities command.
+    #[*] Returns:
+    #   -> str: A JSON object with the protocol version and, by command character, the description of every command.
+    def getCapabilities(self, *externalMessage) -> str:
+        return json.dumps({"protocol":PROTOCOL_VERSION, "commands":{key:command.describe() for key, command in self.commands.items()}})
+
+
+    #Returns the capabilities frame sent to every client when it connects, with the reserved request id 0.
+    #   -> It is compressed with zlib, which every client supports whatever codec it then negotiates, and built once
+    #      until the commands change.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> bytes: The encoded frame.
+    def getAdvertisement(self) -> bytes:
+        advertisement = self.advertisement
+        if(advertisement is None):
+            packet = Packet(byteToCommand(CAPABILITIES_COMMAND), self.getCapabilities())
+            advertisement = self.advertisement = bytes(encodePacket(packet, CompressionPolicy("zlib")))
+        return advertisement
+
+    def __contains__(self, key:str) -> bool:
+        return key in self.commands
+
+    def __iter__(self):
+        return iter(self.commands.values())
+
+
+class BackgroundLoop():
+    #Initialises an event loop run by a thread of its own, to run the commands whose handlers are not plain functions
+    #outside asyncio mode. The thread starts when it is first needed.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loop = None
+
+
+    #Runs a coroutine on the loop and waits for its result.
+    #[*] Parameters:
+    #   -> coroutine (coroutine): The coroutine.
+    #[*] Returns:
+    #   -> The result of the coroutine.
+    def run(self, coroutine):
+        with self.lock:
+            if(self.loop is None):
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name="command-loop", daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+
+    #Iterates an async generator from a thread outside the loop, running each step of it on the loop. The generator is
+    #closed on the loop too, even if the caller stops early.
+    #[*] Parameters:
+    #   -> generator (async generator): The generator.
+    #[*] Returns:
+    #   -> generator: Its items.
+    def iterate(self, generator):
+        try:
+            while(True):
+                item = self.run(nextItem(generator))
+                if(item is DONE):
+                    break
+                yield item
+        finally:
+            self.run(generator.aclose())
+
@@ -0,0 +1,360 @@
+# Compression policy for packet payloads
+# Payloads below a size threshold are sent as they are, since compressing a few bytes costs CPU and usually makes them bigger.
+# Larger payloads are compressed with the selected stdlib codec. The codec used for each frame is stored in the low bits of the
+# frame flags, so the receiving side can always decompress it, whichever codec the sender picked.
+# Two zlib variants target the many tiny country/capital messages, which plain zlib can barely compress on their own:
+#   -> zdict: each message is compressed against a preset dictionary built from the countries file
+#   -> zstream: each connection keeps a compression stream flushed with Z_SYNC_FLUSH, so history carries over between messages
+# Both use raw deflate (no zlib header or checksum, TCP already checks the data). The dictionary is shared with the peer
+# during negotiation, and zstream is primed with it too when there is one.
+# Decompressed payloads are capped at the same size as frames, so a small frame cannot expand into a huge payload.
+
+import bz2, lzma, threading, zlib
+from framing import FLAG_CODEC_MASK, MAX_PAYLOAD_SIZE, FrameError
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+CODEC_BZ2 = 3
+CODEC_ZDICT = 4
+CODEC_ZSTREAM = 5
+
+CODECS = {"none":CODEC_NONE,
+          "zlib":CODEC_ZLIB,
+          "lzma":CODEC_LZMA,
+          "bz2":CODEC_BZ2,
+          "zdict":CODEC_ZDICT,
+          "zstream":CODEC_ZSTREAM}
+CODEC_NAMES = {codecId:name for name, codecId in CODECS.items()}
+DICTIONARY_CODECS = (CODEC_ZDICT, CODEC_ZSTREAM) # codecs that use the preset dictionary, when there is one
+
+DEFAULT_THRESHOLD = 64 # payloads smaller than this many bytes are not compressed
+DICTIONARY_THRESHOLD = 0 # dictionary and stream codecs shrink even the smallest payloads, so they compress everything by default
+DECOMPRESSION_ERRORS = (zlib.error, lzma.LZMAError, OSError, ValueError) # raised by the codecs for corrupt payloads
+MAX_DICTIONARY_SIZE = 32768 # size of the deflate window, anything before it could never be referenced
+RAW_DEFLATE = -15 # wbits for raw deflate streams
+SYNC_FLUSH_TRAILER = b"\x00\x00\xff\xff" # ends every Z_SYNC_FLUSH block, stripped before sending and added back on receipt
+
+
+#Compresses data with the given codec.
+#[*] Parameters:
+#   -> codec (int): The codec to use. Dictionary and stream codecs are handled by CompressionPolicy.
+#   -> data (bytes): The data to compress.
+#   -> level (int | None): The compression level, or None for the codec's default.
+#[*] Returns:
+#   -> bytes: The compressed data.
+def compressWith(codec:int, data:bytes, level=None) -> bytes:
+    if(codec == CODEC_ZLIB):
+        return zlib.compress(data, -1 if level is None else level)
+    if(codec == CODEC_LZMA):
+        return lzma.compress(data, format=lzma.FORMAT_ALONE, preset=level) # smaller header than the default .xz format
+    if(codec == CODEC_BZ2):
+        return bz2.compress(data, 9 if level is None else level)
+    return bytes(data)
+
+
+#Decompresses data with a decompressor object, without letting the output grow past MAX_PAYLOAD_SIZE.
+#[*] Parameters:
+#   -> decompressor (zlib.Decompress | lzma.LZMADecompressor | bz2.BZ2Decompressor): The decompressor.
+#   -> data (bytes | memoryview): The compressed data.
+#[*] Returns:
+#   -> bytes: The decompressed data.
+#[*] Raises:
+#   -> FrameError: If the data decompresses to more than MAX_PAYLOAD_SIZE bytes.
+def decompressBounded(decompressor, data) -> bytes:
+    payload = decompressor.decompress(data, MAX_PAYLOAD_SIZE + 1)
+    if(len(payload) > MAX_PAYLOAD_SIZE):
+        raise FrameError(f"Payload decompresses to more than the maximum of {MAX_PAYLOAD_SIZE} bytes")
+    return payload
+
+
+#Decompresses data that was compressed with the given codec.
+#[*] Parameters:
+#   -> codec (int): The codec the data was compressed with. Dictionary and stream codecs are handled by CompressionPolicy.
+#   -> data (bytes | memoryview): The compressed data.
+#[*] Returns:
+#   -> bytes | memoryview: The decompressed data. Uncompressed data is returned as it was given, without a copy.
+#[*] Raises:
+#   -> ValueError: If the codec is unknown, or the compressed data is truncated.
+#   -> FrameError: If the data decompresses to more than MAX_PAYLOAD_SIZE bytes.
+def decompressWith(codec:int, data) -> bytes:
+    if(codec == CODEC_NONE):
+        return data
+    if(codec == CODEC_ZLIB):
+        decompressor = zlib.decompressobj()
+    elif(codec == CODEC_LZMA):
+        decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_ALONE)
+    elif(codec == CODEC_BZ2):
+        decompressor = bz2.BZ2Decompressor()
+    else:
+        raise ValueError(f"Unknown compression codec {codec}")
+    payload = decompressBounded(decompressor, data)
+    if(not decompressor.eof):
+        raise ValueError("Compressed data ended before the end of its stream")
+    return payload
+
+
+#Builds a preset compression dictionary from the entries of the countries file.
+#   -> Only the last 32KB of a dictionary can be referenced, so it is truncated from the front (on a character boundary,
+#      as the dictionary is sent to the peer as text).
+#[*] Parameters:
+#   -> entries (iterable): (country, capital) pairs.
+#[*] Returns:
+#   -> bytes: The dictionary.
+def buildDictionary(entries) -> bytes:
+    dictionary = "".join(f"{country}\n{capital}\n" for country, capital in entries).encode("utf-8")
+    return dictionary[-MAX_DICTIONARY_SIZE:].decode("utf-8", "ignore").encode("utf-8")
+
+
+class CompressionStats():
+    #Initialises a set of counters recording how much each message was compressed.
+    #[*] Parameters:
+    #   -> parent (CompressionStats | None): Stats that are also updated with every recorded message, to aggregate
+    #                                        the stats of many connections. Default is None.
+    #[*] Returns: None
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.lock = threading.Lock() # parents are shared between connection threads
+        self.messages = 0
+        self.rawBytes = 0
+        self.wireBytes = 0
+        self.lastRatio = 1.0
+        self.codecs = dict() # codec name -> [messages, rawBytes, wireBytes]
+
+
+    #Records the sizes of one message before and after compression.
+    #[*] Parameters:
+    #   -> codec (int): The codec the message was sent with.
+    #   -> rawBytes (int): Size of the payload before compression.
+    #   -> wireBytes (int): Size of the payload as sent.
+    #[*] Returns: None
+    def record(self, codec:int, rawBytes:int, wireBytes:int):
+        with self.lock:
+            self.messages += 1
+            self.rawBytes += rawBytes
+            self.wireBytes += wireBytes
+            self.lastRatio = wireBytes / rawBytes if rawBytes else 1.0
+            counters = self.codecs.setdefault(CODEC_NAMES[codec], [0, 0, 0])
+            counters[0] += 1
+            counters[1] += rawBytes
+            counters[2] += wireBytes
+        if(self.parent is not None):
+            self.parent.record(codec, rawBytes, wireBytes)
+
+
+    #Returns the ratio of bytes sent to bytes before compression over all messages (lower is better).
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> float: The compression ratio, 1.0 if nothing has been recorded.
+    def getRatio(self) -> float:
+        return self.wireBytes / self.rawBytes if self.rawBytes else 1.0
+
+
+    #Returns a snapshot of the counters.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> dict: Overall counters, and the counters of each codec used.
+    def getStats(self) -> dict:
+        with self.lock:
+            return {"messages":self.messages,
+                    "rawBytes":self.rawBytes,
+                    "wireBytes":self.wireBytes,
+                    "ratio":self.getRatio(),
+                    "lastRatio":self.lastRatio,
+                    "codecs":{name:{"messages":counters[0], "rawBytes":counters[1], "wireBytes":counters[2]}
+                              for name, counters in self.codecs.items()}}
+
+
+class CompressionPolicy():
+    #Initialises a compression policy.
+    #[*] Parameters:
+    #   -> codec (str): Name of the codec used to compress outgoing payloads ("zlib", "lzma", "bz2", "zdict", "zstream" or "none").
+    #                   Default is "zlib".
+    #   -> level (int | None): The compression level, or None for the codec's default. Default is None.
+    #   -> threshold (int | None): Payloads smaller than this many bytes are sent uncompressed. Default is None, which uses
+    #                              64 bytes, or 0 for the dictionary and stream codecs.
+    #   -> dictionary (bytes | None): Preset dictionary for the zdict and zstream codecs. Default is None.
+    #   -> stats (CompressionStats | None): Counters updated with every outgoing message. Default is new counters.
+    #   -> receivedStats (CompressionStats | None): Counters updated with every incoming message. Default is new counters.
+    #[*] Returns: None
+    #[*] Raises:
+    #   -> ValueError: If the codec is unknown.
+    def __init__(self, codec:str="zlib", level=None, threshold=None, dictionary:bytes=None, stats:CompressionStats=None,
+                 receivedStats:CompressionStats=None):
+        if(codec not in CODECS):
+            raise ValueError(f"Unknown compression codec {codec}")
+        self.codec = CODECS[codec]
+        self.preferredCodec = self.codec # codec kept during negotiation if the peer offers it
+        self.level = level
+        self.threshold = threshold
+        self.dictionary = dictionary
+        self.stats = stats if stats is not None else CompressionStats()
+        self.receivedStats = receivedStats if receivedStats is not None else CompressionStats()
+        self.nextCodec = None # codec switched to once the reply to a negotiation has been compressed
+        self.compressor = None # zstream state, created on first use
+        self.decompressor = None
+
+
+    #Creates a copy of the policy, so that each connection can negotiate its own codec and keep its own stream state.
+    #   -> The copy gets its own stats (outgoing and incoming), which also update the stats of this policy.
+    #   -> A peer can only use the dictionary and stream codecs once they have been negotiated, so until then the copy uses zlib.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> CompressionPolicy: The copy.
+    def copy(self):
+        policy = CompressionPolicy(CODEC_NAMES[self.preferredCodec], self.level, self.threshold, self.dictionary, CompressionStats(self.stats),
+                                   CompressionStats(self.receivedStats))
+        if(policy.codec in DICTIONARY_CODECS):
+            policy.codec = CODEC_ZLIB
+        return policy
+
+
+    def getCodecName(self) -> str:
+        return CODEC_NAMES[self.codec]
+
+    def setCodec(self, codec:str):
+        self.codec = CODECS[codec]
+
+    def getDictionary(self) -> bytes:
+        return self.dictionary
+
+    def setDictionary(self, dictionary:bytes):
+        self.dictionary = dictionary
+
+    def getStats(self) -> CompressionStats:
+        return self.stats
+
+    def getReceivedStats(self) -> CompressionStats:
+        return self.receivedStats
+
+
+    #Checks whether payloads are compressed the same way whenever they are sent, so that their encoded frames can be reused.
+    #   -> Not the case for zstream, whose output depends on everything sent before, or while a negotiated codec is pending.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> bool: True if the output of compress only depends on the payload.
+    def isStateless(self) -> bool:
+        return self.codec != CODEC_ZSTREAM and self.nextCodec is None
+
+
+    #Returns the size below which payloads are sent uncompressed, for the current codec.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> int: The threshold in bytes.
+    def getThreshold(self) -> int:
+        if(self.threshold is not None):
+            return self.threshold
+        return DICTIONARY_THRESHOLD if self.codec in DICTIONARY_CODECS else DEFAULT_THRESHOLD
+
+
+    #Compresses an outgoing payload according to the policy, and records how much it was compressed.
+    #   -> Payloads below the threshold, and payloads a stateless codec would not make smaller, are sent uncompressed.
+    #   -> A codec chosen by negotiate() takes over after this payload, so the reply to the negotiation uses the old codec.
+    #[*] Parameters:
+    #   -> data (bytes): The payload to compress.
+    #[*] Returns:
+    #   -> tuple: (flags (int), payload (bytes)) where flags holds the codec actually used.
+    def compress(self, data:bytes) -> tuple:
+        codec, payload = CODEC_NONE, data
+        if(self.codec != CODEC_NONE and len(data) >= self.getThreshold()):
+            if(self.codec == CODEC_ZSTREAM):
+                codec, payload = CODEC_ZSTREAM, self.compressStream(data) # the peer's stream must see it, even if it did not shrink
+            else:
+                compressed = self.compressDictionary(data) if self.codec == CODEC_ZDICT else compressWith(self.codec, data, self.level)
+                if(len(compressed) < len(data)):
+                    codec, payload = self.codec, compressed
+        if(self.nextCodec is not None):
+            self.codec, self.nextCodec = self.nextCodec, None
+        self.stats.record(codec, len(data), len(payload))
+        return codec, payload
+
+
+    #Decompresses an incoming payload using the codec recorded in its frame flags, and records how much it was compressed.
+    #[*] Parameters:
+    #   -> flags (int): The flags of the frame.
+    #   -> data (bytes | memoryview): The payload.
+    #[*] Returns:
+    #   -> bytes | memoryview: The decompressed payload. Uncompressed payloads are returned as they were given.
+    #[*] Raises:
+    #   -> One of DECOMPRESSION_ERRORS: If the payload is corrupt.
+    #   -> FrameError: If the payload decompresses to more than MAX_PAYLOAD_SIZE bytes.
+    def decompress(self, flags:int, data) -> bytes:
+        codec = flags & FLAG_CODEC_MASK
+        if(codec == CODEC_ZSTREAM):
+            payload = self.decompressStream(data)
+        elif(codec == CODEC_ZDICT):
+            payload = decompressBounded(self.newDecompressor(), data)
+        else:
+            payload = decompressWith(codec, data)
+        self.receivedStats.record(codec, len(payload), len(data))
+        return payload
+
+
+    #Compresses a payload on its own against the preset dictionary.
+    #[*] Parameters:
+    #   -> data (bytes): The payload to compress.
+    #[*] Returns:
+    #   -> bytes: The compressed payload.
+    def compressDictionary(self, data:bytes) -> bytes:
+        compressor = self.newCompressor()
+        return compressor.compress(data) + compressor.flush()
+
+
+    #Compresses a payload with the connection's compression stream, keeping the history for the next payload.
+    #[*] Parameters:
+    #   -> data (bytes): The payload to compress.
+    #[*] Returns:
+    #   -> bytes: The compressed payload, without the sync flush trailer.
+    def compressStream(self, data:bytes) -> bytes:
+        if(self.compressor is None):
+            self.compressor = self.newCompressor()
+        return (self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH))[:-len(SYNC_FLUSH_TRAILER)]
+
+
+    #Decompresses a payload with the connection's decompression stream. Payloads must arrive in the order they were sent.
+    #[*] Parameters:
+    #   -> data (bytes | memoryview): The compressed payload, without the sync flush trailer.
+    #[*] Returns:
+    #   -> bytes: The decompressed payload.
+    def decompressStream(self, data) -> bytes:
+        if(self.decompressor is None):
+            self.decompressor = self.newDecompressor()
+        return decompressBounded(self.decompressor, bytes(data) + SYNC_FLUSH_TRAILER)
+
+
+    #Creates a raw deflate compressor, primed with the preset dictionary if there is one.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> zlib.Compress: The compressor.
+    def newCompressor(self):
+        level = -1 if self.level is None else self.level
+        if(self.dictionary):
+            return zlib.compressobj(level, zlib.DEFLATED, RAW_DEFLATE, zdict=self.dictionary)
+        return zlib.compressobj(level, zlib.DEFLATED, RAW_DEFLATE)
+
+
+    #Creates a raw deflate decompressor, primed with the preset dictionary if there is one.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> zlib.Decompress: The decompressor.
+    def newDecompressor(self):
+        if(self.dictionary):
+            return zlib.decompressobj(RAW_DEFLATE, zdict=self.dictionary)
+        return zlib.decompressobj(RAW_DEFLATE)
+
+
+    #Picks the codec to use with a peer from the codecs it offered. The policy switches to it after compressing the next
+    #outgoing payload, which is the reply to the negotiation, so the peer can always read that reply.
+    #   -> The policy's configured codec is kept if the peer offered it. Otherwise the peer's first supported choice is used.
+    #   -> The zdict codec is only supported when the policy has a dictionary to share with the peer.
+    #[*] Parameters:
+    #   -> offered (list): Names of the codecs the peer supports, in its order of preference.
+    #[*] Returns:
+    #   -> str: Name of the codec chosen.
+    def negotiate(self, offered:list) -> str:
+        supported = [codec for codec in offered if codec in CODECS and (codec != "zdict" or self.dictionary)]
+        codec = CODEC_NAMES[self.preferredCodec]
+        if(codec not in supported):
+            codec = supported[0] if supported else "none"
+        self.nextCodec = CODECS[codec]
+        return codec
@@ -0,0 +1,973 @@
+# Client library for the country capitals server, for calling it from other programs rather than through the interactive client
+# Connection speaks the framed protocol over a single socket: it negotiates compression when it connects, then sends
+# requests one at a time or pipelined. ConnectionPool keeps a bounded set of connections that threads borrow for each call,
+# reconnects with exponential backoff when the server goes away, and exposes the server's commands as plain method calls.
+# AsyncConnection and AsyncConnectionPool are their asyncio equivalents.
+# The server pings connections that have been silent for a while, and closes those that do not answer. Connections answer
+# pings as they read their replies, and in the background while they sit idle: from a shared responder thread, or from
+# the task that reads every frame of an AsyncConnection.
+# Requests the server rejects because it is overloaded or the client is over its rate limits raise ServerBusyError, and the
+# pools send them again after a backoff delay.
+# The server advertises its commands when a connection opens (see commands.py), which connections keep as their
+# capabilities. Replies that the server streams over several frames are joined by request, or yielded frame by frame by stream.
+
+import asyncio, json, queue, random, socket, threading, time, weakref
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from packet import Packet, encodeInto, encodePacket, decodeFrom
+from framing import FrameReader, FrameError, HEADER, FLAG_BUSY, FLAG_MORE, PONG_FRAME, isPing, isCapabilities, nextRequestId, unpackHeader
+from compression import CompressionPolicy, CODECS, DECOMPRESSION_ERRORS
+
+DEFAULT_CODECS = ["zlib", "zdict", "zstream", "lzma", "bz2", "none"] # codecs offered to the server, in order of preference
+NOT_FOUND_REPLIES = ("No country found.", "No country found") # replies of the lookup commands for unknown countries
+EXISTS_REPLY = "Country already exists"
+RETRYABLE_COMMANDS = frozenset("cpbhsife?") # commands that are safe to send again when a connection fails mid-request
+CONNECTION_ERRORS = (OSError, EOFError, FrameError) # errors after which a connection is discarded (socket timeouts are OSErrors)
+RESPONDER_INTERVAL = 1.0 # seconds between checks of the idle connections for pings
+
+
+class ServerBusyError(Exception):
+    #Initialises the error of requests that the server rejected without carrying them out, as it is overloaded or the
+    #client is over its rate limits. The connection is still usable, unless the server turned it away when it was opened.
+    #[*] Parameters:
+    #   -> replies (list): The contents of the reply to each request, None for the rejected ones.
+    #[*] Returns: None
+    def __init__(self, replies:list):
+        super().__init__(f"Server busy: {replies.count(None)} of {len(replies)} requests rejected, retry later")
+        self.replies = replies
+
+
+#Turns the reply packets of pipelined requests into their contents.
+#[*] Parameters:
+#   -> packets (list): The reply packets, in the same order as the requests.
+#[*] Returns:
+#   -> list: The contents of each reply.
+#[*] Raises:
+#   -> ServerBusyError: If the server rejected any of the requests, with the contents of the others.
+def unpackReplies(packets:list) -> list:
+    replies = [None if packet.getFlags() & FLAG_BUSY else packet.getContents() for packet in packets]
+    if(None in replies):
+        raise ServerBusyError(replies)
+    return replies
+
+
+#Fills in the replies of a pipeline after an attempt at sending its requests that had no reply yet.
+#[*] Parameters:
+#   -> replies (list): The contents of the reply to each request of the pipeline, None for those without one yet. Updated in place.
+#   -> pending (list): Indexes of the requests sent in the attempt.
+#   -> results (list): The contents of their replies, None for the rejected ones.
+#[*] Returns:
+#   -> list: Indexes of the requests still without a reply.
+def mergeReplies(replies:list, pending:list, results:list) -> list:
+    for index, reply in zip(pending, results):
+        replies[index] = reply
+    return [index for index in pending if replies[index] is None]
+
+
+#Joins the frames of a streamed reply into a single reply, their contents separated by newlines.
+#[*] Parameters:
+#   -> chunks (list): The contents of the frames flagged FLAG_MORE, in order.
+#   -> packet (Packet): The last frame of the reply.
+#[*] Returns:
+#   -> Packet: The whole reply.
+def joinChunks(chunks:list, packet:Packet) -> Packet:
+    chunks.append(packet.getContents())
+    return Packet(packet.getCommand(), "\n".join(chunks), packet.getRequestId(), packet.getFlags())
+
+
+#Turns the reply to a capital city lookup into its result.
+#[*] Parameters:
+#   -> reply (str): The reply of the server.
+#[*] Returns:
+#   -> str | None: The capital city, or None if the country was not found.
+def parseCity(reply:str):
+    return None if reply in NOT_FOUND_REPLIES else reply
+
+
+#Turns the reply to a search into its matches.
+#[*] Parameters:
+#   -> reply (str): The reply of the server.
+#[*] Returns:
+#   -> list: (country, capital) of each match, best first.
+def parseMatches(reply:str) -> list:
+    if(reply in NOT_FOUND_REPLIES):
+        return list()
+    return [tuple(line.rsplit(",", 1)) for line in reply.split("\n")]
+
+
+#Turns the reply to a population lookup into its result.
+#[*] Parameters:
+#   -> reply (str): The reply of the server.
+#[*] Returns:
+#   -> int | None: The population, or None if the country was not found.
+def parsePopulation(reply:str):
+    return None if reply in NOT_FOUND_REPLIES else int(reply)
+
+
+#Encodes a new country and capital city as the contents of an add request.
+#[*] Parameters:
+#   -> country (str): The country to add.
+#   -> city (str): Its capital city.
+#[*] Returns:
+#   -> str: The contents of the request.
+#[*] Raises:
+#   -> ValueError: If either name contains a comma, which separates them in the request.
+def encodeEntry(country:str, city:str) -> str:
+    if("," in country or "," in city):
+        raise ValueError("Country and city names cannot contain commas")
+    return ",".join([country, city])
+
+
+#Works out how long to wait before the next attempt of a failed call: exponential backoff with full jitter,
+#so that many clients losing the server at once do not all reconnect at the same moment.
+#[*] Parameters:
+#   -> attempt (int): Number of attempts that have failed so far, from 1.
+#   -> backoff (float): Delay limit after the first failure, in seconds.
+#   -> maxBackoff (float): Upper bound of the delay limit, in seconds.
+#[*] Returns:
+#   -> float: Seconds to wait.
+def backoffDelay(attempt:int, backoff:float, maxBackoff:float) -> float:
+    return random.uniform(0, min(maxBackoff, backoff * 2 ** (attempt - 1)))
+
+
+class PingResponder():
+    #Initialises the responder that answers the pings of idle connections. Its thread starts with the first connection.
+    #   -> Connections are held weakly, so a connection that is dropped without being closed is not kept open by it.
+    #[*] Parameters:
+    #   -> interval (float): Seconds between checks of the connections. Default is 1 second.
+    #[*] Returns: None
+    def __init__(self, interval:float=RESPONDER_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.connections = weakref.WeakSet()
+        self.thread = None
+
+
+    #Starts answering the pings of a connection while it is idle.
+    #[*] Parameters:
+    #   -> connection (Connection): The connection.
+    #[*] Returns: None
+    def watch(self, connection):
+        with self.lock:
+            self.connections.add(connection)
+            if(self.thread is None or not self.thread.is_alive()): # not started yet, or lost in a fork
+                self.thread = threading.Thread(target=self.run, name="ping-responder", daemon=True)
+                self.thread.start()
+
+    def unwatch(self, connection):
+        with self.lock:
+            self.connections.discard(connection)
+
+
+    #Checks every watched connection for pings at each interval, for as long as the program runs.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def run(self):
+        while(True):
+            time.sleep(self.interval)
+            with self.lock:
+                connections = list(self.connections)
+            for connection in connections:
+                connection.answerPings()
+
+
+RESPONDER = PingResponder() # shared by every Connection
+
+
+class Connection():
+    #Initialises a connection to the server. It is not opened until connect is called.
+    #[*] Parameters:
+    #   -> address (str): Address of the server. Default is "127.0.0.1".
+    #   -> port (int): Port of the server. Default is 6000.
+    #   -> codecs (list | None): Names of the codecs offered to the server, in order of preference. Default is DEFAULT_CODECS.
+    #   -> timeout (float | None): Seconds to wait for the server before giving up on a connect, send or reply. Default is None (forever).
+    #[*] Returns: None
+    def __init__(self, address:str="127.0.0.1", port:int=6000, codecs:list=None, timeout:float=None):
+        self.address = address
+        self.port = port
+        self.codecs = [codec for codec in (codecs if codecs is not None else DEFAULT_CODECS) if codec in CODECS]
+        self.timeout = timeout
+        self.socket = None
+        self.reader = FrameReader() # reassembles reply frames from the stream
+        self.requestId = 0 # id of the last request sent, used to match replies to requests
+        self.policy = CompressionPolicy(self.codecs[0] if self.codecs else "none") # compresses and decompresses the packets of the connection
+        self.codec = None # codec chosen by the server
+        self.lock = threading.Lock() # held while a request is in progress, so that the ping responder keeps off the socket
+        self.capabilities = dict() # command -> {"name", "description", "streaming"}, as advertised by the server
+        self.received = deque() # packets the ping responder read while the connection sat idle, for receiveReply
+
+
+    #Opens the connection and negotiates the compression codec with the server.
+    #[*] Parameters: None
+    #[*] Returns: None
+    #[*] Raises:
+    #   -> OSError: If the server cannot be reached (e.g. ConnectionRefusedError), or the address or port is invalid.
+    #   -> FrameError: If the server does not reply with a valid frame.
+    #   -> ServerBusyError: If the server turned the connection away, as it is at its connection limit.
+    def connect(self):
+        self.socket = socket.create_connection((self.address, self.port), timeout=self.timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # requests are small and latency bound
+        try:
+            self.negotiateCompression()
+        except (*CONNECTION_ERRORS, ServerBusyError):
+            self.close()
+            raise
+        RESPONDER.watch(self)
+
+
+    #Negotiates the compression codec with the server by offering the codecs this connection supports,
+    #then switches the compression policy to the codec chosen by the server, and to its preset dictionary if it sent one.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def negotiateCompression(self):
+        codec, _, dictionary = self.pipeline([("n", ",".join(self.codecs))])[0].partition("\n")
+        if(codec in CODECS):
+            self.policy.setCodec(codec)
+            self.policy.setDictionary(dictionary.encode("utf-8") if dictionary else None)
+        self.codec = codec
+
+
+    #Records the commands the server advertised when the connection opened.
+    #[*] Parameters:
+    #   -> frame (bytes | memoryview): The capabilities frame.
+    #[*] Returns: None
+    def recordCapabilities(self, frame):
+        self.capabilities = json.loads(decodeFrom(frame, self.policy).getContents())["commands"]
+
+    def supports(self, command:str) -> bool:
+        return command in self.capabilities
+
+
+    #Sends a request and waits for its reply.
+    #[*] Parameters:
+    #   -> command (str): The command of the request.
+    #   -> contents (str): The contents of the request. Default is an empty string.
+    #[*] Returns:
+    #   -> str: The contents of the reply.
+    def request(self, command:str, contents:str="") -> str:
+        return self.pipeline([(command, contents)])[0]
+
+
+    #Sends several requests to the server without waiting for each reply, then collects all of the replies.
+    #   -> Every request is tagged with its own request id, and replies are matched to requests by id,
+    #      so the whole list costs a single round trip.
+    #   -> Streamed replies are collected whole, the contents of their frames joined by newlines.
+    #[*] Parameters:
+    #   -> requests (list): (command, contents) pairs to send.
+    #[*] Returns:
+    #   -> list: The contents of each reply, in the same order as the requests.
+    #[*] Raises:
+    #   -> ConnectionError: If the server closes the connection before replying.
+    #   -> OSError: If the connection fails or times out.
+    #   -> FrameError: If the server sends an invalid frame.
+    #   -> ServerBusyError: If the server rejected any of the requests, or turned the connection away.
+    def pipeline(self, requests:list) -> list:
+        with self.lock:
+            requestIds = list()
+            frames = bytearray()
+            end = 0
+            for command, contents in requests:
+                self.requestId = nextRequestId(self.requestId)
+                end = encodeInto(Packet(command, contents, self.requestId), frames, end, self.policy)
+                requestIds.append(self.requestId)
+            self.socket.sendall(frames)
+            replies = dict()
+            chunks = dict() # request id -> contents of the frames of its streamed reply so far
+            while(len(replies) < len(requestIds)):
+                packet = self.receiveReply()
+                if(packet.getRequestId() == 0 and packet.getFlags() & FLAG_BUSY): # turned away, and closed by the server
+                    raise ServerBusyError([None] * len(requestIds))
+                if(packet.getRequestId() not in requestIds): # a late reply to an earlier request
+                    continue
+                if(packet.getFlags() & FLAG_MORE):
+                    chunks.setdefault(packet.getRequestId(), list()).append(packet.getContents())
+                    continue
+                if(packet.getRequestId() in chunks):
+                    packet = joinChunks(chunks.pop(packet.getRequestId()), packet)
+                replies[packet.getRequestId()] = packet
+            return unpackReplies([replies[requestId] for requestId in requestIds])
+
+
+    #Sends a request and yields the contents of each frame of its reply as it arrives, for replies the server streams.
+    #   -> The connection is held until the whole reply has been read. If the caller stops early, the rest of the reply is
+    #      read and dropped when the generator is closed, so that the connection stays in step.
+    #[*] Parameters:
+    #   -> command (str): The command of the request.
+    #   -> contents (str): The contents of the request. Default is an empty string.
+    #[*] Returns:
+    #   -> generator of str: The contents of each frame of the reply. A reply that is not streamed is a single frame.
+    #[*] Raises:
+    #   -> ConnectionError | OSError | FrameError: As pipeline.
+    #   -> ServerBusyError: If the server rejected the request.
+    def stream(self, command:str, contents:str=""):
+        with self.lock:
+            self.requestId = nextRequestId(self.requestId)
+            requestId = self.requestId
+            self.socket.sendall(encodePacket(Packet(command, contents, requestId), self.policy))
+            more = True
+            try:
+                while(more):
+                    packet = self.receiveReply()
+                    if(packet.getFlags() & FLAG_BUSY and packet.getRequestId() in (0, requestId)):
+                        raise ServerBusyError([None])
+                    if(packet.getRequestId() != requestId):
+                        continue
+                    more = packet.getFlags() & FLAG_MORE
+                    yield packet.getContents()
+            except GeneratorExit:
+                while(more):
+                    packet = self.receiveReply()
+                    more = packet.getRequestId() != requestId or packet.getFlags() & FLAG_MORE
+                raise
+
+
+    #Receives the next reply from the server. Data is read until a complete reply frame has arrived, however TCP splits it.
+    #   -> Keepalive pings that arrive meanwhile are answered, and the capabilities the server advertises are recorded.
+    #   -> Replies the ping responder read while the connection sat idle come first.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> Packet: The reply.
+    def receiveReply(self) -> Packet:
+        if(self.received):
+            return self.received.popleft()
+        while(True):
+            frame = next(self.reader.frames(), None)
+            while(frame is None):
+                if(not self.reader.recvFrom(self.socket)):
+                    raise ConnectionError("Connection closed by server")
+                frame = next(self.reader.frames(), None)
+            if(isPing(frame)):
+                self.socket.sendall(PONG_FRAME)
+            elif(isCapabilities(frame)):
+                self.recordCapabilities(frame)
+            else:
+                return decodeFrom(frame, self.policy)
+
+
+    #Answers, without blocking, the keepalive pings the server has sent while the connection sat idle. Called by the ping
+    #responder; a connection in use answers pings itself as it reads its replies.
+    #   -> Any other frame (e.g. a late reply) is decoded as it arrives, which keeps the zstream codec's decompressor in
+    #      step with the server, and kept for receiveReply. A frame that cannot be decoded shuts the connection down, as
+    #      the stream can no longer be followed, so that isAlive reports it closed.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def answerPings(self):
+        if(not self.lock.acquire(blocking=False)):
+            return
+        sock = self.socket
+        try:
+            if(sock is None):
+                return
+            sock.setblocking(False)
+            try:
+                received = self.reader.recvFrom(sock)
+            except BlockingIOError: # nothing sent
+                return
+            finally:
+                sock.settimeout(self.timeout)
+            if(not received): # closed by the server, which isAlive finds out before the connection is used again
+                RESPONDER.unwatch(self)
+                return
+            for frame in self.reader.frames():
+                if(isPing(frame)):
+                    sock.sendall(PONG_FRAME)
+                elif(isCapabilities(frame)):
+                    self.recordCapabilities(frame)
+                else:
+                    self.received.append(decodeFrom(frame, self.policy))
+        except CONNECTION_ERRORS:
+            RESPONDER.unwatch(self)
+        except DECOMPRESSION_ERRORS:
+            RESPONDER.unwatch(self)
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        finally:
+            self.lock.release()
+
+
+    #Checks, without blocking, whether the connection is still open, so that a pool does not hand out a connection
+    #the server has closed while it sat idle.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> bool: False if the server has closed the connection or it failed.
+    def isAlive(self) -> bool:
+        if(self.socket is None):
+            return False
+        self.socket.setblocking(False)
+        try:
+            return self.socket.recv(1, socket.MSG_PEEK) != b""
+        except BlockingIOError: # nothing to read, as expected of an idle connection
+            return True
+        except OSError:
+            return False
+        finally:
+            self.socket.settimeout(self.timeout)
+
+
+    #Closes the connection.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def close(self):
+        RESPONDER.unwatch(self)
+        self.received.clear()
+        if(self.socket is not None):
+            self.socket.close()
+            self.socket = None
+
+
+class ConnectionPool():
+    #Initialises a pool of connections to the server. Connections are opened when they are first needed.
+    #[*] Parameters:
+    #   -> address (str): Address of the server. Default is "127.0.0.1".
+    #   -> port (int): Port of the server. Default is 6000.
+    #   -> size (int): Maximum number of connections open at once. Default is 8.
+    #   -> codecs (list | None): Names of the codecs offered to the server, in order of preference. Default is DEFAULT_CODECS.
+    #   -> timeout (float | None): Seconds to wait for a free connection, and for the server. Default is 5 seconds.
+    #   -> retries (int): Number of times a call is retried after its connection fails. Default is 3.
+    #   -> backoff (float): Delay limit before the first retry, in seconds, doubled after every failure. Default is 0.05 seconds.
+    #   -> maxBackoff (float): Upper bound of the delay limit, in seconds. Default is 2 seconds.
+    #[*] Returns: None
+    def __init__(self, address:str="127.0.0.1", port:int=6000, size:int=8, codecs:list=None, timeout:float=5.0,
+                 retries:int=3, backoff:float=0.05, maxBackoff:float=2.0):
+        self.address = address
+        self.port = port
+        self.size = size
+        self.codecs = codecs
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.slots = threading.BoundedSemaphore(size) # one per connection that may be open
+        self.idle = queue.LifoQueue() # open connections not in use, most recently used first
+        self.closed = False
+
+
+    #Borrows a connection from the pool for the duration of a with block, opening a new one if none is idle.
+    #   -> A connection whose block raises is closed rather than returned to the pool, as its stream may be out of step,
+    #      unless the error is a ServerBusyError, after which the stream is still in step.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> Connection: The connection, as the target of the with statement.
+    #[*] Raises:
+    #   -> TimeoutError: If no connection became free within the timeout.
+    @contextmanager
+    def connection(self):
+        if(self.closed):
+            raise ConnectionError("Connection pool is closed")
+        if(not self.slots.acquire(timeout=self.timeout)):
+            raise TimeoutError("No connection became free in the pool")
+        connection = None
+        try:
+            connection = self.takeIdle()
+            if(connection is None):
+                connection = Connection(self.address, self.port, self.codecs, self.timeout)
+                connection.connect()
+            busy = None
+            try:
+                yield connection
+            except ServerBusyError as e:
+                busy = e
+            if(not self.closed):
+                self.idle.put(connection)
+                connection = None
+            if(busy is not None):
+                raise busy
+        finally:
+            if(connection is not None):
+                connection.close()
+            self.slots.release()
+
+
+    #Takes the most recently used idle connection that is still open, closing any the server has closed meanwhile.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> Connection | None: The connection, or None if there is none.
+    def takeIdle(self):
+        while(True):
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                return None
+            if(connection.isAlive()):
+                return connection
+            connection.close()
+
+
+    #Sends several requests over one connection of the pool (see Connection.pipeline).
+    #   -> If the connection fails, the requests are sent again over a new connection after a backoff delay, up to retries times.
+    #      Requests that change the server's data (adds) are only sent again if the failure happened while connecting,
+    #      as the server may already have applied them.
+    #   -> Requests the server rejects as busy were not carried out, so they are always sent again after a backoff delay,
+    #      on their own rather than with the requests of the pipeline that got a reply.
+    #[*] Parameters:
+    #   -> requests (list): (command, contents) pairs to send.
+    #[*] Returns:
+    #   -> list: The contents of each reply, in the same order as the requests.
+    #[*] Raises:
+    #   -> OSError | FrameError: The error of the last attempt, once the retries are used up.
+    #   -> ServerBusyError: If requests were still rejected once the retries are used up.
+    def pipeline(self, requests:list) -> list:
+        replies = [None] * len(requests)
+        pending = list(range(len(requests))) # indexes of the requests without a reply yet
+        attempt = 0
+        while(True):
+            sent = False
+            try:
+                with self.connection() as connection:
+                    sent = True
+                    mergeReplies(replies, pending, connection.pipeline([requests[index] for index in pending]))
+                    return replies
+            except ServerBusyError as e:
+                pending = mergeReplies(replies, pending, e.replies if sent else [None] * len(pending))
+                attempt += 1
+                if(attempt > self.retries or self.closed):
+                    raise ServerBusyError(replies) from e
+            except CONNECTION_ERRORS:
+                attempt += 1
+                retryable = all(requests[index][0] in RETRYABLE_COMMANDS for index in pending)
+                if(attempt > self.retries or (sent and not retryable) or self.closed):
+                    raise
+            time.sleep(backoffDelay(attempt, self.backoff, self.maxBackoff))
+
+
+    #Sends a request over a connection of the pool and waits for its reply.
+    #[*] Parameters:
+    #   -> command (str): The command of the request.
+    #   -> contents (str): The contents of the request. Default is an empty string.
+    #[*] Returns:
+    #   -> str: The contents of the reply.
+    def request(self, command:str, contents:str="") -> str:
+        return self.pipeline([(command, contents)])[0]
+
+
+    #Sends a request over a connection of the pool and yields the contents of each frame of its reply as it arrives
+    #(see Connection.stream). The connection is held until the generator is exhausted or closed.
+    #   -> Streams are not retried, as part of the reply may already have been consumed.
+    #[*] Parameters:
+    #   -> command (str): The command of the request.
+    #   -> contents (str): The contents of the request. Default is an empty string.
+    #[*] Returns:
+    #   -> generator of str: The contents of each frame of the reply.
+    def stream(self, command:str, contents:str=""):
+        with self.connection() as connection:
+            yield from connection.stream(command, contents)
+
+
+    #Retrieves the commands the server answers.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> dict: command -> {"name", "description", "streaming"}.
+    def getCapabilities(self) -> dict:
+        return json.loads(self.request("?"))["commands"]
+
+
+    #Exports every country and its capital city, as the server streams them.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> generator of tuple: (country, capital) of each country.
+    def exportCountries(self):
+        for chunk in self.stream("e"):
+            if(chunk):
+                yield from parseMatches(chunk)
+
+
+    #Retrieves the capital city of a country.
+    #[*] Parameters:
+    #   -> country (str): The country to look up.
+    #   -> casefold (bool): Match the name case-insensitively (casefolded, with runs of whitespace collapsed) rather than
+    #                       through str.capitalize. Default is False.
+    #[*] Returns:
+    #   -> str | None: The capital city, or None if the country was not found.
+    def getCity(self, country:str, casefold:bool=False):
+        return parseCity(self.request("i" if casefold else "c", country))
+
+
+    #Finds the countries best matching a partial or misspelt name.
+    #[*] Parameters:
+    #   -> query (str): The partial name.
+    #   -> limit (int | None): Maximum number of matches, at most 100. Default is None, the server's default of 10.
+    #[*] Returns:
+    #   -> list: (country, capital) of each match, best first.
+    def findCountries(self, query:str, limit:int=None) -> list:
+        return parseMatches(self.request("f", query if limit is None else f"{query}\n{limit}"))
+
+
+    #Retrieves the capital cities of several countries with a single batch request.
+    #[*] Parameters:
+    #   -> countries (list): The countries to look up.
+    #[*] Returns:
+    #   -> list: The capital city of each country (None if it was not found), in the same order as the countries.
+    def getCities(self, countries:list) -> list:
+        if(not countries):
+            return list()
+        return [parseCity(reply) for reply in self.request("b", "\n".join(countries)).split("\n")]
+
+
+    #Retrieves the estimated population of a country.
+    #[*] Parameters:
+    #   -> country (str): The country to look up.
+    #[*] Returns:
+    #   -> int | None: The population, or None if the country was not found.
+    def getPopulation(self, country:str):
+        return parsePopulation(self.request("p", country))
+
+
+    #Adds a new country and its capital city to the server's database.
+    #[*] Parameters:
+    #   -> country (str): The country to add.
+    #   -> city (str): Its capital city.
+    #[*] Returns:
+    #   -> bool: True if the country was added, False if it already exists.
+    def addCountry(self, country:str, city:str) -> bool:
+        return self.request("a", encodeEntry(country, city)) != EXISTS_REPLY
+
+
+    #Sends a heartbeat to the server.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> bool: True if the server answered.
+    def heartbeat(self) -> bool:
+        return self.request("h") == "beat"
+
+
+    #Retrieves the server's metrics (see Server.getStats).
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> dict: The stats.
+    def getStats(self) -> dict:
+        return json.loads(self.request("s"))
+
+
+    #Closes the idle connections of the pool. Connections in use are closed when they are returned.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def close(self):
+        self.closed = True
+        while(True):
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+class AsyncConnection(Connection):
+    #Opens the connection and negotiates the compression codec with the server (see Connection.connect).
+    #[*] Parameters: None
+    #[*] Returns: None
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.address, self.port), self.timeout)
+        self.socket = self.writer.get_extra_info("socket")
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.pending = dict() # request id -> future of its reply
+        self.chunks = dict() # request id -> contents of the frames of its streamed reply so far
+        self.streams = dict() # request id -> queue of the frames of its reply, for the requests sent by stream
+        self.listener = asyncio.create_task(self.listen())
+        try:
+            await self.negotiateCompression()
+        except (*CONNECTION_ERRORS, ServerBusyError):
+            self.close()
+            raise
+
+
+    #Negotiates the compression codec with the server (see Connection.negotiateCompression).
+    #[*] Parameters: None
+    #[*] Returns: None
+    async def negotiateCompression(self):
+        codec, _, dictionary = (await self.pipeline([("n", ",".join(self.codecs))]))[0].partition("\n")
+        if(codec in CODECS):
+            self.policy.setCodec(codec)
+            self.policy.setDictionary(dictionary.encode("utf-8") if dictionary else None)
+        self.codec = codec
+
+
+    #Sends a request and waits for its reply.
+    #[*] Parameters:
+    #   -> command (str): The command of the request.
+    #   -> contents (str): The contents of the request. Default is an empty string.
+    #[*] Returns:
+    #   -> str: The contents of the reply.
+    async def request(self, command:str, contents:str="") -> str:
+        return (await self.pipeline([(command, contents)]))[0]
+
+
+    #Sends several requests to the server without waiting for each reply, then collects all of the replies
+    #(see Connection.pipeline). The replies are read by the listener task, which hands each one to its request.
+    #[*] Parameters:
+    #   -> requests (list): (command, contents) pairs to send.
+    #[*] Returns:
+    #   -> list: The contents of each reply, in the same order as the requests.
+    async def pipeline(self, requests:list) -> list:
+        if(self.listener.done()):
+            raise ConnectionError("Connection closed by server")
+        loop = asyncio.get_running_loop()
+        replies = list()
+        frames = bytearray()
+        end = 0
+        for command, contents in requests:
+            self.requestId = nextRequestId(self.requestId)
+            end = encodeInto(Packet(command, contents, self.requestId), frames, end, self.policy)
+            replies.append(loop.create_future())
+            self.pending[self.requestId] = replies[-1]
+        self.writer.write(frames)
+        await asyncio.wait_for(self.writer.drain(), self.timeout)
+        try:
+            packets = await asyncio.wait_for(asyncio.gather(*replies), self.timeout)
+        except ServerBusyError: # turned away, and closed by the server
+            raise ServerBusyError([None] * len(replies))
+        return unpackReplies(packets)
+
+
+    #Sends a request and yields the contents of each frame of its reply as it arrives (see Connection.stream). The listener
+    #task queues the frames of the reply. If the caller stops early, the rest of the reply is dropped as it arrives.
+    #[*] Parameters:
+    #   -> command (str): The command of the request.
+    #   -> contents (str): The contents of the request. Default is an empty string.
+    #[*] Returns:
+    #   -> async generator of str: The contents of each frame of the reply.
+    async def stream(self, command:str, contents:str=""):
+        if(self.listener.done()):
+            raise ConnectionError("Connection closed by server")
+        self.requestId = nextRequestId(self.requestId)
+        requestId = self.requestId
+        frames = self.streams[requestId] = asyncio.Queue()
+        try:
+            self.writer.write(encodePacket(Packet(command, contents, requestId), self.policy))
+            await asyncio.wait_for(self.writer.drain(), self.timeout)
+            more = True
+            while(more):
+                packet = await asyncio.wait_for(frames.get(), self.timeout)
+                if(isinstance(packet, ServerBusyError) or (isinstance(packet, Packet) and packet.getFlags() & FLAG_BUSY)):
+                    raise ServerBusyError([None])
+                if(isinstance(packet, Exception)):
+                    raise packet
+                more = packet.getFlags() & FLAG_MORE
+                yield packet.getContents()
+        finally:
+            self.streams.pop(requestId, None)
+
+
+    #Reads every frame the server sends for as long as the connection is open: replies are handed to the requests waiting
+    #for them, and keepalive pings are answered at once, so that an idle connection keeps answering them.
+    #   -> When the connection fails or closes, the requests still waiting for a reply get the error.
+    #[*] Parameters: None
+    #[*] Returns: None
+    async def listen(self):
+        error = ConnectionError("Connection closed")
+        try:
+            while(True):
+                frame = await self.receiveFrame()
+                if(isPing(frame)):
+                    self.writer.write(PONG_FRAME)
+                    continue
+                if(isCapabilities(frame)):
+                    self.recordCapabilities(frame)
+                    continue
+                packet = decodeFrom(frame, self.policy)
+                requestId = packet.getRequestId()
+                if(requestId == 0 and packet.getFlags() & FLAG_BUSY):
+                    raise ServerBusyError(list())
+                if(requestId in self.streams):
+                    self.streams[requestId].put_nowait(packet)
+                    continue
+                if(requestId not in self.pending):
+                    continue
+                if(packet.getFlags() & FLAG_MORE):
+                    self.chunks.setdefault(requestId, list()).append(packet.getContents())
+                    continue
+                if(requestId in self.chunks):
+                    packet = joinChunks(self.chunks.pop(requestId), packet)
+                reply = self.pending.pop(requestId)
+                if(not reply.done()):
+                    reply.set_result(packet)
+        except Exception as e: # handed to the requests waiting for a reply, which raise it
+            error = e
+        finally:
+            for reply in self.pending.values():
+                if(not reply.done()):
+                    reply.set_exception(error)
+            self.pending.clear()
+            for frames in self.streams.values():
+                frames.put_nowait(error)
+
+
+    #Receives the next frame from the server: its header, then as many bytes as the header says the payload holds.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> bytes: The frame.
+    async def receiveFrame(self) -> bytes:
+        header = await self.reader.readexactly(HEADER.size) # raises IncompleteReadError, an EOFError, if the server closes
+        return header + await self.reader.readexactly(unpackHeader(header)[3])
+
+
+    #Checks whether the server has closed the connection while it was idle.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> bool: False if the server has closed the connection.
+    def isAlive(self) -> bool:
+        return self.socket is not None and not self.listener.done() and not self.writer.is_closing()
+
+
+    #Closes the connection.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def close(self):
+        if(self.socket is not None):
+            self.listener.cancel()
+            self.writer.close()
+            self.socket = None
+
+
+class AsyncConnectionPool(ConnectionPool):
+    #Initialises a pool of asyncio connections to the server (see ConnectionPool). The pool must be used from one event loop.
+    #[*] Returns: None
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.slots = asyncio.Semaphore(self.size)
+        self.idle = list() # open connections not in use, most recently used last
+
+
+    #Borrows a connection from the pool for the duration of an async with block (see ConnectionPool.connection).
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> AsyncConnection: The connection, as the target of the async with statement.
+    @asynccontextmanager
+    async def connection(self):
+        if(self.closed):
+            raise ConnectionError("Connection pool is closed")
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("No connection became free in the pool")
+        connection = None
+        try:
+            connection = self.takeIdle()
+            if(connection is None):
+                connection = AsyncConnection(self.address, self.port, self.codecs, self.timeout)
+                await connection.connect()
+            busy = None
+            try:
+                yield connection
+            except ServerBusyError as e:
+                busy = e
+            if(not self.closed):
+                self.idle.append(connection)
+                connection = None
+            if(busy is not None):
+                raise busy
+        finally:
+            if(connection is not None):
+                connection.close()
+            self.slots.release()
+
+
+    #Takes the most recently used idle connection that is still open, closing any the server has closed meanwhile.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> AsyncConnection | None: The connection, or None if there is none.
+    def takeIdle(self):
+        while(self.idle):
+            connection = self.idle.pop()
+            if(connection.isAlive()):
+                return connection
+            connection.close()
+        return None
+
+
+    #Sends several requests over one connection of the pool, retrying with backoff (see ConnectionPool.pipeline).
+    #[*] Parameters:
+    #   -> requests (list): (command, contents) pairs to send.
+    #[*] Returns:
+    #   -> list: The contents of each reply, in the same order as the requests.
+    async def pipeline(self, requests:list) -> list:
+        replies = [None] * len(requests)
+        pending = list(range(len(requests))) # indexes of the requests without a reply yet
+        attempt = 0
+        while(True):
+            sent = False
+            try:
+                async with self.connection() as connection:
+                    sent = True
+                    mergeReplies(replies, pending, await connection.pipeline([requests[index] for index in pending]))
+                    return replies
+            except ServerBusyError as e:
+                pending = mergeReplies(replies, pending, e.replies if sent else [None] * len(pending))
+                attempt += 1
+                if(attempt > self.retries or self.closed):
+                    raise ServerBusyError(replies) from e
+            except CONNECTION_ERRORS:
+                attempt += 1
+                retryable = all(requests[index][0] in RETRYABLE_COMMANDS for index in pending)
+                if(attempt > self.retries or (sent and not retryable) or self.closed):
+                    raise
+            await asyncio.sleep(backoffDelay(attempt, self.backoff, self.maxBackoff))
+
+    async def request(self, command:str, contents:str="") -> str:
+        return (await self.pipeline([(command, contents)]))[0]
+
+    async def getCity(self, country:str, casefold:bool=False):
+        return parseCity(await self.request("i" if casefold else "c", country))
+
+    async def findCountries(self, query:str, limit:int=None) -> list:
+        return parseMatches(await self.request("f", query if limit is None else f"{query}\n{limit}"))
+
+    async def getCities(self, countries:list) -> list:
+        if(not countries):
+            return list()
+        return [parseCity(reply) for reply in (await self.request("b", "\n".join(countries))).split("\n")]
+
+    async def getPopulation(self, country:str):
+        return parsePopulation(await self.request("p", country))
+
+    async def addCountry(self, country:str, city:str) -> bool:
+        return (await self.request("a", encodeEntry(country, city))) != EXISTS_REPLY
+
+    async def heartbeat(self) -> bool:
+        return (await self.request("h")) == "beat"
+
+    async def getStats(self) -> dict:
+        return json.loads(await self.request("s"))
+
+    async def getCapabilities(self) -> dict:
+        return json.loads(await self.request("?"))["commands"]
+
+
+    #Sends a request over a connection of the pool and yields the contents of each frame of its reply as it arrives
+    #(see ConnectionPool.stream).
+    #[*] Parameters:
+    #   -> command (str): The command of the request.
+    #   -> contents (str): The contents of the request. Default is an empty string.
+    #[*] Returns:
+    #   -> async generator of str: The contents of each frame of the reply.
+    async def stream(self, command:str, contents:str=""):
+        async with self.connection() as connection:
+            async for chunk in connection.stream(command, contents):
+                yield chunk
+
+    async def exportCountries(self):
+        async for chunk in self.stream("e"):
+            if(chunk):
+                for entry in parseMatches(chunk):
+                    yield entry
+
+
+    #Closes the idle connections of the pool. Connections in use are closed when they are returned.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def close(self):
+        self.closed = True
+        while(self.idle):
+            self.idle.pop().close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exception):
+        self.close()
@@ -0,0 +1,206 @@
+# Length-prefixed binary framing for the packets sent between the client and the server
+# Every frame is a fixed size header followed by the payload, so message boundaries no longer depend on how TCP splits or
+# coalesces writes. Header layout (network byte order):
+#   version (1 byte) | command (1 byte) | flags (2 bytes) | request id (4 bytes) | payload length (4 bytes)
+# The request id lets a client send many requests without waiting for each reply: replies carry the id of their request
+
+import struct
+
+PROTOCOL_VERSION = 2
+HEADER = struct.Struct("!BBHII")
+MAX_REQUEST_ID = 0xFFFFFFFF # request id 0 is reserved for messages that are not a reply to a request
+REQUEST_ID = struct.Struct("!I")
+REQUEST_ID_OFFSET = 4 # offset of the request id within the header
+
+# frame flags
+FLAG_CODEC_MASK = 0x000F # codec the payload is compressed with (see compression.py)
+FLAG_BUSY = 0x0010 # reply of a request the server rejected without carrying it out, as it is overloaded or rate limited
+FLAG_MORE = 0x0020 # frame of a streamed reply that more frames of the same reply follow
+MAX_PAYLOAD_SIZE = 16 * 1024 * 1024 # frames larger than this are treated as a protocol error
+
+
+class FrameError(ValueError):
+    pass
+
+
+#Converts a single character command into the command byte of a frame header. An empty command (used by replies) is 0.
+#[*] Parameters:
+#   -> command (str): The command character.
+#[*] Returns:
+#   -> int: The command byte.
+def commandToByte(command:str) -> int:
+    return ord(command) if command else 0
+
+
+#Converts the command byte of a frame header back into its single character command.
+#[*] Parameters:
+#   -> command (int): The command byte.
+#[*] Returns:
+#   -> str: The command character, or an empty string for 0.
+def byteToCommand(command:int) -> str:
+    return chr(command) if command else ""
+
+
+#Packs a frame header.
+#[*] Parameters:
+#   -> command (str): The command character of the frame.
+#   -> flags (int): The frame flags.
+#   -> length (int): The length of the payload that follows the header, in bytes.
+#   -> requestId (int): The id of the request, echoed back in its reply. Default is 0.
+#[*] Returns:
+#   -> bytes: The packed header.
+def packHeader(command:str, flags:int, length:int, requestId:int=0) -> bytes:
+    return HEADER.pack(PROTOCOL_VERSION, commandToByte(command), flags, requestId, length)
+
+
+#Unpacks and validates the frame header at the given offset of a buffer.
+#[*] Parameters:
+#   -> buffer (bytes | bytearray | memoryview): The buffer holding the header.
+#   -> offset (int): Offset of the header in the buffer. Default is 0.
+#[*] Returns:
+#   -> tuple: (command (str), flags (int), requestId (int), length (int))
+#[*] Raises:
+#   -> FrameError: If the protocol version is not supported or the payload is too large.
+def unpackHeader(buffer, offset:int=0) -> tuple:
+    version, command, flags, requestId, length = HEADER.unpack_from(buffer, offset)
+    if(version != PROTOCOL_VERSION):
+        raise FrameError(f"Unsupported protocol version {version}")
+    if(length > MAX_PAYLOAD_SIZE):
+        raise FrameError(f"Frame payload of {length} bytes exceeds the maximum of {MAX_PAYLOAD_SIZE} bytes")
+    return byteToCommand(command), flags, requestId, length
+
+
+#Returns the request id that follows the given one, wrapping around and skipping the reserved id 0.
+#[*] Parameters:
+#   -> requestId (int): The previous request id.
+#[*] Returns:
+#   -> int: The next request id.
+def nextRequestId(requestId:int) -> int:
+    return requestId % MAX_REQUEST_ID + 1
+
+
+#Overwrites the request id in the header of an encoded frame, so that a frame can be reused as the reply to another request.
+#[*] Parameters:
+#   -> buffer (bytearray): The buffer holding the frame.
+#   -> offset (int): Offset of the frame in the buffer.
+#   -> requestId (int): The new request id.
+#[*] Returns: None
+def setRequestId(buffer:bytearray, offset:int, requestId:int):
+    REQUEST_ID.pack_into(buffer, offset + REQUEST_ID_OFFSET, requestId)
+
+
+#Checks whether a frame is a keepalive ping from the server: an "h" frame with the reserved request id 0.
+#[*] Parameters:
+#   -> frame (bytes | memoryview): A complete frame, header included.
+#[*] Returns:
+#   -> bool: True if the frame is a ping, which is answered with PONG_FRAME.
+def isPing(frame) -> bool:
+    return frame[1] == PING_COMMAND and REQUEST_ID.unpack_from(frame, REQUEST_ID_OFFSET)[0] == 0
+
+
+#Checks whether a frame is the server's advertisement of its commands: a "?" frame with the reserved request id 0.
+#[*] Parameters:
+#   -> frame (bytes | memoryview): A complete frame, header included.
+#[*] Returns:
+#   -> bool: True if the frame lists the server's capabilities (see commands.py).
+def isCapabilities(frame) -> bool:
+    return frame[1] == CAPABILITIES_COMMAND and REQUEST_ID.unpack_from(frame, REQUEST_ID_OFFSET)[0] == 0
+
+
+CAPABILITIES_COMMAND = commandToByte("?") # sent by the server to every connection when it is accepted
+
+# keepalive frames, sent uncompressed so that they never touch a connection's compression stream
+PING_COMMAND = commandToByte("h")
+PING_FRAME = packHeader("h", 0, 0) # sent by the server to a connection that has been silent for a while
+PONG_FRAME = packHeader("", 0, 0) # sent back by the client: an empty reply with the reserved request id 0
+
+
+class FrameReader():
+    #Initialises a reader that reassembles frames from a byte stream into a reusable buffer.
+    #   -> Data is read straight into the buffer with recv_into, and complete frames are handed out as memoryview slices
+    #      of it, so no intermediate copies are made. The buffer grows to fit frames larger than it.
+    #[*] Parameters:
+    #   -> bufferSize (int): Initial size of the buffer in bytes. Default is 1024.
+    #[*] Returns: None
+    def __init__(self, bufferSize:int=1024):
+        self.bufferSize = bufferSize
+        self.buffer = bytearray(bufferSize)
+        self.view = memoryview(self.buffer)
+        self.start = 0 # start of the data not yet handed out as frames
+        self.end = 0 # end of the data received so far
+
+
+    #Receives the next chunk of the stream from a socket directly into the buffer.
+    #[*] Parameters:
+    #   -> sock (socket.socket): The socket to read from.
+    #[*] Returns:
+    #   -> int: The number of bytes received. 0 means the peer closed the connection.
+    def recvFrom(self, sock) -> int:
+        self.makeRoom(1)
+        received = sock.recv_into(self.view[self.end:])
+        self.end += received
+        return received
+
+
+    #Appends the next chunk of the stream to the buffer, for streams that hand out data rather than read into a buffer.
+    #[*] Parameters:
+    #   -> data (bytes): The received data.
+    #[*] Returns: None
+    def feed(self, data:bytes):
+        self.makeRoom(len(data))
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+
+    #Yields every complete frame currently in the buffer.
+    #   -> Each frame is a memoryview of the header and payload. It is only valid until the next recvFrom or feed call,
+    #      so it must be processed (or copied) before reading more data.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> generator of memoryview: The complete frames, in the order they were received.
+    #[*] Raises:
+    #   -> FrameError: If a frame header is invalid.
+    def frames(self):
+        while(self.end - self.start >= HEADER.size):
+            length = unpackHeader(self.buffer, self.start)[3]
+            frameEnd = self.start + HEADER.size + length
+            if(frameEnd > self.end):
+                return
+            frame = self.view[self.start:frameEnd]
+            self.start = frameEnd
+            yield frame
+
+
+    #Makes sure there is room at the end of the buffer for at least the given number of bytes.
+    #   -> Leftover data from a partially received frame is moved to the front of the buffer once the free space runs low,
+    #      and the buffer is replaced by a bigger one when the partial frame does not fit.
+    #[*] Parameters:
+    #   -> size (int): The number of bytes about to be written.
+    #[*] Returns: None
+    def makeRoom(self, size:int):
+        pending = self.end - self.start
+        if(pending == 0):
+            self.start = self.end = 0
+            if(len(self.buffer) > 4 * self.bufferSize): # a large frame has been handled, shrink back
+                self.buffer = bytearray(max(self.bufferSize, size))
+                self.view = memoryview(self.buffer)
+        needed = max(pending + size, self.pendingFrameSize())
+        if(needed > len(self.buffer)):
+            buffer = bytearray(max(needed, 2 * len(self.buffer)))
+            buffer[:pending] = self.view[self.start:self.end]
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+            self.start, self.end = 0, pending
+        elif(len(self.buffer) - self.end < size or self.start + needed > len(self.buffer) or self.start > len(self.buffer) // 2):
+            self.buffer[:pending] = bytes(self.view[self.start:self.end]) # the source may overlap the destination
+            self.start, self.end = 0, pending
+
+
+    #Returns the total size of the frame at the start of the pending data, or just the header size if it is not known yet.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> int: The size in bytes.
+    def pendingFrameSize(self) -> int:
+        if(self.end - self.start < HEADER.size):
+            return HEADER.size
+        return HEADER.size + unpackHeader(self.buffer, self.start)[3]
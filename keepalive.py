@@ -0,0 +1,133 @@
+# Keepalive of client connections: connections that go quiet are pinged, and closed if they stay silent
+# Every connection records when it last received anything. A heap orders the connections by when their next deadline falls
+# due. Receiving only updates the connection's timestamp, and the heap is only touched when a deadline is reached, at which
+# point the connection is rescheduled from its latest activity. So the cost of a message does not depend on the number of
+# connections. A connection that has been silent for the ping interval is sent a ping frame, which clients answer with an
+# empty reply (see framing.py). A connection that has been silent for the idle timeout is closed, which reaps dead and
+# half-open peers that would otherwise hold on to their memory and file descriptors.
+
+import asyncio, heapq, itertools, threading, time
+
+DEFAULT_PING_INTERVAL = 30.0 # seconds of silence before a connection is pinged
+DEFAULT_IDLE_TIMEOUT = 90.0 # seconds of silence before a connection is closed
+MAX_TICK = 1.0 # longest sleep between checks of the heap, so that new connections and a stopping server are noticed
+
+
+class Peer():
+    #Initialises the keepalive state of a connection.
+    #[*] Parameters:
+    #   -> ping (callable): Sends a ping frame to the connection.
+    #   -> close (callable): Closes the connection.
+    #[*] Returns: None
+    def __init__(self, ping, close):
+        self.ping = ping
+        self.close = close
+        self.lastActivity = time.monotonic()
+        self.pinged = None # value of lastActivity when the connection was last pinged, so it is pinged once per silence
+        self.closed = False
+
+    def touch(self):
+        self.lastActivity = time.monotonic()
+
+
+class KeepaliveScheduler():
+    #Initialises a scheduler with no connections.
+    #[*] Parameters:
+    #   -> pingInterval (float): Seconds of silence before a connection is pinged, 0 to never ping. Default is 30 seconds.
+    #   -> idleTimeout (float): Seconds of silence before a connection is closed, 0 to never close. Default is 90 seconds.
+    #[*] Returns: None
+    def __init__(self, pingInterval:float=DEFAULT_PING_INTERVAL, idleTimeout:float=DEFAULT_IDLE_TIMEOUT):
+        self.pingInterval = pingInterval
+        self.idleTimeout = idleTimeout
+        self.lock = threading.Lock() # connection threads register while the scheduler thread runs deadlines in thread-pool mode
+        self.heap = list() # (deadline, order, peer), the order breaking ties between equal deadlines
+        self.order = itertools.count()
+
+
+    #Starts tracking a connection.
+    #[*] Parameters:
+    #   -> ping (callable): Sends a ping frame to the connection.
+    #   -> close (callable): Closes the connection.
+    #[*] Returns:
+    #   -> Peer: The connection's state, to touch whenever it receives data, or None if keepalive is disabled.
+    def register(self, ping, close):
+        if(not self.isEnabled()):
+            return None
+        peer = Peer(ping, close)
+        self.schedule(peer, time.monotonic())
+        return peer
+
+
+    #Stops tracking a connection. Its entry is dropped from the heap when its deadline comes.
+    #[*] Parameters:
+    #   -> peer (Peer | None): The connection's state, as returned by register.
+    #[*] Returns: None
+    def unregister(self, peer:Peer):
+        if(peer is not None):
+            peer.closed = True
+
+
+    #Works out a connection's next deadline from its latest activity, and pushes it onto the heap.
+    #[*] Parameters:
+    #   -> peer (Peer): The connection's state.
+    #   -> now (float): The current time.monotonic() value.
+    #[*] Returns: None
+    def schedule(self, peer:Peer, now:float):
+        deadlines = list()
+        if(self.pingInterval and peer.pinged != peer.lastActivity):
+            deadlines.append(peer.lastActivity + self.pingInterval)
+        if(self.idleTimeout):
+            deadlines.append(peer.lastActivity + self.idleTimeout)
+        if(not deadlines): # pinged, and never closed: wait for activity
+            deadlines.append(now + self.pingInterval)
+        with self.lock:
+            heapq.heappush(self.heap, (max(min(deadlines), now), next(self.order), peer))
+
+
+    #Handles every deadline that has come: pings or closes the connections that have been silent for long enough, and
+    #reschedules the others from their latest activity.
+    #[*] Parameters:
+    #   -> now (float): The current time.monotonic() value.
+    #[*] Returns:
+    #   -> float | None: Seconds until the next deadline, or None if no connection is tracked.
+    def runDue(self, now:float):
+        while(True):
+            with self.lock:
+                if(not self.heap):
+                    return None
+                if(self.heap[0][0] > now):
+                    return self.heap[0][0] - now
+                deadline, order, peer = heapq.heappop(self.heap)
+            if(peer.closed):
+                continue
+            silence = now - peer.lastActivity
+            if(self.idleTimeout and silence >= self.idleTimeout):
+                peer.closed = True
+                peer.close()
+                continue
+            if(self.pingInterval and silence >= self.pingInterval and peer.pinged != peer.lastActivity):
+                peer.pinged = peer.lastActivity
+                peer.ping()
+            self.schedule(peer, now)
+
+
+    #Runs deadlines as they come, in a thread of its own, until the server stops.
+    #[*] Parameters:
+    #   -> stopped (callable): Returns True once the server has stopped.
+    #[*] Returns: None
+    def serve(self, stopped):
+        while(not stopped()):
+            wait = self.runDue(time.monotonic())
+            time.sleep(MAX_TICK if wait is None else min(wait, MAX_TICK))
+
+
+    #Runs deadlines as they come, as a task of the server's event loop, until it is cancelled.
+    #[*] Parameters: None
+    #[*] Returns: None
+    async def serveAsync(self):
+        while(True):
+            wait = self.runDue(time.monotonic())
+            await asyncio.sleep(MAX_TICK if wait is None else min(wait, MAX_TICK))
+
+    def isEnabled(self) -> bool:
+        return bool(self.pingInterval or self.idleTimeout)
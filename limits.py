@@ -0,0 +1,121 @@
+# Token-bucket rate limits of the requests of each client, so that one noisy client cannot starve the others
+# Every client (by address) has a bucket for each limited command, and one for all of its requests ("*"). A bucket holds up
+# to a burst of tokens and is refilled continuously at its rate. A request takes a token from each of its buckets, and is
+# rejected if one of them is empty. Buckets are only refilled when they are next used, so an idle client costs nothing but
+# its entry, and the entries of clients that have been idle long enough for their buckets to be full again are dropped.
+
+import threading, time
+
+ALL_COMMANDS = "*" # key of the limit on all of the requests of a client
+DEFAULT_BURST = 1.0 # seconds' worth of requests a client may send at once after being idle
+PRUNE_SIZE = 1024 # number of clients above which the idle ones are dropped
+
+
+#Parses rate limits given as comma-separated command=rate pairs, e.g. "a=5,c=500,*=1000".
+#[*] Parameters:
+#   -> limits (str): The limits, in requests per second per client. An empty string sets none.
+#[*] Returns:
+#   -> dict: command -> requests per second.
+#[*] Raises:
+#   -> ValueError: If a pair is malformed or a rate is not positive.
+def parseLimits(limits:str) -> dict:
+    rates = dict()
+    for pair in filter(None, (pair.strip() for pair in limits.split(","))):
+        command, _, rate = pair.partition("=")
+        if(len(command) != 1 or not rate):
+            raise ValueError(f"Invalid rate limit {pair!r}, expected <command>=<requests per second>")
+        rates[command] = float(rate)
+        if(rates[command] <= 0):
+            raise ValueError(f"Rate limit of command {command!r} must be positive")
+    return rates
+
+
+class TokenBucket():
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    #Initialises a full bucket.
+    #[*] Parameters:
+    #   -> rate (float): Tokens added per second.
+    #   -> capacity (float): Maximum number of tokens held.
+    #   -> now (float): The current time.monotonic() value.
+    #[*] Returns: None
+    def __init__(self, rate:float, capacity:float, now:float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+
+    #Adds the tokens earned since the bucket was last refilled.
+    #[*] Parameters:
+    #   -> now (float): The current time.monotonic() value.
+    #[*] Returns:
+    #   -> float: The tokens now in the bucket.
+    def refill(self, now:float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+
+    #Checks whether the bucket would be full by now, without refilling it.
+    #[*] Parameters:
+    #   -> now (float): The current time.monotonic() value.
+    #[*] Returns:
+    #   -> bool: True if it would be full.
+    def isFull(self, now:float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class RateLimiter():
+    #Initialises a limiter with no clients.
+    #[*] Parameters:
+    #   -> limits (dict | None): command -> requests per second per client, "*" limiting all of the requests of a client.
+    #                            Default is None, no limits.
+    #   -> burst (float): Seconds' worth of requests a bucket holds. Default is 1 second.
+    #[*] Returns: None
+    def __init__(self, limits:dict=None, burst:float=DEFAULT_BURST):
+        self.limits = dict(limits or {})
+        self.burst = burst
+        self.lock = threading.Lock() # connection threads take tokens concurrently in thread-pool mode
+        self.clients = dict() # client -> {command: TokenBucket}
+        self.pruneAt = PRUNE_SIZE
+
+
+    #Takes a token for a request of a client, unless one of its buckets is empty.
+    #[*] Parameters:
+    #   -> client (str): The client, e.g. its host address.
+    #   -> command (str): The command of the request.
+    #[*] Returns:
+    #   -> bool: True if the request is allowed, False if it is over one of the limits.
+    def allow(self, client:str, command:str) -> bool:
+        limited = [key for key in (command, ALL_COMMANDS) if key in self.limits]
+        if(not limited):
+            return True
+        now = time.monotonic()
+        with self.lock:
+            buckets = self.clients.get(client)
+            if(buckets is None):
+                if(len(self.clients) >= self.pruneAt):
+                    self.prune(now)
+                buckets = self.clients[client] = dict()
+            for key in limited:
+                if(key not in buckets):
+                    buckets[key] = TokenBucket(self.limits[key], max(1.0, self.limits[key] * self.burst), now)
+            if(any(buckets[key].refill(now) < 1 for key in limited)):
+                return False
+            for key in limited:
+                buckets[key].tokens -= 1
+            return True
+
+
+    #Drops the clients whose buckets are all full again, which are the same as new clients. The caller holds the lock.
+    #[*] Parameters:
+    #   -> now (float): The current time.monotonic() value.
+    #[*] Returns: None
+    def prune(self, now:float):
+        self.clients = {client:buckets for client, buckets in self.clients.items()
+                        if(not all(bucket.isFull(now) for bucket in buckets.values()))}
+        self.pruneAt = max(PRUNE_SIZE, 2 * len(self.clients)) # so that pruning stays amortised if most clients are active
+
+    def isEnabled(self) -> bool:
+        return bool(self.limits)
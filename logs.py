@@ -0,0 +1,59 @@
+# Levelled, non-blocking logging for the server
+# Records are put on a queue by whichever thread logs them and written out by a single listener thread, so a request never
+# waits on the terminal. Messages keep the "[*]" (information) and "[!]" (problem) prefixes the server has always printed.
+# Per-request messages are logged at debug level, so at the default level the hot path costs no more than a level check.
+
+import atexit, logging, logging.handlers, queue, sys
+
+LOG_LEVELS = {"debug":logging.DEBUG, "info":logging.INFO, "warning":logging.WARNING, "error":logging.ERROR, "off":logging.CRITICAL + 1}
+LEVEL_PREFIXES = {logging.DEBUG:"[-]", logging.INFO:"[*]"} # anything more severe is prefixed with "[!]"
+
+settings = None # (level, stream) logging was last set up with, to set it up again in forked children
+
+
+class PrefixFormatter(logging.Formatter):
+    #Formats a record as its level prefix followed by the message.
+    #[*] Parameters:
+    #   -> record (logging.LogRecord): The record.
+    #[*] Returns:
+    #   -> str: The formatted line.
+    def format(self, record:logging.LogRecord) -> str:
+        line = LEVEL_PREFIXES.get(record.levelno, "[!]") + " " + record.getMessage()
+        if(record.exc_info):
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+#Sets up logging for the process: every logger hands its records to a queue, which a listener thread writes to the stream.
+#   -> The listener is stopped (after writing out what is left in the queue) when the process exits.
+#[*] Parameters:
+#   -> level (str): One of LOG_LEVELS. Default is "info".
+#   -> stream (file | None): Where to write the log. Default is None, which writes to standard output.
+#[*] Returns:
+#   -> logging.handlers.QueueListener: The running listener.
+def setupLogging(level:str="info", stream=None) -> logging.handlers.QueueListener:
+    global settings
+    settings = (level, stream)
+    records = queue.SimpleQueue()
+    output = logging.StreamHandler(stream if stream is not None else sys.stdout)
+    output.setFormatter(PrefixFormatter())
+    listener = logging.handlers.QueueListener(records, output)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(LOG_LEVELS[level])
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+#Sets up logging again in a forked child process, with the settings of its parent, as the listener thread of the parent
+#does not survive the fork. A child that exits without running atexit handlers must stop the listener itself.
+#[*] Parameters: None
+#[*] Returns:
+#   -> logging.handlers.QueueListener | None: The running listener, or None if logging was never set up.
+def restartLogging():
+    if(settings is None):
+        return None
+    return setupLogging(*settings)
@@ -0,0 +1,260 @@
+# Memory-mapped, sorted on-disk index of the countries file, for datasets too large to hold as Python strings
+# The index file holds a header, then the positions of the records sorted by their normalised key, then the records
+# themselves in the order they were read from the countries file. Lookups binary search the positions through an mmap,
+# so only the pages touched are read into memory, and every process mapping the file (e.g. prefork workers) shares them.
+# Entries added after the file was built are kept in a small in-memory delta. Saving the index again merges the delta into
+# a new file, copying the existing records as they are and merging the sorted positions, so the countries file is not
+# parsed again and the existing keys are not sorted again. The new file is written a block at a time, so that the existing
+# records are never read into memory all at once.
+
+import mmap, struct
+from itertools import islice
+from persistence import BLOCK_SIZE, atomicWriteChunks
+
+INDEX_MAGIC = b"CIDX"
+INDEX_VERSION = 1 # bumped whenever the layout or the normalisation rules change
+INDEX_HEADER = struct.Struct("<4sHHQQq16s64s") # magic, version, tail length, count, indexed offset, mtime, digest, tail
+POSITION = struct.Struct("<Q") # byte position of a record in the index file
+RECORD = struct.Struct("<HHH") # lengths of the UTF-8 key, country and city that follow
+INDEX_ERRORS = (OSError, ValueError, struct.error, UnicodeDecodeError)
+POSITIONS_PER_BLOCK = BLOCK_SIZE // POSITION.size
+
+
+class MappedIndex():
+    #Maps an index file into memory.
+    #   -> Behaves like the dictionary index of the store (normalised country -> (country, capital)) for the operations the
+    #      store uses, with new entries going to the in-memory delta.
+    #[*] Parameters:
+    #   -> path (str): Path to the index file.
+    #[*] Returns: None
+    #[*] Raises:
+    #   -> OSError: If the file cannot be opened or mapped.
+    #   -> ValueError: If the file is empty, truncated, or not an index of the current version.
+    def __init__(self, path:str):
+        with open(path, "rb") as indexFile:
+            self.map = mmap.mmap(indexFile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, tailLength, self.count, self.offset, self.mtime, self.digest, tail = INDEX_HEADER.unpack_from(self.map)
+        if(magic != INDEX_MAGIC or version != INDEX_VERSION):
+            raise ValueError("not an index file of version %d" % INDEX_VERSION)
+        self.tail = tail[:tailLength]
+        self.positions = INDEX_HEADER.size
+        self.records = self.positions + POSITION.size * self.count
+        if(self.records > len(self.map)):
+            raise ValueError("truncated index file")
+        self.delta = dict() # normalised country -> (country, capital) of entries added since the file was built
+
+
+    #Reads a record of the file.
+    #[*] Parameters:
+    #   -> position (int): Byte position of the record.
+    #[*] Returns:
+    #   -> tuple: (key (bytes), country (str), capital (str), position of the next record (int)).
+    def readRecord(self, position:int) -> tuple:
+        keyLength, countryLength, cityLength = RECORD.unpack_from(self.map, position)
+        start = position + RECORD.size
+        country = start + keyLength
+        city = country + countryLength
+        end = city + cityLength
+        return (self.map[start:country], self.map[country:city].decode("utf-8"), self.map[city:end].decode("utf-8"), end)
+
+
+    #Returns the position of the record with the given rank in key order.
+    #[*] Parameters:
+    #   -> rank (int): The rank, from 0 to count - 1.
+    #[*] Returns:
+    #   -> int: The byte position of the record.
+    def positionAt(self, rank:int) -> int:
+        return POSITION.unpack_from(self.map, self.positions + POSITION.size * rank)[0]
+
+
+    #Returns the key of the record with the given rank in key order, without decoding the rest of the record.
+    #[*] Parameters:
+    #   -> rank (int): The rank, from 0 to count - 1.
+    #[*] Returns:
+    #   -> bytes: The UTF-8 normalised key.
+    def keyAt(self, rank:int) -> bytes:
+        position = self.positionAt(rank)
+        start = position + RECORD.size
+        return self.map[start:start + RECORD.unpack_from(self.map, position)[0]]
+
+
+    #Binary searches the file for the first key that is not less than the given one.
+    #[*] Parameters:
+    #   -> key (bytes): The UTF-8 normalised key.
+    #[*] Returns:
+    #   -> int: The rank of that key, or count if every key is less.
+    def search(self, key:bytes) -> int:
+        low, high = 0, self.count
+        while(low < high):
+            middle = (low + high) // 2
+            if(self.keyAt(middle) < key):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+    #Looks up the entry of a country.
+    #[*] Parameters:
+    #   -> key (str): The normalised country.
+    #   -> default: Returned if the country is not in the index. Default is None.
+    #[*] Returns:
+    #   -> tuple: (country, capital), or the default.
+    def get(self, key:str, default=None):
+        encoded = key.encode("utf-8")
+        rank = self.search(encoded)
+        if(rank < self.count and self.keyAt(rank) == encoded):
+            return self.readRecord(self.positionAt(rank))[1:3]
+        return self.delta.get(key, default)
+
+
+    #Adds an entry unless the country is already in the index (the first entry wins, as with the dictionary index).
+    #[*] Parameters:
+    #   -> key (str): The normalised country.
+    #   -> entry (tuple): (country, capital).
+    #[*] Returns:
+    #   -> tuple: The entry now in the index for the country.
+    def setdefault(self, key:str, entry:tuple) -> tuple:
+        existing = self.get(key)
+        if(existing is None):
+            self.delta[key] = existing = entry
+        return existing
+
+
+    #Finds the entries whose normalised key starts with the given prefix, in key order.
+    #[*] Parameters:
+    #   -> prefix (str): The normalised prefix.
+    #   -> limit (int): Maximum number of entries returned.
+    #[*] Returns:
+    #   -> list: (country, capital) entries.
+    def prefix(self, prefix:str, limit:int) -> list:
+        encoded = prefix.encode("utf-8")
+        found = list()
+        rank = self.search(encoded)
+        while(rank < self.count and len(found) < limit):
+            key, country, city, end = self.readRecord(self.positionAt(rank))
+            if(not key.startswith(encoded)):
+                break
+            found.append((key, (country, city)))
+            rank += 1
+        found.extend((key.encode("utf-8"), entry) for key, entry in self.delta.items() if key.startswith(prefix))
+        return [entry for key, entry in sorted(found)[:limit]]
+
+
+    #Iterates over every entry: those of the file in the order they were read from the countries file, then the delta.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> generator: (country, capital) entries.
+    def values(self):
+        position = self.records
+        while(position < len(self.map)):
+            key, country, city, position = self.readRecord(position)
+            yield (country, city)
+        yield from list(self.delta.values())
+
+    def __setitem__(self, key:str, entry:tuple): # only for countries not in the index yet, as the store checks beforehand
+        self.delta[key] = entry
+
+    def __contains__(self, key:str) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return self.count + len(self.delta)
+
+
+#Writes an index file, replacing the previous one atomically.
+#   -> Given a base index, its records are copied as they are and its sorted positions merged with those of the new
+#      entries, which must not already be in it. Both are streamed from its mapping into the new file.
+#[*] Parameters:
+#   -> path (str): Path to the index file.
+#   -> entries (list): (normalised country, country, capital) entries, in the order they were read.
+#   -> offset (int): Number of bytes of the countries file indexed.
+#   -> mtime (int): Modification time of the countries file in nanoseconds.
+#   -> digest (bytes): Hash of the indexed part of the countries file.
+#   -> tail (bytes): Bytes of the countries file just before the offset, at most 64.
+#   -> base (MappedIndex | None): Index whose entries are kept. Default is None.
+#[*] Returns: None
+#[*] Raises:
+#   -> OSError: If the file cannot be written.
+def writeIndex(path:str, entries:list, offset:int, mtime:int, digest:bytes, tail:bytes, base:MappedIndex=None):
+    records = bytearray()
+    keyed = list() # (key, position of the record relative to the new records)
+    for key, country, city in entries:
+        key, country, city = key.encode("utf-8"), country.encode("utf-8"), city.encode("utf-8")
+        keyed.append((key, len(records)))
+        records += RECORD.pack(len(key), len(country), len(city)) + key + country + city
+    keyed.sort()
+    kept = len(base.map) - base.records if base is not None else 0
+    count = len(keyed) + (base.count if base is not None else 0)
+    start = INDEX_HEADER.size + POSITION.size * count # the kept records move along as the positions grow
+    keyed = [(key, start + kept + position) for key, position in keyed]
+    positions = (position for key, position in keyed)
+    if(base is not None):
+        positions = mergePositions(base, keyed, start - base.records)
+    header = INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(tail), count, offset, mtime, digest, tail)
+    atomicWriteChunks(path, indexBlocks(header, packPositions(positions), base, records))
+
+
+#Merges the sorted positions of a base index with those of new entries.
+#   -> Each new key is binary searched in the base, whose positions up to it are copied a block at a time, so that the
+#      keys of the base are not read one by one.
+#[*] Parameters:
+#   -> base (MappedIndex): The base index.
+#   -> keyed (list): Sorted (key (bytes), position (int)) of the new entries, none of which are in the base.
+#   -> shift (int): Amount the positions of the base's records move by in the new file.
+#[*] Returns:
+#   -> generator: The positions, as ints, in key order.
+def mergePositions(base:MappedIndex, keyed:list, shift:int):
+    rank = 0
+    for key, position in keyed:
+        end = base.search(key)
+        yield from basePositions(base, rank, end, shift)
+        yield position
+        rank = end
+    yield from basePositions(base, rank, base.count, shift)
+
+
+#Reads a range of the sorted positions of an index, a block at a time.
+#[*] Parameters:
+#   -> base (MappedIndex): The index.
+#   -> start (int): Rank of the first position.
+#   -> end (int): Rank just after the last position.
+#   -> shift (int): Amount added to every position.
+#[*] Returns:
+#   -> generator: The positions, as ints.
+def basePositions(base:MappedIndex, start:int, end:int, shift:int):
+    for block in range(start, end, POSITIONS_PER_BLOCK):
+        length = min(end - block, POSITIONS_PER_BLOCK)
+        positions = struct.unpack_from("<%dQ" % length, base.map, base.positions + POSITION.size * block)
+        yield from (position + shift for position in positions)
+
+
+#Packs record positions, a block at a time.
+#[*] Parameters:
+#   -> positions (iterable): The positions, as ints.
+#[*] Returns:
+#   -> generator: The packed positions, as bytes.
+def packPositions(positions):
+    positions = iter(positions)
+    while(True):
+        block = list(islice(positions, POSITIONS_PER_BLOCK))
+        if(not block):
+            return
+        yield struct.pack("<%dQ" % len(block), *block)
+
+
+#Lays out the contents of an index file: the header, the positions, the records kept from the base index and the new ones.
+#[*] Parameters:
+#   -> header (bytes): The packed header.
+#   -> positions (iterable): The packed positions, as bytes.
+#   -> base (MappedIndex | None): Index whose records are copied from its mapping, a block at a time.
+#   -> records (bytes): The new records.
+#[*] Returns:
+#   -> generator: The contents, as bytes.
+def indexBlocks(header:bytes, positions, base, records:bytes):
+    yield header
+    yield from positions
+    if(base is not None):
+        for start in range(base.records, len(base.map), BLOCK_SIZE):
+            yield base.map[start:start + BLOCK_SIZE]
+    yield bytes(records)
@@ -0,0 +1,119 @@
+# Metrics of the server: counters, and latency histograms of each stage of request handling for each command
+# Histograms use fixed power-of-two buckets, so recording a latency is a single increment whatever the load, and
+# percentiles are read from the bucket counts (to within a factor of two) when the stats are asked for.
+# An optional hook receives every latency as it is recorded, to plug in a profiler or tracer.
+
+import threading, time
+
+HISTOGRAM_BUCKETS = 28 # bucket i counts latencies below 2**i microseconds (the last bucket also counts anything slower)
+STATS_PERCENTILES = (("p50", 50), ("p90", 90), ("p99", 99), ("p999", 99.9))
+
+
+class Histogram():
+    #Initialises an empty latency histogram.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def __init__(self):
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = 0.0
+
+
+    #Records a latency.
+    #[*] Parameters:
+    #   -> seconds (float): The latency.
+    #[*] Returns: None
+    def record(self, seconds:float):
+        self.buckets[min(int(seconds * 1000000).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if(self.minimum is None or seconds < self.minimum):
+            self.minimum = seconds
+        if(seconds > self.maximum):
+            self.maximum = seconds
+
+
+    #Estimates a percentile of the recorded latencies: the upper bound of the bucket it falls in, capped at the maximum.
+    #[*] Parameters:
+    #   -> percent (float): The percentile, from 0 to 100.
+    #[*] Returns:
+    #   -> float: The latency in seconds, 0 if nothing has been recorded.
+    def percentile(self, percent:float) -> float:
+        rank = self.count * percent / 100
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if(count and seen >= rank):
+                return min(2 ** index / 1000000, self.maximum)
+        return self.maximum
+
+
+    #Returns a summary of the recorded latencies in milliseconds.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> dict: Count, mean, min, max and percentiles.
+    def getStats(self) -> dict:
+        if(not self.count):
+            return {"count":0}
+        stats = {"count":self.count, "mean":1000 * self.total / self.count, "min":1000 * self.minimum}
+        for name, percent in STATS_PERCENTILES:
+            stats[name] = 1000 * self.percentile(percent)
+        stats["max"] = 1000 * self.maximum
+        return stats
+
+
+class Metrics():
+    #Initialises an empty set of metrics.
+    #[*] Parameters:
+    #   -> hook (callable | None): Called with (stage, command, seconds) for every latency recorded, e.g. to feed a profiler.
+    #                              Default is None.
+    #[*] Returns: None
+    def __init__(self, hook=None):
+        self.lock = threading.Lock() # connection threads record concurrently in thread-pool mode
+        self.started = time.monotonic()
+        self.counters = dict() # name -> count
+        self.histograms = dict() # (stage, command) -> Histogram
+        self.hook = hook
+
+
+    #Adds to a counter.
+    #[*] Parameters:
+    #   -> name (str): Name of the counter.
+    #   -> amount (int): Amount to add. Default is 1.
+    #[*] Returns: None
+    def increment(self, name:str, amount:int=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+
+    #Records the latency of a stage of handling a request.
+    #[*] Parameters:
+    #   -> stage (str): The stage, e.g. "decode", "lookup", "encode" or "send".
+    #   -> command (str): The command of the request, or "*" for stages shared by several requests.
+    #   -> seconds (float): The latency.
+    #[*] Returns: None
+    def observe(self, stage:str, command:str, seconds:float):
+        with self.lock:
+            histogram = self.histograms.get((stage, command))
+            if(histogram is None):
+                histogram = self.histograms[(stage, command)] = Histogram()
+            histogram.record(seconds)
+        if(self.hook is not None):
+            self.hook(stage, command, seconds)
+
+    def setHook(self, hook):
+        self.hook = hook
+
+
+    #Returns a snapshot of the metrics.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> dict: Uptime in seconds, counters, and the latency stats of each stage for each command.
+    def getStats(self) -> dict:
+        with self.lock:
+            latency = dict()
+            for (stage, command), histogram in sorted(self.histograms.items()):
+                latency.setdefault(stage, dict())[command] = histogram.getStats()
+            return {"uptime":time.monotonic() - self.started, "counters":dict(sorted(self.counters.items())), "latency":latency}
@@ -1,75 +1,115 @@
-# Represents a simple network packet for the client and server to communicate with each other with
-# This allows a standardised form of communication so that both sides can expect the same message format
-
-from sys import getsizeof as size
-import zlib
-
-class Packet():
-    #Initialize a new Packet object.
-    #[*] Parameters:
-    #   -> command (str): The command associated with the packet. Default is an empty string.
-    #   -> contents (str): The contents of the packet. Default is an empty string.
-    #[*] Returns: None
-    def __init__(self, command:str="", contents:str=""):
-        self.command = command
-        self.contents = contents
-        self.size = 0
-
-
-    #Creates a new packet with the given command and contents.
-    #[*] Parameters:
-    #   -> command (str): The command associated with the packet.
-    #   -> contents (str): The contents of the packet.
-    #[*] Returns: None
-    def createNewPacket(self, command:str, contents:str):
-        self.command = command
-        self.contents = contents
-        self.calculateSize()
-
-
-    #Parses a string into a Packet object by splitting it at the first colon.
-    #   -> The input string is expected to be in the format "command:contents".
-    #   -> The command and contents are then assigned to the Packet object's respective attributes.
-    #[*] Parameters:
-    #   -> packet (str): The input string to be parsed. It should be in the format "command:contents".
-    #[*] Returns: None
-    def createPacketFromString(self, packet:bytes):
-        if(len(packet) > 0):
-            packetString = self.decompress(packet)
-            self.command, self.contents = packetString.split("|")
-            self.calculateSize()
-
-
-    #Generates a string representation of the packet in the format "command:contents".
-    #[*] Parameters: None
-    #[*] Returns:
-    #   -> str: A string representation of the packet in the format "command:contents".
-    def generatePacket(self) -> str:
-        return self.compress(f"{self.command}|{self.contents}")
-
-    #Resets the command and contents of the packet to empty strings.
-    #Parameters: None
-    #Returns: None
-    def emptyPacket(self):
-        self.command = ""
-        self.contents = ""
-
-    def getCommand(self) -> str:
-        return self.command
-
-    def getContents(self) -> str:
-        return self.contents
-    
-    def getSize(self) -> int:
-        return self.size
-
-    def compress(self, message) -> bytes:
-        compressed = zlib.compress(message.encode("utf-8"))
-        return compressed
-    
-    def decompress(self, message) -> str:
-        decompressed = zlib.decompress(message).decode("utf-8")
-        return decompressed
-    
-    def calculateSize(self):
-        self.size = size(self.command) + size(self.contents)
+# Represents a simple network packet for the client and server to communicate with each other with
+# This allows a standardised form of communication so that both sides can expect the same message format
+# Packets are sent as length-prefixed frames (see framing.py): the command travels in the frame header,
+# and the payload is the contents, compressed according to the connection's compression policy (see compression.py)
+# Packets are immutable and slotted, so they can be created per message and shared freely. They are encoded straight into
+# a caller's buffer and decoded from a memoryview of the receive buffer, without intermediate copies of the frame.
+
+from framing import HEADER, PROTOCOL_VERSION, FLAG_CODEC_MASK, commandToByte, unpackHeader
+from compression import CompressionPolicy
+
+class Packet():
+    __slots__ = ("command", "contents", "requestId", "flags", "size")
+
+    #Initialize a new Packet object.
+    #[*] Parameters:
+    #   -> command (str): The command associated with the packet. Default is an empty string.
+    #   -> contents (str): The contents of the packet. Default is an empty string.
+    #   -> requestId (int): The id matching a request with its reply. Default is 0 (not a request or reply).
+    #   -> flags (int): Frame flags other than the codec, which is chosen when the packet is encoded. Default is 0.
+    #   -> size (int | None): Encoded size of the packet before compression, header included. Default is None,
+    #                         which works it out from the contents when asked for.
+    #[*] Returns: None
+    def __init__(self, command:str="", contents:str="", requestId:int=0, flags:int=0, size:int=None):
+        object.__setattr__(self, "command", command)
+        object.__setattr__(self, "contents", contents)
+        object.__setattr__(self, "requestId", requestId)
+        object.__setattr__(self, "flags", flags)
+        object.__setattr__(self, "size", size)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Packet is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Packet is immutable")
+
+    def __repr__(self) -> str:
+        return f"Packet(command={self.command!r}, contents={self.contents!r}, requestId={self.requestId}, flags={self.flags})"
+
+    def __eq__(self, other) -> bool:
+        if(not isinstance(other, Packet)):
+            return NotImplemented
+        return (self.command, self.contents, self.requestId, self.flags) == (other.command, other.contents, other.requestId, other.flags)
+
+    def __hash__(self) -> int:
+        return hash((self.command, self.contents, self.requestId, self.flags))
+
+    def getCommand(self) -> str:
+        return self.command
+
+    def getContents(self) -> str:
+        return self.contents
+
+    def getRequestId(self) -> int:
+        return self.requestId
+
+    def getFlags(self) -> int:
+        return self.flags
+
+    #Returns the real encoded size of the packet before compression: the frame header plus the UTF-8 encoded contents.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> int: The size in bytes.
+    def getSize(self) -> int:
+        if(self.size is None):
+            return HEADER.size + len(self.contents.encode("utf-8"))
+        return self.size
+
+
+#Encodes a packet as a frame straight into a buffer: a header carrying the command, flags, request id and payload length,
+#followed by the contents, compressed if the compression policy says so.
+#   -> The buffer is extended if the frame does not fit, so a reusable bytearray can collect several frames before one send.
+#[*] Parameters:
+#   -> packet (Packet): The packet to encode.
+#   -> buffer (bytearray): The buffer to write the frame into.
+#   -> offset (int): Offset in the buffer to write the frame at.
+#   -> policy (CompressionPolicy): The connection's compression policy.
+#[*] Returns:
+#   -> int: The offset just after the frame.
+def encodeInto(packet:Packet, buffer:bytearray, offset:int, policy:CompressionPolicy) -> int:
+    codec, payload = policy.compress(packet.contents.encode("utf-8"))
+    end = offset + HEADER.size + len(payload)
+    if(len(buffer) < end):
+        buffer.extend(bytes(end - len(buffer)))
+    HEADER.pack_into(buffer, offset, PROTOCOL_VERSION, commandToByte(packet.command), packet.flags | codec, packet.requestId, len(payload))
+    buffer[offset + HEADER.size:end] = payload
+    return end
+
+
+#Encodes a packet as a standalone frame.
+#[*] Parameters:
+#   -> packet (Packet): The packet to encode.
+#   -> policy (CompressionPolicy): The connection's compression policy.
+#[*] Returns:
+#   -> bytearray: The encoded frame.
+def encodePacket(packet:Packet, policy:CompressionPolicy) -> bytearray:
+    buffer = bytearray()
+    encodeInto(packet, buffer, 0, policy)
+    return buffer
+
+
+#Decodes a packet from a received frame.
+#   -> The command and request id are read from the frame header and the contents are decompressed from the payload,
+#      using the codec recorded in the frame flags. Uncompressed payloads are decoded straight from the memoryview.
+#[*] Parameters:
+#   -> frame (bytes | memoryview): A complete frame, header included.
+#   -> policy (CompressionPolicy): The connection's compression policy.
+#[*] Returns:
+#   -> Packet: The decoded packet.
+#[*] Raises:
+#   -> FrameError: If the frame header is invalid.
+#   -> One of compression.DECOMPRESSION_ERRORS: If the payload is corrupt or not valid UTF-8.
+def decodeFrom(frame, policy:CompressionPolicy) -> Packet:
+    command, flags, requestId, length = unpackHeader(frame)
+    payload = policy.decompress(flags, memoryview(frame)[HEADER.size:HEADER.size + length])
+    return Packet(command, str(payload, "utf-8"), requestId, flags & ~FLAG_CODEC_MASK, HEADER.size + len(payload))
@@ -0,0 +1,271 @@
+# Write-behind persistence for the country store
+# New entries are appended to a write-ahead log next to the countries file instead of being written to the CSV itself.
+# Appends go straight to the OS, while a background thread fsyncs them in batches (group commit), so an insert costs
+# little more than a memory write. Every so often the log is compacted into a new countries file that atomically replaces
+# the old one, after which the log is emptied, so at startup only the entries since the last compaction are replayed.
+# Every log record carries a CRC, so a record torn by a crash mid-write is detected and dropped on replay.
+
+import csv, io, json, logging, os, threading, time, zlib
+
+DEFAULT_FLUSH_INTERVAL = 0.05 # seconds between group commits
+DEFAULT_COMPACT_THRESHOLD = 1000 # number of logged entries that triggers a compaction
+BLOCK_SIZE = 1 << 20 # bytes read or written at a time when large files are copied
+COMPACT_RETRY_DELAY = 10.0 # seconds before a failed compaction is tried again
+
+log = logging.getLogger("persistence")
+
+
+#Writes data to a file atomically: it is written to a temporary file which is synced and then renamed over the target,
+#so the target holds either its old contents or all of the new data, even if the program crashes mid-write.
+#[*] Parameters:
+#   -> path (str): The file to replace.
+#   -> data (bytes): The new contents of the file.
+#[*] Returns: None
+def atomicWrite(path:str, data:bytes):
+    atomicWriteChunks(path, (data,))
+
+
+#Writes data to a file atomically (see atomicWrite), a chunk at a time, so that a large file is never held in memory whole.
+#[*] Parameters:
+#   -> path (str): The file to replace.
+#   -> chunks (iterable): The new contents of the file, as bytes.
+#[*] Returns: None
+def atomicWriteChunks(path:str, chunks):
+    temporaryPath = path + ".tmp"
+    with open(temporaryPath, "wb") as temporaryFile:
+        for chunk in chunks:
+            temporaryFile.write(chunk)
+        temporaryFile.flush()
+        os.fsync(temporaryFile.fileno())
+    os.replace(temporaryPath, path)
+    syncDirectory(path)
+
+
+#Encodes CSV rows as they are written to the countries file.
+#[*] Parameters:
+#   -> rows (iterable): The CSV rows.
+#[*] Returns:
+#   -> bytes: The UTF-8 encoded rows, each ending with a newline.
+def encodeRows(rows) -> bytes:
+    text = io.StringIO(newline="")
+    csv.writer(text).writerows(rows)
+    return text.getvalue().encode("utf-8")
+
+
+#Syncs the directory holding a file, so that a rename or creation of the file survives a crash.
+#[*] Parameters:
+#   -> path (str): The file whose directory is synced.
+#[*] Returns: None
+def syncDirectory(path:str):
+    try:
+        directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError: # not supported on every platform (e.g. Windows)
+        return
+    try:
+        os.fsync(directory)
+    except OSError:
+        pass
+    finally:
+        os.close(directory)
+
+
+#Encodes an entry as a log record: the CRC32 of the entry, then the entry as a JSON list, on a single line.
+#[*] Parameters:
+#   -> country (str): The country of the entry.
+#   -> city (str): The capital city of the entry.
+#[*] Returns:
+#   -> bytes: The record.
+def encodeRecord(country:str, city:str) -> bytes:
+    entry = json.dumps([country, city], ensure_ascii=False).encode("utf-8")
+    return b"%08x %s\n" % (zlib.crc32(entry), entry)
+
+
+#Decodes a log record.
+#[*] Parameters:
+#   -> record (bytes): The record, including its trailing newline.
+#[*] Returns:
+#   -> tuple | None: (country, city), or None if the record is torn or corrupt.
+def decodeRecord(record:bytes):
+    if(not record.endswith(b"\n") or len(record) < 10):
+        return None
+    checksum, entry = record[:8], record[9:-1]
+    try:
+        if(int(checksum, 16) != zlib.crc32(entry)):
+            return None
+        country, city = json.loads(entry)
+    except ValueError:
+        return None
+    return country, city
+
+
+#Reads every intact record of a log, without changing it, so that other processes can follow a log they do not write.
+#[*] Parameters:
+#   -> path (str): Path of the log file.
+#[*] Returns:
+#   -> tuple: (entries (list), intact (int), size (int)): the (country, city) entries in the order they were logged,
+#             the number of bytes they take up from the start of the file, and the size of the file.
+def readRecords(path:str) -> tuple:
+    entries = list()
+    offset = 0
+    try:
+        with open(path, "rb") as logFile:
+            for record in logFile:
+                entry = decodeRecord(record)
+                if(entry is None):
+                    break
+                entries.append(entry)
+                offset += len(record)
+            size = logFile.seek(0, os.SEEK_END)
+    except FileNotFoundError:
+        return entries, 0, 0
+    return entries, offset, size
+
+
+class WriteAheadLog():
+    #Opens (or creates) a write-ahead log and starts its group commit thread.
+    #[*] Parameters:
+    #   -> path (str): Path of the log file.
+    #   -> flushInterval (float): Seconds between group commits. Default is 0.05 seconds.
+    #   -> compactThreshold (int): Number of logged entries after which the compactor is called. Default is 1000.
+    #[*] Returns: None
+    def __init__(self, path:str, flushInterval:float=DEFAULT_FLUSH_INTERVAL, compactThreshold:int=DEFAULT_COMPACT_THRESHOLD):
+        self.path = path
+        self.flushInterval = flushInterval
+        self.compactThreshold = compactThreshold
+        self.compactor = None # called by the commit thread once compactThreshold entries have been logged
+        self.condition = threading.Condition()
+        self.written = 0 # number of records written since the log was opened
+        self.synced = 0 # number of those records known to be on disk
+        self.error = None # error of the last failed sync, until a sync succeeds
+        self.failed = 0 # number of records written when that sync failed
+        self.compactAfter = 0.0 # time before which the compactor is not called, after it failed
+        self.records = len(self.replay()) # records in the log, replayed or appended, since the last compaction
+        self.file = open(self.path, "ab")
+        self.closed = False
+        self.thread = threading.Thread(target=self.commitLoop, name="wal-commit", daemon=True)
+        self.thread.start()
+
+
+    #Reads every intact record of the log. A torn or corrupt record ends the replay, and is cut off the log so that
+    #new records are appended after the last intact one.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> list: (country, city) entries in the order they were logged.
+    def replay(self) -> list:
+        entries, offset, size = readRecords(self.path)
+        if(offset < size):
+            log.warning("Dropping %d bytes of torn records from the end of %s", size - offset, self.path)
+            os.truncate(self.path, offset)
+        return entries
+
+
+    #Appends an entry to the log. The record is handed to the OS straight away and synced to disk by the next group commit.
+    #[*] Parameters:
+    #   -> country (str): The country of the entry.
+    #   -> city (str): The capital city of the entry.
+    #[*] Returns:
+    #   -> int: Sequence number of the record, which can be passed to waitForSync.
+    def append(self, country:str, city:str) -> int:
+        record = encodeRecord(country, city)
+        with self.condition:
+            self.file.write(record)
+            self.file.flush()
+            self.written += 1
+            self.records += 1
+            return self.written
+
+
+    #Waits until the record with the given sequence number has been synced to disk by a group commit.
+    #[*] Parameters:
+    #   -> sequence (int): Sequence number returned by append.
+    #[*] Returns: None
+    #[*] Raises:
+    #   -> OSError: If the group commit that should have synced the record failed.
+    def waitForSync(self, sequence:int):
+        with self.condition:
+            while(self.synced < sequence and not self.closed):
+                if(self.error is not None and sequence <= self.failed):
+                    raise self.error
+                self.condition.wait()
+
+
+    #Group commit loop: every flushInterval, syncs all records written since the last sync with a single fsync,
+    #and calls the compactor once enough entries have been logged.
+    #   -> A failed sync is logged, fails the appends waiting for it, and is tried again by the next group commit.
+    #   -> A failed compaction is logged and tried again after COMPACT_RETRY_DELAY seconds.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def commitLoop(self):
+        while(True):
+            with self.condition:
+                self.condition.wait(self.flushInterval)
+                if(self.closed):
+                    return
+                try:
+                    self.sync()
+                except OSError:
+                    log.exception("Failed to sync %s", self.path)
+                compact = self.compactor is not None and self.records >= self.compactThreshold
+            if(compact and time.monotonic() >= self.compactAfter):
+                try:
+                    self.compactor()
+                except Exception:
+                    log.exception("Failed to compact %s, trying again in %.0f seconds", self.path, COMPACT_RETRY_DELAY)
+                    self.compactAfter = time.monotonic() + COMPACT_RETRY_DELAY
+
+
+    #Syncs the records written so far to disk and wakes up appends waiting for them. Must be called with the condition held.
+    #[*] Parameters: None
+    #[*] Returns: None
+    #[*] Raises:
+    #   -> OSError: If the records could not be synced, after waking up the appends waiting for them with the error.
+    def sync(self):
+        if(self.synced < self.written):
+            try:
+                os.fsync(self.file.fileno())
+            except OSError as e:
+                self.error = e
+                self.failed = self.written
+                self.condition.notify_all()
+                raise
+            self.synced = self.written
+            self.error = None
+            self.condition.notify_all()
+
+
+    #Empties the log, once its entries have been written into a compacted countries file.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def truncate(self):
+        with self.condition:
+            self.file.truncate(0)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.synced = self.written
+            self.error = None
+            self.records = 0
+            self.condition.notify_all()
+
+
+    #Syncs any outstanding records and closes the log.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def close(self):
+        with self.condition:
+            if(self.closed):
+                return
+            try:
+                self.sync()
+            finally:
+                self.closed = True
+                self.file.close()
+                self.condition.notify_all()
+        if(threading.current_thread() is not self.thread):
+            self.thread.join()
+
+
+    def getRecords(self) -> int:
+        return self.records
+
+    def setCompactor(self, compactor):
+        self.compactor = compactor
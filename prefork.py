@@ -0,0 +1,329 @@
+# Pre-fork mode of the server: one worker process per core, to get past the GIL for parsing and compression
+# The supervisor loads the country store once, then forks the workers, which inherit the loaded index copy-on-write rather
+# than each loading their own. Every worker binds its own listening socket to the same address and port with SO_REUSEPORT,
+# so the kernel spreads incoming connections over them, and serves its connections with its own event loop.
+# The supervisor is the only process that writes: workers forward inserts to it over a pipe, and it logs them to the
+# write-ahead log and broadcasts them to every worker, so that all of them stay consistent. Workers that die are restarted.
+
+import logging, multiprocessing, os, signal, sys, threading, time
+from multiprocessing.connection import wait
+from store import CountryStore, normaliseCountry
+from persistence import readRecords
+from logs import restartLogging
+
+MIN_UPTIME = 5.0 # workers that die sooner than this after starting are restarted after RESTART_DELAY, to avoid a restart loop
+RESTART_DELAY = 1.0
+STOP_TIMEOUT = 10.0 # seconds given to workers to shut down cleanly before they are terminated
+GROUP_SIGNAL_GRACE = 1.0 # seconds given to workers to stop on a Ctrl-C of their own before they are sent SIGTERM
+
+log = logging.getLogger("prefork")
+
+
+class SupervisorLink():
+    #Initialises a worker's end of the pipe to the supervisor.
+    #[*] Parameters:
+    #   -> channel (multiprocessing.connection.Connection): The pipe.
+    #[*] Returns: None
+    def __init__(self, channel):
+        self.channel = channel
+        self.lock = threading.Lock() # inserts may be forwarded from several connection threads
+        self.pending = dict() # request id -> [threading.Event, result] of forwarded inserts
+        self.requestId = 0
+        self.store = None
+        self.thread = threading.Thread(target=self.listen, name="supervisor-link", daemon=True)
+
+
+    #Starts listening for the supervisor's messages, which are applied to the given store.
+    #[*] Parameters:
+    #   -> store (ReplicaStore): The worker's store.
+    #[*] Returns: None
+    def start(self, store):
+        self.store = store
+        self.thread.start()
+
+
+    #Forwards an insert to the supervisor and waits for its outcome.
+    #[*] Parameters:
+    #   -> country (str): The country to add.
+    #   -> city (str): Its capital city.
+    #[*] Returns:
+    #   -> bool: True if the entry was added, False if the country already exists (or the supervisor is gone).
+    def add(self, country:str, city:str) -> bool:
+        waiter = [threading.Event(), False]
+        with self.lock:
+            self.requestId += 1
+            self.pending[self.requestId] = waiter
+            try:
+                self.channel.send(("add", self.requestId, country, city))
+            except OSError:
+                del self.pending[self.requestId]
+                return False
+        waiter[0].wait()
+        return waiter[1]
+
+
+    #Applies the supervisor's messages until the pipe closes: broadcast inserts, and the outcome of forwarded ones.
+    #   -> If the supervisor goes away, the worker shuts itself down as if the supervisor had stopped it.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def listen(self):
+        while(True):
+            try:
+                message = self.channel.recv()
+            except (EOFError, OSError):
+                break
+            if(message[0] == "added"):
+                self.store.apply(message[1], message[2])
+            elif(message[0] == "result"):
+                waiter = self.pending.pop(message[1], None)
+                if(waiter is not None):
+                    waiter[1] = message[2]
+                    waiter[0].set()
+        with self.lock:
+            for waiter in self.pending.values():
+                waiter[0].set()
+            self.pending.clear()
+        log.error("Lost the connection to the supervisor. Shutting down worker.")
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+class ReplicaStore(CountryStore):
+    #Initialises a worker's replica of the supervisor's store.
+    #   -> The index inherited from the supervisor through fork is used as it is, so its memory stays shared until written to.
+    #[*] Parameters:
+    #   -> primary (CountryStore): The supervisor's store, as inherited by the worker.
+    #   -> link (SupervisorLink): The pipe to the supervisor, which inserts are forwarded to.
+    #[*] Returns: None
+    def __init__(self, primary:CountryStore, link:SupervisorLink):
+        self.__dict__.update(vars(primary))
+        self.lock = threading.RLock() # the supervisor's lock may have been held by another of its threads when it forked
+        self.logFile = primary.log.path if primary.log is not None else None
+        self.log = None # the log is only written (and compacted) by the supervisor
+        self.link = link
+        self.insertListener = None
+
+
+    #Returns the entries logged since the last compaction, read from the supervisor's write-ahead log without changing it.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> list: (country, city) entries.
+    def loggedEntries(self) -> list:
+        if(self.logFile is None):
+            return list()
+        return readRecords(self.logFile)[0]
+
+
+    #Snapshots and index files are only saved by the supervisor, as several workers writing one at once would clash.
+    #[*] Parameters:
+    #   -> index (dict | MappedIndex): The index read from the file.
+    #[*] Returns:
+    #   -> dict | MappedIndex: The given index, unsaved.
+    def saveSnapshot(self, index):
+        return index
+
+
+    #Adds a new country by forwarding it to the supervisor, which logs it and broadcasts it to every worker.
+    #   -> The pipe is waited on outside the lock, as the broadcast of another insert may need the lock meanwhile.
+    #[*] Parameters:
+    #   -> country (str): The country to add.
+    #   -> city (str): The capital city of the country.
+    #[*] Returns:
+    #   -> bool: True if the entry was added, False if the country already exists.
+    def add(self, country:str, city:str) -> bool:
+        with self.lock:
+            self.refresh(force=True)
+            if(normaliseCountry(country) in self.index):
+                return False
+        added = self.link.add(country, city)
+        if(added):
+            self.apply(country, city) # visible to this worker at once, whether or not the broadcast has arrived yet
+        return added
+
+
+    #Applies an insert made through the supervisor to the index, and tells the insert listener about it if it is new there.
+    #   -> The worker that forwarded the insert applies it both when it is answered and when it is broadcast, in either
+    #      order, so the listener is only told the first time.
+    #[*] Parameters:
+    #   -> country (str): The country added.
+    #   -> city (str): Its capital city.
+    #[*] Returns: None
+    def apply(self, country:str, city:str):
+        key = normaliseCountry(country)
+        with self.lock:
+            if(key in self.index):
+                return
+            self.index[key] = (country, city)
+        if(self.insertListener is not None):
+            self.insertListener(country, city)
+
+
+#Entry point of a worker process: replaces the inherited store with a replica linked to the supervisor, then serves
+#connections on its own SO_REUSEPORT socket until it is interrupted.
+#[*] Parameters:
+#   -> server (Server): The supervisor's server, as inherited by the worker.
+#   -> channel (multiprocessing.connection.Connection): The worker's end of the pipe to the supervisor.
+#   -> number (int): Number of the worker.
+#[*] Returns: None
+def runWorker(server, channel, number:int):
+    listener = restartLogging()
+    link = SupervisorLink(channel)
+    # a Ctrl-C reaches the whole process group, and the supervisor may then send SIGTERM too: the worker is only
+    # interrupted by the first of them, so that the others do not break into its shutdown
+    def interrupt(signum, frame):
+        if(not server.stopServer):
+            server.stopServer = True
+            raise KeyboardInterrupt
+    if(signal.getsignal(signal.SIGINT) is not signal.SIG_IGN): # as it is for a server started in the background
+        signal.signal(signal.SIGINT, interrupt)
+    signal.signal(signal.SIGTERM, interrupt)
+    server.store = ReplicaStore(server.store, link)
+    server.store.setInsertListener(server.countryAdded)
+    link.start(server.store)
+    server.workerId = number
+    if(server.profile):
+        server.profile = f"{server.profile}.{number}" # one profile per worker
+    try:
+        server.serveWorker()
+    finally:
+        if(listener is not None): # multiprocessing children exit without running atexit handlers
+            listener.stop()
+
+
+class Supervisor():
+    #Initialises the supervisor of the workers of a server.
+    #[*] Parameters:
+    #   -> server (Server): The server, with its store loaded and its socket bound.
+    #   -> workers (int): Number of worker processes.
+    #[*] Returns: None
+    def __init__(self, server, workers:int):
+        self.server = server
+        self.workers = workers
+        self.context = multiprocessing.get_context("fork") # workers inherit the loaded store
+        self.processes = dict() # worker number -> (process, channel, start time)
+        self.restarts = dict() # worker number -> time.monotonic() value at which to restart it
+        self.stopping = False
+
+
+    #Starts the workers, then serves their inserts and restarts the ones that die, until interrupted.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def run(self):
+        for number in range(self.workers):
+            self.startWorker(number)
+        log.info("Supervisor started %d workers", self.workers)
+        interrupted = False
+        try:
+            while(True):
+                self.serveOnce()
+        except KeyboardInterrupt:
+            interrupted = True
+        finally:
+            self.stopWorkers(interrupted and isForeground())
+
+
+    #Forks a worker.
+    #[*] Parameters:
+    #   -> number (int): Number of the worker.
+    #[*] Returns: None
+    def startWorker(self, number:int):
+        channel, workerChannel = self.context.Pipe()
+        process = self.context.Process(target=runWorker, args=(self.server, workerChannel, number), name=f"worker-{number}")
+        with self.server.store.lock: # so that the worker does not inherit a half-compacted store
+            process.start()
+        workerChannel.close()
+        self.processes[number] = (process, channel, time.monotonic())
+
+
+    #Waits up to a second for messages from the workers or for workers to exit, and handles them.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def serveOnce(self):
+        now = time.monotonic()
+        for number, due in list(self.restarts.items()):
+            if(due <= now):
+                del self.restarts[number]
+                self.startWorker(number)
+        channels = {channel:number for number, (process, channel, started) in self.processes.items()}
+        sentinels = {process.sentinel:number for number, (process, channel, started) in self.processes.items()}
+        for ready in wait(list(channels) + list(sentinels), timeout=1.0):
+            if(ready in sentinels):
+                self.workerExited(sentinels[ready])
+            elif(channels[ready] in self.processes):
+                self.handleMessage(channels[ready])
+
+
+    #Handles a message from a worker: an insert is applied to the store, broadcast to every worker if it was added,
+    #and its outcome sent back to the worker that forwarded it.
+    #[*] Parameters:
+    #   -> number (int): Number of the worker.
+    #[*] Returns: None
+    def handleMessage(self, number:int):
+        channel = self.processes[number][1]
+        try:
+            message = channel.recv()
+        except (EOFError, OSError): # the worker died, which its sentinel reports
+            return
+        if(message[0] != "add"):
+            return
+        _, requestId, country, city = message
+        added = self.server.store.add(country, city)
+        if(added):
+            for process, workerChannel, started in self.processes.values():
+                try:
+                    workerChannel.send(("added", country, city))
+                except OSError: # the worker is dying, and will inherit the insert when it is restarted
+                    pass
+        try:
+            channel.send(("result", requestId, added))
+        except OSError:
+            pass
+
+
+    #Cleans up after a worker that exited, and schedules its restart.
+    #[*] Parameters:
+    #   -> number (int): Number of the worker.
+    #[*] Returns: None
+    def workerExited(self, number:int):
+        process, channel, started = self.processes.pop(number)
+        process.join()
+        channel.close()
+        if(self.stopping):
+            return
+        log.warning("Worker %d (pid %d) exited with code %s. Restarting it.", number, process.pid, process.exitcode)
+        delay = RESTART_DELAY if time.monotonic() - started < MIN_UPTIME else 0
+        self.restarts[number] = time.monotonic() + delay
+
+
+    #Stops every worker with SIGTERM so that it shuts down cleanly, and terminates the ones that do not in time.
+    #   -> Workers that got the supervisor's Ctrl-C themselves are given GROUP_SIGNAL_GRACE to stop on their own first.
+    #[*] Parameters:
+    #   -> groupInterrupted (bool): Whether the supervisor was interrupted by a Ctrl-C, which the workers got too. Default is False.
+    #[*] Returns: None
+    def stopWorkers(self, groupInterrupted:bool=False):
+        self.stopping = True
+        if(groupInterrupted):
+            deadline = time.monotonic() + GROUP_SIGNAL_GRACE
+            for process, channel, started in self.processes.values():
+                process.join(max(0, deadline - time.monotonic()))
+        for process, channel, started in self.processes.values():
+            if(process.is_alive()):
+                os.kill(process.pid, signal.SIGTERM)
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for process, channel, started in self.processes.values():
+            process.join(max(0, deadline - time.monotonic()))
+            if(process.is_alive()):
+                process.terminate()
+                process.join()
+            channel.close()
+        self.processes.clear()
+
+
+#Tells whether the process runs in the foreground of its terminal, where a Ctrl-C is sent to its whole process group.
+#[*] Parameters: None
+#[*] Returns:
+#   -> bool: True if the process group is the foreground one of the terminal, False otherwise (or without a terminal).
+def isForeground() -> bool:
+    try:
+        return os.tcgetpgrp(sys.stdin.fileno()) == os.getpgrp()
+    except (OSError, ValueError, AttributeError):
+        return False
@@ -0,0 +1,250 @@
+# Search of the country names: ranked completions of a partial name, and fuzzy matches of a misspelt one
+# Names are folded (Unicode-normalised, casefolded and with runs of whitespace collapsed) when the index is built, so that
+# "UNITED  kingdom" and "United Kingdom" are the same name. Completions are found by binary search in the sorted starts of
+# the words of every name (a flattened trie), and fuzzy matches through an index of the trigrams of every name: only the
+# names sharing the most of the query's rarest trigrams have their edit distance to it worked out, so a query never scans
+# every name. The index is built from the country store, kept up to date as countries are added, and brought up to date
+# by a background thread when the store reloads or reads new lines from the countries file, so that searches never wait
+# for it.
+
+import logging, threading, unicodedata
+from bisect import bisect_left, insort
+from collections import Counter
+
+DEFAULT_SEARCH_LIMIT = 10 # matches returned when the query does not ask for a number
+MAX_SEARCH_LIMIT = 100
+MAX_CANDIDATES = 64 # completions ranked, and names sharing the most trigrams with a query whose edit distance is worked out
+GRAM_SIZE = 3
+INCREMENTAL_LIMIT = 1024 # new countries added to the index one by one when the store changes; with more it is rebuilt
+
+log = logging.getLogger("search")
+
+
+#Folds a name for case-insensitive comparison: Unicode-normalises and casefolds it, and collapses runs of whitespace.
+#   -> Unlike str.capitalize (the rule of the exact lookups), this also matches e.g. "Straße" with "STRASSE".
+#[*] Parameters:
+#   -> name (str): The name.
+#[*] Returns:
+#   -> str: The folded name.
+def foldName(name:str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", name).casefold().split())
+
+
+#Splits a folded name into its trigrams, padded so that its start and end count as trigrams of their own.
+#[*] Parameters:
+#   -> folded (str): The folded name.
+#[*] Returns:
+#   -> set: The trigrams.
+def nameGrams(folded:str) -> set:
+    padded = "$$" + folded + "$"
+    return {padded[start:start + GRAM_SIZE] for start in range(len(padded) - GRAM_SIZE + 1)}
+
+
+#Works out the edit distance (Levenshtein) of a query to a name, both to the whole name and to its closest prefix.
+#   -> Only the band of cells within the maximum of the diagonal is worked out, as the others are sure to exceed it, and
+#      it gives up as soon as both distances are sure to exceed the maximum.
+#[*] Parameters:
+#   -> query (str): The folded query.
+#   -> name (str): The folded name.
+#   -> maximum (int): The largest distance of interest.
+#[*] Returns:
+#   -> tuple: (distance to the whole name, distance to its closest prefix), each maximum + 1 if it is larger.
+def editDistances(query:str, name:str, maximum:int) -> tuple:
+    beyond = maximum + 1
+    row = [min(column, beyond) for column in range(len(name) + 1)]
+    for index, character in enumerate(query, 1):
+        previous, row = row, [beyond] * (len(name) + 1)
+        row[0] = min(index, beyond)
+        low, high = max(1, index - maximum), min(len(name), index + maximum)
+        for column in range(low, high + 1):
+            row[column] = min(previous[column] + 1, row[column - 1] + 1, previous[column - 1] + (character != name[column - 1]), beyond)
+        if(min(row[low - 1:high + 1]) >= beyond):
+            return (beyond, beyond)
+    return (row[-1], min(row))
+
+
+#Works out how many edits a fuzzy match of a query may be away from it: none for very short queries, which would match
+#almost anything, then one, then two.
+#[*] Parameters:
+#   -> query (str): The folded query.
+#[*] Returns:
+#   -> int: The largest edit distance of a match.
+def maxDistance(query:str) -> int:
+    if(len(query) <= 2):
+        return 0
+    return 1 if len(query) <= 5 else 2
+
+
+class SearchIndex():
+    #Initialises an empty index.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def __init__(self):
+        self.lock = threading.Lock() # connection threads search and add concurrently in thread-pool mode
+        self.entries = list() # (folded name, country, capital), by id
+        self.names = dict() # folded name -> id
+        self.starts = list() # sorted (folded name from the start of one of its words, id, word number)
+        self.grams = dict() # trigram -> ids of the names that contain it
+        self.known = set() # (country, capital) of every entry added, including those whose folded name was taken
+        self.generation = None # generation of the country store the index was built from, None until it is first built
+        self.builder = None # thread bringing the index up to date with the store, while one runs
+        self.pending = None # entries added while the builder runs, which it adds to an index it rebuilds
+
+
+    #Brings the index up to date with the country store, in a background thread, if the store has changed generation (it
+    #reloaded or read new lines from the countries file). Until the thread is done, searches use the index as it was.
+    #Entries added through the store are added to the index as they are (see add).
+    #[*] Parameters:
+    #   -> store (CountryStore): The country store.
+    #[*] Returns: None
+    def sync(self, store):
+        store.refresh()
+        generation = store.getGeneration()
+        if(generation == self.generation or self.builder is not None):
+            return
+        with self.lock:
+            if(generation != self.generation and self.builder is None):
+                self.pending = list()
+                self.builder = threading.Thread(target=self.buildInBackground, args=(store,), name="search-index", daemon=True)
+                self.builder.start()
+
+
+    #Runs build in the background thread started by sync.
+    #[*] Parameters:
+    #   -> store (CountryStore): The country store.
+    #[*] Returns: None
+    def buildInBackground(self, store):
+        try:
+            self.build(store)
+        except Exception:
+            log.exception("Failed to bring the search index up to date")
+        finally:
+            with self.lock:
+                self.builder = None
+                self.pending = None
+
+
+    #Brings the index up to date with the country store, in the calling thread.
+    #   -> If every entry indexed is still in the store and only a few were added to it, the new entries are added to the
+    #      index one by one, which is all a compaction of the write-ahead log or a few lines appended to the countries
+    #      file take.
+    #   -> Otherwise (the first build, or the countries file was edited) a new index is built without the lock, so that
+    #      searches carry on using the old one meanwhile, and swapped in along with the entries added during the build.
+    #[*] Parameters:
+    #   -> store (CountryStore): The country store.
+    #[*] Returns: None
+    def build(self, store):
+        generation = store.getGeneration()
+        items = store.items()
+        with self.lock:
+            added = [item for item in items if item not in self.known]
+            incremental = (self.generation is not None and len(items) - len(added) == len(self.known)
+                           and len(added) <= INCREMENTAL_LIMIT)
+        if(incremental):
+            for country, city in added:
+                self.add(country, city)
+        else:
+            index = SearchIndex()
+            for country, city in items:
+                index.insert(country, city)
+            index.starts.sort()
+            index.known.update(items)
+        with self.lock:
+            if(not incremental):
+                for country, city in self.pending or ():
+                    index.insert(country, city, insort)
+                    index.known.add((country, city))
+                self.entries, self.names, self.starts, self.grams, self.known = index.entries, index.names, index.starts, index.grams, index.known
+            self.generation = generation
+        log.info("Search index %s (%d names)", "updated" if incremental else "built", len(self.entries))
+
+
+    #Adds a country to the index, unless a country with the same folded name is already in it (the first entry wins).
+    #[*] Parameters:
+    #   -> country (str): The country.
+    #   -> city (str): Its capital city.
+    #[*] Returns: None
+    def add(self, country:str, city:str):
+        with self.lock:
+            self.insert(country, city, insort)
+            self.known.add((country, city))
+            if(self.pending is not None):
+                self.pending.append((country, city))
+
+
+    #Adds a country to the index. The caller holds the lock.
+    #[*] Parameters:
+    #   -> country (str): The country.
+    #   -> city (str): Its capital city.
+    #   -> place (callable): Adds a word start to the list of starts. Default is list.append, for a list sorted afterwards.
+    #[*] Returns: None
+    def insert(self, country:str, city:str, place=list.append):
+        folded = foldName(country)
+        if(not folded or folded in self.names):
+            return
+        entry = self.names[folded] = len(self.entries)
+        self.entries.append((folded, country, city))
+        start = 0
+        for word, part in enumerate(folded.split(" ")):
+            place(self.starts, (folded[start:], entry, word))
+            start += len(part) + 1
+        for gram in nameGrams(folded):
+            self.grams.setdefault(gram, list()).append(entry)
+
+
+    #Looks up a country by its folded name.
+    #[*] Parameters:
+    #   -> country (str): The country. It is folded before the lookup.
+    #[*] Returns:
+    #   -> tuple | None: (country, capital), or None if the country is not in the index.
+    def get(self, country:str):
+        with self.lock:
+            entry = self.names.get(foldName(country))
+            return self.entries[entry][1:] if entry is not None else None
+
+
+    #Finds the countries best matching a partial or misspelt name, best first.
+    #   -> Matches are ranked by edit distance, then whole names before completions of the start of a name, before
+    #      completions of a later word of a name (e.g. "kingdom" for "United Kingdom"), then shorter names first.
+    #[*] Parameters:
+    #   -> query (str): The partial name. It is folded before the search.
+    #   -> limit (int): Maximum number of matches returned. Default is 10.
+    #[*] Returns:
+    #   -> list: (country, capital) of every match.
+    def find(self, query:str, limit:int=DEFAULT_SEARCH_LIMIT) -> list:
+        query = foldName(query)
+        if(not query or limit <= 0):
+            return list()
+        ranks = dict() # id -> (distance, kind of match)
+        with self.lock:
+            position = bisect_left(self.starts, (query,))
+            candidates = max(limit, MAX_CANDIDATES)
+            while(position < len(self.starts) and len(ranks) < candidates and self.starts[position][0].startswith(query)):
+                suffix, entry, word = self.starts[position]
+                rank = (0, 0 if suffix == query and word == 0 else min(word, 1) + 1)
+                ranks[entry] = min(rank, ranks.get(entry, rank))
+                position += 1
+            maximum = maxDistance(query)
+            if(len(ranks) < limit and maximum):
+                # a name within d edits of the query (or of its start) shares all but at most 3d + 1 of its trigrams, so it
+                # shares at least one of the 3d + 2 rarest, and the lists of the more common trigrams need not be counted
+                postings = sorted((self.grams.get(gram, ()) for gram in nameGrams(query)), key=len)
+                shared = Counter()
+                for entries in postings[:3 * maximum + 2]:
+                    shared.update(entries)
+                for entry, count in shared.most_common(MAX_CANDIDATES):
+                    if(entry in ranks):
+                        continue
+                    whole, prefix = editDistances(query, self.entries[entry][0], maximum)
+                    if(whole <= maximum):
+                        ranks[entry] = (whole, 0)
+                    elif(prefix <= maximum):
+                        ranks[entry] = (prefix, 1)
+            best = sorted(ranks, key=lambda entry: (ranks[entry], len(self.entries[entry][0]), self.entries[entry][0]))
+            return [self.entries[entry][1:] for entry in best[:limit]]
+
+    def isReady(self) -> bool:
+        return self.generation is not None
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -1,237 +1,948 @@
-import csv, socket, sys
-from random import randint
-from socket import SOL_SOCKET, SO_REUSEADDR
-from packet import Packet
-from time import time
-from argparse import ArgumentParser
-from datetime import date, datetime
-from sys import getsizeof as size
-
-class Server():
-    #Initialises the Server class with a default port number of 6000.
-    #If a port number is provided as a command-line argument, it updates the server's port.
-    #[*] Parameters:
-    #   -> port (int): The port number for the server. Default is 6000.
-    #[*] Returns: None
-    def __init__(self, address:str = "127.0.0.1", port:int = 6000) -> None:
-        # update port
-        parser = ArgumentParser()
-        parser.add_argument("--port")
-        parser.add_argument("--address")
-        parser.add_argument("--file")
-        args = parser.parse_args()
-        if(args.port):
-            self.port = int(args.port)
-        else:
-            self.port = port
-        if(args.address):
-            self.address = str(args.address)
-        else:
-            self.address = str(address)
-        if(args.file):
-            self.countriesFile = str(args.file)
-        else:
-            self.countriesFile = "countries_capitals.csv"
-        self.studentNumber = 3404867
-
-        self.serverSocket = socket.socket()
-        self.stopServer = False
-        self.bufferSize = 1024
-
-        self.commandsExecution = {"c":self.getCity,
-                                "p":self.getPopulation,
-                                "a":self.addNewEntry,
-                                "h":self.heartbeat}
-        self.packet = Packet() # serves as a packet template to load and process received and transmitted packets
-
-    #Preprocesses the 'countries_capitals.csv' file to handle multiple countries in a single line.
-    #If a line contains multiple countries separated by " and ", it splits the line into separate entries,
-    #each with a shared capital city. The updated file is then written back to disk.
-    #[*] Parameters: None
-    #[*] Returns:None
-
-    def preprocessCountriesFile(self):
-        print("[*] Preprocessing countries file...")
-        rows = list()
-        with open(self.countriesFile, "r") as csvFile:
-            reader = csv.reader(csvFile)
-            for index, row in enumerate(reader):
-                rows.append(row)
-                if(" and " in row[0]):
-                    print("[!] Multiple countries in one line found. Fixing...")
-                    sharedCapital = row[1]
-                    countries = row[0].split(" and ")
-                    rows.remove(row)
-                    rows.append([countries[0],sharedCapital])
-                    rows.append([countries[1],sharedCapital])
-                    print("[*] Countries file updated, duplicate capital city fixed!")
-        with open(self.countriesFile, 'w', newline='') as csvFile:
-            writer = csv.writer(csvFile)
-            for row in rows:
-                writer.writerow(row)
-
-
-    #This function initializes and runs the server. It sets up the server details,
-    #waits for a client connection, and handles incoming messages.
-    #[*] Parameters: None
-    #[*] Returns: None
-    def run(self):
-        try:
-            self.preprocessCountriesFile()
-        except FileNotFoundError as e:
-            self.stopProgram("Countries file not found. Please make sure it is in the same directory as the server program.", type(e).__name__)
-
-        # initialise server details
-        self.serverSocket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-        self.serverSocket.settimeout(30) # 30 second timeout
-
-        # attempt to bind the socket
-        try:
-            self.serverSocket.bind((self.address, self.port))
-        except OverflowError as e:
-            self.stopProgram("Port number may be too high or too low. Ensure the port number is 0-65535", type(e).__name__)
-        except OSError as e:
-            self.stopProgram("Inputted IP Address is not valid in the current context. Ensure the IP address is correct and try again.", type(e).__name__)
-        self.serverSocket.listen(2)
-        print("Server started on " + self.address + ":" + str(self.port))
-
-        # wait for connection
-        print("Waiting for client connection...")
-        try:
-            self.conn, address = self.serverSocket.accept()
-        except TimeoutError as e:
-            self.stopProgram("Connection timed out. Ensure client and server have matching IP addresses and port numbers.", type(e).__name__)
-        print("Connection established from " + str(address))
-
-        # main server listening loop
-        while(not self.stopServer):
-            self.receiveMessage()
-        self.stopProgram() # realistically the program shouldn't ever arrive here, this is just for redundancy
-
-    #This function receives a message from the connected client, processes it, and responds accordingly.
-    #[*] Parameters: None
-    #[*] Returns: None
-    #[*] Raises:
-    #   -> ValueError: If a null packet is received, indicating a disconnection from the client.
-    def receiveMessage(self):
-        try:
-            data = self.conn.recv(self.bufferSize)
-            if not (size(data) > self.bufferSize):
-                print(f"[*] Received message! {str(size(data))} bytes (compressed)")
-            else:
-                self.stopProgram("Received message! Exceeded buffer size.", type(Exception).__name__)
-        except ConnectionAbortedError as e:
-            self.stopProgram("Client disconnected.", type(e).__name__)
-            return
-        try:
-            self.packet.createPacketFromString(data)
-            if self.packet.getCommand() in self.commandsExecution:
-                print(f"[*] Message Contents\n -> Command: {self.packet.getCommand()}\n -> Contents: {self.packet.getContents()}\n -> Size (uncompressed): {str(self.packet.getSize())} bytes")
-                reply = self.commandsExecution[self.packet.getCommand()](self.packet.getContents()) 
-                self.packet.emptyPacket()
-                self.transmitMessage(self.conn,reply)
-            else:
-                self.transmitMessage(self.conn,"Invalid command received by server")
-        except ValueError as e:
-            if(not data) or data == "": 
-                self.stopProgram("Null packet received, client may have been disconnected.", type(e).__name__)
-
-
-    #Transmits a message to the connected client using the provided socket connection.
-    #[*] Parameters:
-    #   -> conn (socket.socket): The socket connection to the client.
-    #   -> message (str): The message to be transmitted.
-    #[*] Returns:
-    #   -> None: This function does not return any value. It sends the message to the client.
-    def transmitMessage(self, conn:socket.socket, message:str):
-        self.packet.createNewPacket("",message)
-        message = self.packet.generatePacket()
-        self.packet.emptyPacket()
-        conn.send(message)
-        print("[*] Message Transmitted!")
-
-
-    #Retrieves the capital city of a given country from the 'countries_capitals.csv' file.
-    #[*] Parameters:
-    #   -> country (str): The name of the country for which the capital city is to be retrieved.
-    #[*] Returns:
-    #   -> str: The capital city of the given country. If the country is not found in the file,
-    #           the function returns "No country found."
-    def getCity(self, country:str) -> str:
-        print(f"[*] Retrieving capital city for {country}...")
-        country = country.capitalize() # normalise the input
-        with open(self.countriesFile, "r") as csvFile:
-            reader = csv.reader(csvFile)
-            next(reader, None) # skip the header [Country, City]
-            for index, row in enumerate(reader):
-                if(row[0] == country): 
-                    print(f"[*] Found capital city {row[1]}")
-                    return row[1]
-            return "No country found."
-
-
-    #Retrieves the estimated population of a given country from the 'countries_capitals.csv' file.
-    #The population is calculated as a random number between 1 and 10 times the student number.
-    #[*] Parameters:
-    #   -> country (str): The name of the country for which the population is to be retrieved.
-    #[*] Returns:
-    #   -> str: The estimated population of the given country. If the country is not found in the file,
-    #           the function returns "Country not found."
-    def getPopulation(self, country:str) -> str:
-        print(f"[*] Retrieving estimated population for {country}...")
-        country = country.capitalize() # normalise the input
-        with open(self.countriesFile, "r") as csvFile:
-            reader = csv.reader(csvFile)
-            next(reader, None) # skip the header [Country, City]
-            for index, row in enumerate(reader):
-                if(row[0] == country): return str(randint(1,10) * self.studentNumber)
-        return "No country found"
-
-
-    #Adds a new entry to the 'countries_capitals.csv' file.
-    #[*] Parameters:
-    #   -> countryCityPair (str): A string containing the country and city separated by a comma.
-    #                             The country and city names are expected to be in lowercase.
-    #[*] Returns:
-    #   -> str: A message indicating the success or failure of the operation.
-    #           If the country does not exist in the file, the new entry is added and a success message is returned.
-    #           If the country already exists in the file, a failure message is returned.
-    def addNewEntry(self, countryCityPair:str) -> str:
-        country,city = countryCityPair.split(",")
-        country = country.capitalize() # normalise the input
-        city = city.capitalize() # normalise the input
-        print(f"[*] Adding new entry for {country} with {city}...")
-        if(self.getCity(country) == "No country found."):
-            with open(self.countriesFile ,'a', newline='') as csvFile:
-                csv.writer(csvFile).writerow([country, city])
-                print(f"{country} and {city} successfully added to database")
-                return f"{country} and {city} successfully added to database"
-        return "Country already exists"
-
-
-    #This function serves as a heartbeat mechanism for the server. It is called periodically to check the server's status.
-    #[*] Parameters:
-    #   -> *externalMessage (tuple): This parameter is not used in this function. It is included to maintain consistency with other command execution functions.
-    #[*] Returns:
-    #   -> str: A string indicating the success of the heartbeat. In this case, it always returns "beat".
-    def heartbeat(self, *externalMessage) -> str:
-            print("[*] Heart -> beat")
-            return "beat"
-
-
-    #This function stops the server and closes the connection. It also prints a shutdown message and exits the program.
-    #[*] Parameters:
-    #   -> message (str): A custom message to be printed when the server is shut down. Default is "Server has been shut down successfully."
-    #   -> *error (str): Variable length argument list to capture any error messages. This argument is not used in the function's logic.
-    #[*] Returns:
-    #   -> None: This function does not return any value. It closes the server connection, prints a shutdown message, and exits the program.
-    def stopProgram(self, message="Server has been shut down successfully.", *error:str) -> None:
-        try:
-            self.conn.close()
-            print("[!] Server connection closed.")
-        except (NameError, AttributeError): # connection was never established or doesn't exist
-            pass
-        sys.exit(f"[!] {error[0]} detected: {message}")
-
-s = Server()
-s.run()
\ No newline at end of file
+import asyncio, cProfile, json, logging, os, socket, sys, threading
+from concurrent.futures import ThreadPoolExecutor
+from random import randint
+from socket import SOL_SOCKET, SO_REUSEADDR
+from packet import Packet, encodeInto, encodePacket, decodeFrom
+from framing import FrameReader, FrameError, HEADER, FLAG_BUSY, FLAG_MORE, FLAG_CODEC_MASK, PING_FRAME, byteToCommand, packHeader, setRequestId, unpackHeader
+from compression import CompressionPolicy, CODECS, DECOMPRESSION_ERRORS, DICTIONARY_CODECS, buildDictionary
+from store import CountryStore, normaliseCountry
+from cache import ResponseCache, DEFAULT_CACHE_SIZE
+from search import SearchIndex, DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT
+from keepalive import KeepaliveScheduler, DEFAULT_PING_INTERVAL, DEFAULT_IDLE_TIMEOUT
+from limits import RateLimiter, parseLimits
+from prefork import Supervisor
+from commands import Command, CommandRegistry, BackgroundLoop
+from persistence import WriteAheadLog
+from metrics import Metrics
+from logs import LOG_LEVELS, setupLogging
+from time import perf_counter
+from argparse import ArgumentParser
+
+log = logging.getLogger("server")
+
+CACHED_COMMANDS = ("c",) # commands whose reply frames are cached; not "p", as its reply is random
+BUSY_REPLY = "Server busy, retry later" # contents of the replies flagged FLAG_BUSY
+BUSY_FRAME = packHeader("", FLAG_BUSY, len(BUSY_REPLY)) + BUSY_REPLY.encode("utf-8") # sent uncompressed to connections turned away
+DEFAULT_SEND_TIMEOUT = 10.0 # seconds a client may leave its replies unread before it is disconnected
+WRITE_BUFFER_LIMIT = 64 * 1024 # bytes of replies queued for a connection in asyncio mode before the server waits for it to read them
+HANDLER_ERROR_REPLY = "Command failed on server" # reply to a request whose handler raised
+INVALID_ENTRY_REPLY = "Invalid entry, expected <country>,<city>"
+EXPORT_CHUNK_SIZE = 1000 # countries per frame of the reply of the export command
+
+class Server():
+    #Initialises the Server class with a default port number of 6000.
+    #[*] Parameters:
+    #   -> address (str): The address to listen on. Default is localhost.
+    #   -> port (int): The port number for the server. Default is 6000.
+    #   -> countriesFile (str): Path to the countries file. Default is "countries_capitals.csv".
+    #   -> mode (str): "async" to serve connections from an asyncio event loop, "threads" for a thread pool with one
+    #                  worker per connection, or "prefork" for several worker processes each with an event loop. Default is "async".
+    #   -> threads (int): Maximum number of connections served at once in thread-pool mode, which caps maxConnections.
+    #                     Default is 256.
+    #   -> codec (str): Preferred compression codec, negotiated with each client. Default is "zlib".
+    #   -> compressionLevel (int | None): Compression level, or None for the codec's default. Default is None.
+    #   -> compressionThreshold (int | None): Replies smaller than this many bytes are sent uncompressed. Default is None (codec default).
+    #   -> durable (bool): Wait for new entries to be synced to disk before replying, rather than writing behind. Default is False.
+    #   -> profile (str | None): File to write cProfile stats of the serving loop to when the server stops. Default is None (no profiling).
+    #   -> cacheSize (int): Maximum number of reply frames kept in the response cache, 0 to disable it. Default is 4096.
+    #   -> workers (int | None): Number of worker processes in prefork mode. Default is None, one per CPU core.
+    #   -> backend (str): "memory" to index the countries file in a dictionary, or "mmap" for a memory-mapped, sorted index
+    #                     file, for datasets too large to hold in memory. Default is "memory".
+    #   -> pingInterval (float): Seconds a connection may be silent before it is sent a keepalive ping, 0 to never ping.
+    #                            Default is 30 seconds.
+    #   -> idleTimeout (float): Seconds a connection may be silent before it is closed, 0 to never close it. Default is 90 seconds.
+    #   -> rateLimits (dict | None): command -> requests per second allowed to each client, "*" limiting all of its requests.
+    #                                Requests over a limit get a busy reply. Default is None, no limits.
+    #   -> maxConnections (int): Maximum number of connections served at once, 0 for no limit (in thread-pool mode, the
+    #                            number of threads). Connections over it are sent a busy frame and closed. Default is 0.
+    #   -> sendTimeout (float): Seconds a client may leave its replies unread before it is disconnected, 0 to wait forever.
+    #                           Default is 10 seconds.
+    #   -> search (str | None): When the search index of the i and f commands is built: "eager" before serving, "lazy" in
+    #                           the background once first needed, or "off" to never build it, the commands then falling back
+    #                           to the exact and prefix lookups of the store. Default is None, eager with the memory backend
+    #                           and lazy with the mmap one, whose point is not to hold every name in memory.
+    #[*] Returns: None
+    def __init__(self, address:str = "127.0.0.1", port:int = 6000, countriesFile:str = "countries_capitals.csv", mode:str = "async",
+                 threads:int = 256, codec:str = "zlib", compressionLevel:int = None, compressionThreshold:int = None, durable:bool = False,
+                 profile:str = None, cacheSize:int = DEFAULT_CACHE_SIZE, workers:int = None,
+                 backend:str = "memory", pingInterval:float = DEFAULT_PING_INTERVAL,
+                 idleTimeout:float = DEFAULT_IDLE_TIMEOUT, rateLimits:dict = None, maxConnections:int = 0,
+                 sendTimeout:float = DEFAULT_SEND_TIMEOUT, search:str = None) -> None:
+        self.address = str(address)
+        self.port = int(port)
+        self.countriesFile = str(countriesFile)
+        self.mode = mode
+        self.threads = threads
+        self.workers = workers if workers else os.cpu_count() or 1
+        self.backend = backend
+        self.workerId = None # number of this worker process in prefork mode
+        # compression policy copied to every connection, whose codec is then negotiated with the client
+        self.compression = CompressionPolicy(codec, compressionLevel, compressionThreshold)
+        self.durable = durable
+        self.profile = profile
+        self.profiler = None
+        self.metrics = Metrics() # counters and latency histograms, reported by the stats command; a profiling hook can be set on it
+        self.cache = ResponseCache(cacheSize) # encoded reply frames of hot lookups
+        self.search = SearchIndex() # folded country names, for case-insensitive lookups and searches
+        self.searchMode = search or ("lazy" if backend == "mmap" else "eager")
+        self.keepalive = KeepaliveScheduler(pingInterval, idleTimeout) # pings silent connections and reaps dead ones
+        self.limiter = RateLimiter(rateLimits) # token buckets of the requests of each client
+        # in thread-pool mode a connection holds a worker for as long as it is open, so connections beyond the pool's size
+        # would wait in its queue with no reply: they are turned away instead
+        self.maxConnections = min(maxConnections or threads, threads) if mode == "threads" else maxConnections
+        self.sendTimeout = sendTimeout
+        self.studentNumber = 3404867
+
+        self.serverSocket = socket.socket()
+        self.stopServer = False
+        self.bufferSize = 1024
+        self.backlog = 1024 # pending connections queued by the kernel before accept()
+        self.connections = set() # open client connections (sockets, or stream writers in asyncio mode)
+
+        # commands answered by the server, advertised to every client when it connects; more can be registered before it runs
+        self.commands = CommandRegistry()
+        self.commands.register("c", "GET_CITY", self.getCity, "Get the capital city of a country")
+        self.commands.register("p", "GET_POPULATION", self.getPopulation, "Get the estimated population of a country")
+        # adds check the countries file and write to the log, wait for the group commit when durable and for the supervisor
+        # in prefork mode, and wait for the store's lock while the log is compacted, so they are kept off the event loop
+        self.commands.register("a", "ADD_NEW_COUNTRY", self.addNewEntry, "Add a country and its capital city", blocking=True)
+        self.commands.register("h", "HEART", self.heartbeat, "Check that the server is alive")
+        self.commands.register("b", "GET_CITIES", self.getCities, "Get the capital cities of several countries, one per line")
+        self.commands.register("i", "GET_CITY_ANY_CASE", self.getCityAnyCase, "Get the capital city of a country, ignoring case")
+        self.commands.register("f", "FIND_COUNTRY", self.findCountries, "Find the countries matching a partial or misspelt name")
+        self.commands.register("s", "STATS", self.getStats, "Get the server's metrics")
+        self.commands.register("e", "EXPORT", self.exportCountries, "Export every country and its capital city", blocking=True)
+        # changes the state of the connection it arrives on, so its handler also receives the connection's compression policy
+        self.commands.register("n", "NEGOTIATE", self.negotiateCompression, "Negotiate the compression codec", connection=True)
+        self.commands.register("?", "CAPABILITIES", self.commands.getCapabilities, "List the commands of the server")
+        self.background = BackgroundLoop() # runs the handlers that are not plain functions in thread-pool mode
+        self.store = None # in-memory country index, loaded from the countries file (or its snapshot) when the server starts
+
+    #This function initializes and runs the server. It sets up the server details,
+    #then serves client connections concurrently using the selected mode (asyncio, thread pool or prefork worker processes).
+    #[*] Parameters: None
+    #[*] Returns: None
+    def run(self):
+        try:
+            self.store = CountryStore(self.countriesFile, log=WriteAheadLog(self.countriesFile + ".wal"), durable=self.durable,
+                                      mapped=self.backend == "mmap")
+            self.store.setInsertListener(self.countryAdded)
+            self.compression.setDictionary(buildDictionary(self.store.items())) # preset dictionary for the zdict and zstream codecs
+            if(self.searchMode == "eager"):
+                self.search.build(self.store) # built before serving (and, in prefork mode, before forking), not by the first search
+        except FileNotFoundError as e:
+            self.stopProgram("Countries file not found. Please make sure it is in the same directory as the server program.", type(e).__name__)
+        self.bindSocket()
+        if(self.mode == "prefork"):
+            # the supervisor's socket is bound but never listens: it checks the address and holds the port for the workers
+            log.info("Server started on %s:%d (prefork mode, %d workers)", self.address, self.port, self.workers)
+            Supervisor(self, self.workers).run()
+            self.stopProgram()
+        self.serve()
+
+
+    #Binds the server socket to the server's address and port. In prefork mode, the port is shared with SO_REUSEPORT.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def bindSocket(self):
+        # initialise server details
+        self.serverSocket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        if(self.mode == "prefork"):
+            if(not hasattr(socket, "SO_REUSEPORT")):
+                self.stopProgram("Prefork mode needs SO_REUSEPORT, which is not supported on this platform. Use async or threads mode.")
+            self.serverSocket.setsockopt(SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+        # attempt to bind the socket
+        try:
+            self.serverSocket.bind((self.address, self.port))
+        except OverflowError as e:
+            self.stopProgram("Port number may be too high or too low. Ensure the port number is 0-65535", type(e).__name__)
+        except OSError as e:
+            self.stopProgram("Inputted IP Address is not valid in the current context. Ensure the IP address is correct and try again.", type(e).__name__)
+
+
+    #Serves client connections from a prefork worker process, on its own socket sharing the port of the other workers.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def serveWorker(self):
+        self.serverSocket.close() # inherited from the supervisor
+        self.serverSocket = socket.socket()
+        self.bindSocket()
+        self.serve()
+
+
+    #Listens on the bound socket and serves client connections until the server is stopped.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def serve(self):
+        self.serverSocket.listen(self.backlog)
+        if(self.workerId is None):
+            log.info("Server started on %s:%d (%s mode)", self.address, self.port, self.mode)
+        else:
+            log.info("Worker %d (pid %d) started on %s:%d", self.workerId, os.getpid(), self.address, self.port)
+
+        # main server loop, serving every client connection until the server is stopped
+        log.info("Waiting for client connections...")
+        if(self.profile):
+            self.profiler = cProfile.Profile() # profiles the thread running the loop, which serves every connection in async mode
+            self.profiler.enable()
+        try:
+            if(self.mode == "threads"):
+                self.runThreaded()
+            else:
+                asyncio.run(self.runAsync())
+        except KeyboardInterrupt:
+            pass
+        self.stopProgram()
+
+
+    #Accepts connections on the listening socket and hands each one to a worker of a thread pool.
+    #   -> The accept call times out every second so that the loop notices when stopServer is set.
+    #   -> Connections beyond the pool size wait in the pool's queue until a worker is free. With a connection limit, the
+    #      queue is bounded, as connections over the limit are turned away.
+    #   -> When the loop ends, open connections are shut down so that their workers return.
+    #   -> Keepalive deadlines are run by a thread of their own.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def runThreaded(self):
+        self.serverSocket.settimeout(1)
+        if(self.keepalive.isEnabled()):
+            threading.Thread(target=self.keepalive.serve, args=(lambda: self.stopServer,), name="keepalive", daemon=True).start()
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="connection") as pool:
+            try:
+                while(not self.stopServer):
+                    try:
+                        conn, address = self.serverSocket.accept()
+                    except socket.timeout:
+                        continue
+                    if(not self.admitConnection(address, conn.send)):
+                        conn.close()
+                        continue
+                    conn.settimeout(self.sendTimeout or None) # also wakes up reads, so that the worker notices when the server stops
+                    self.connections.add(conn)
+                    try:
+                        conn.sendall(self.commands.getAdvertisement())
+                    except OSError: # already closed by the client, which its worker finds out
+                        pass
+                    try:
+                        pool.submit(self.handleConnection, conn, address)
+                    except RuntimeError: # the pool is shutting down, so the connection is never served
+                        self.connections.discard(conn)
+                        conn.close()
+                        raise
+            finally:
+                self.stopServer = True
+                for conn in list(self.connections):
+                    try:
+                        conn.shutdown(socket.SHUT_RDWR)
+                    except OSError: # already closed by the client
+                        pass
+
+
+    #Serves a single client connection in thread-pool mode until the client disconnects.
+    #Each connection gets its own copy of the compression policy, as the codec is negotiated per connection, and its own
+    #FrameReader, which receives straight into a reusable buffer and may hand out several frames per read.
+    #The replies to all of the frames of one read (pipelined requests) are encoded into a reusable output buffer and sent together.
+    #Keepalive pings are sent from the keepalive thread, so sends to the connection are serialised by a lock.
+    #Commands that are not run inline (see runsInline) are run once the replies to the frames before them are sent.
+    #A client that leaves its replies unread for the send timeout, so that they no longer fit in the socket's buffers, is disconnected.
+    #[*] Parameters:
+    #   -> conn (socket.socket): The accepted client connection.
+    #   -> address (tuple): The address of the client.
+    #[*] Returns: None
+    def handleConnection(self, conn:socket.socket, address:tuple):
+        log.info("Connection established from %s", address)
+        self.metrics.increment("connections.opened")
+        policy = self.compression.copy()
+        peer = None
+        try:
+            with conn:
+                reader = FrameReader(self.bufferSize)
+                output = bytearray(self.bufferSize)
+                sending = threading.Lock()
+                peer = self.keepalive.register(lambda: self.sendPing(conn.sendall, sending, conn.shutdown, socket.SHUT_RDWR),
+                                               lambda: self.reapConnection(address, conn.shutdown, socket.SHUT_RDWR))
+                while(not self.stopServer):
+                    try:
+                        try:
+                            received = reader.recvFrom(conn)
+                        except socket.timeout: # nothing received for a while, which the keepalive deals with
+                            continue
+                        if(not received):
+                            break
+                        if(peer is not None):
+                            peer.touch()
+                        self.metrics.increment("bytes.received", received)
+                        end = 0
+                        for frame in reader.frames():
+                            offset = self.handleFrame(frame, policy, output, end, address[0])
+                            if(offset is None):
+                                if(end):
+                                    with sending:
+                                        self.transmitMessage(conn, memoryview(output)[:end])
+                                self.runCommandThreaded(conn, sending, frame, policy)
+                                offset = 0
+                            end = offset
+                        if(end):
+                            with sending:
+                                self.transmitMessage(conn, memoryview(output)[:end])
+                    except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
+                        break
+                    except socket.timeout:
+                        self.dropSlowClient(address)
+                        break
+                    except FrameError as e:
+                        log.warning("%s detected: %s. Closing connection.", type(e).__name__, e)
+                        self.metrics.increment("errors.frame")
+                        break
+        except Exception:
+            log.exception("Error serving connection from %s", address)
+            self.metrics.increment("errors.connection")
+        finally:
+            self.connections.discard(conn) # frees its slot under the connection limit (see admitConnection), however it ended
+            self.keepalive.unregister(peer)
+            self.metrics.increment("connections.closed")
+            log.info("Connection closed from %s (compression ratio %.2f)", address, policy.getStats().getRatio())
+
+
+    #Runs the asyncio event loop server on the already bound listening socket, with keepalive deadlines run by a task.
+    #[*] Parameters: None
+    #[*] Returns: None
+    async def runAsync(self):
+        self.serverSocket.setblocking(False)
+        server = await asyncio.start_server(self.handleStreamConnection, sock=self.serverSocket)
+        keepalive = asyncio.create_task(self.keepalive.serveAsync()) if self.keepalive.isEnabled() else None
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if(keepalive is not None):
+                keepalive.cancel()
+
+
+    #Serves a single client connection in asyncio mode until the client disconnects.
+    #Each connection gets its own copy of the compression policy, as the codec is negotiated per connection, and its own
+    #FrameReader to reassemble frames from the stream. The replies to all of the frames of one read are written together.
+    #The next read waits until the queued replies are down to the write buffer limit, which a client that leaves its replies
+    #unread must reach within the send timeout, or be disconnected.
+    #Commands that are not run inline (see runsInline) are awaited once the replies to the frames before them are written, so
+    #that the requests of a connection are still carried out in order.
+    #[*] Parameters:
+    #   -> reader (asyncio.StreamReader): Stream to read client messages from.
+    #   -> writer (asyncio.StreamWriter): Stream to write replies to.
+    #[*] Returns: None
+    async def handleStreamConnection(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        address = writer.get_extra_info("peername")
+        if(not self.admitConnection(address, writer.write)):
+            writer.close()
+            return
+        log.info("Connection established from %s", address)
+        self.metrics.increment("connections.opened")
+        policy = self.compression.copy()
+        peer = None
+        try:
+            self.connections.add(writer)
+            frameReader = FrameReader(self.bufferSize)
+            writer.transport.set_write_buffer_limits(WRITE_BUFFER_LIMIT)
+            writer.write(self.commands.getAdvertisement())
+            peer = self.keepalive.register(lambda: self.sendPing(writer.write), lambda: self.reapConnection(address, writer.transport.abort))
+            while(not self.stopServer):
+                data = await reader.read(self.bufferSize)
+                if(not data):
+                    break
+                if(peer is not None):
+                    peer.touch()
+                self.metrics.increment("bytes.received", len(data))
+                frameReader.feed(data)
+                output = bytearray() # a new buffer each time, as the transport may hold on to it until it is sent
+                for frame in frameReader.frames():
+                    if(self.handleFrame(frame, policy, output, len(output), address[0]) is None):
+                        await self.writeReplies(writer, output)
+                        output = bytearray()
+                        await self.runCommand(writer, frame, policy)
+                await self.writeReplies(writer, output)
+        except (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
+            pass
+        except asyncio.TimeoutError:
+            self.dropSlowClient(address)
+            writer.transport.abort() # its unsent replies are discarded rather than waited for
+        except FrameError as e:
+            log.warning("%s detected: %s. Closing connection.", type(e).__name__, e)
+            self.metrics.increment("errors.frame")
+        except Exception:
+            log.exception("Error serving connection from %s", address)
+            self.metrics.increment("errors.connection")
+        finally:
+            self.connections.discard(writer) # frees its slot under the connection limit (see admitConnection), however it ended
+            self.keepalive.unregister(peer)
+            writer.close()
+            self.metrics.increment("connections.closed")
+            log.info("Connection closed from %s (compression ratio %.2f)", address, policy.getStats().getRatio())
+
+
+    #Writes the replies to the frames of a read to a connection in asyncio mode, then waits until the replies queued for it
+    #are down to the write buffer limit.
+    #[*] Parameters:
+    #   -> writer (asyncio.StreamWriter): Stream to write replies to.
+    #   -> output (bytearray): The encoded replies, which may be empty.
+    #[*] Returns: None
+    #[*] Raises:
+    #   -> asyncio.TimeoutError: If the client leaves its replies unread for the send timeout.
+    async def writeReplies(self, writer:asyncio.StreamWriter, output:bytearray):
+        start = perf_counter()
+        if(output):
+            writer.write(output)
+            log.debug("Message Transmitted!")
+        if(writer.transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT): # drain waits for the client to read
+            await asyncio.wait_for(writer.drain(), self.sendTimeout or None)
+        else:
+            await writer.drain()
+        if(output):
+            self.metrics.observe("send", "*", perf_counter() - start)
+            self.metrics.increment("bytes.sent", len(output))
+
+
+    #Handles one frame received from a client: works out the reply and encodes it into the connection's output buffer,
+    #timing the encoding under the command of the request.
+    #   -> Requests over the client's rate limits are not carried out, and get a busy reply instead. They are still
+    #      decoded, as the zstream codec's decompressor must see every frame of the connection.
+    #   -> Commands that are not run inline (see runsInline) are left to the caller, which runs them once the replies
+    #      encoded so far are sent.
+    #[*] Parameters:
+    #   -> frame (memoryview): The frame received from the client.
+    #   -> policy (CompressionPolicy): The connection's compression policy.
+    #   -> output (bytearray): The output buffer.
+    #   -> offset (int): Offset in the output buffer to encode the reply at.
+    #   -> client (str | None): The client's host, which its rate limits are kept by. Default is None.
+    #[*] Returns:
+    #   -> int | None: The offset just after the reply, or None if the command is left to the caller.
+    def handleFrame(self, frame, policy:CompressionPolicy, output:bytearray, offset:int, client:str=None):
+        command = byteToCommand(frame[1]) # the frame header has been validated by the FrameReader
+        if(not command): # the answer to a keepalive ping, which has done its job by arriving
+            return offset
+        if(self.limiter.isEnabled() and not self.limiter.allow(client, command)):
+            self.metrics.increment("rejected.ratelimit")
+            try:
+                decodeFrom(frame, policy) # not carried out, but decoded all the same to keep a zstream decompressor in step
+            except DECOMPRESSION_ERRORS:
+                self.metrics.increment("errors.decode")
+            return encodeInto(Packet("", BUSY_REPLY, unpackHeader(frame)[2], FLAG_BUSY), output, offset, policy)
+        handler = self.commands.get(command)
+        if(handler is not None and not self.runsInline(handler)):
+            return None
+        if(handler is not None and command in CACHED_COMMANDS and self.cache.isEnabled() and policy.isStateless()):
+            end = self.replyFromCache(command, frame, policy, output, offset)
+            if(end is not None):
+                return end
+        reply = self.receiveMessage(frame, policy)
+        start = perf_counter()
+        end = encodeInto(reply, output, offset, policy)
+        self.metrics.observe("encode", command, perf_counter() - start)
+        return end
+
+
+    #Replies to a cacheable lookup through the response cache: on a hit, the cached frame is copied into the output buffer
+    #with the request id patched in, skipping the lookup, the new Packet and the compression. On a miss, the reply is worked
+    #out and encoded as usual, and its frame is cached.
+    #   -> The country store is still checked for external edits, which clear the cache.
+    #[*] Parameters:
+    #   -> command (str): The command of the frame, one of CACHED_COMMANDS.
+    #   -> frame (memoryview): The frame received from the client.
+    #   -> policy (CompressionPolicy): The connection's compression policy, which must be stateless.
+    #   -> output (bytearray): The output buffer.
+    #   -> offset (int): Offset in the output buffer to encode the reply at.
+    #[*] Returns:
+    #   -> int | None: The offset just after the reply, or None if the frame could not be decoded, which is left to receiveMessage.
+    def replyFromCache(self, command:str, frame, policy:CompressionPolicy, output:bytearray, offset:int):
+        start = perf_counter()
+        try:
+            packet = decodeFrom(frame, policy)
+        except DECOMPRESSION_ERRORS:
+            return None
+        decoded = perf_counter()
+        self.metrics.observe("decode", command, decoded - start)
+        self.store.refresh()
+        self.cache.sync(self.store.getGeneration())
+        key = (command, normaliseCountry(packet.getContents()), policy.codec)
+        entry = self.cache.get(key)
+        if(entry is None):
+            epoch = self.cache.getEpoch() # read before the lookup, so a reply made stale by an insert meanwhile is not cached
+            reply = self.callHandler(self.commands.get(command), packet.getContents(), policy)
+            lookedUp = perf_counter()
+            self.metrics.observe("lookup", command, lookedUp - decoded)
+            end = encodeInto(Packet("", reply, packet.getRequestId()), output, offset, policy)
+            if(reply is not HANDLER_ERROR_REPLY): # a failure is not cached, so the lookup is tried again next time
+                codec = unpackHeader(output, offset)[1] & FLAG_CODEC_MASK
+                self.cache.put(key, (bytes(output[offset:end]), len(reply.encode("utf-8")), codec), epoch)
+            self.metrics.observe("encode", command, perf_counter() - lookedUp)
+            return end
+        cachedFrame, rawBytes, codec = entry
+        end = offset + len(cachedFrame)
+        if(len(output) < end):
+            output.extend(bytes(end - len(output)))
+        output[offset:end] = cachedFrame
+        setRequestId(output, offset, packet.getRequestId())
+        policy.getStats().record(codec, rawBytes, len(cachedFrame) - HEADER.size)
+        self.metrics.observe("encode", command, perf_counter() - decoded)
+        return end
+
+
+    #This function processes a message received from a client and generates the reply to send back.
+    #The command is dispatched through the command registry, and the reply carries the request id of the message.
+    #Only commands run inline (see runsInline) get here.
+    #   -> Decoding and the command's handler (lookup) are timed for the metrics, under the command of the message.
+    #[*] Parameters:
+    #   -> data (bytes | memoryview): The frame received from the client.
+    #   -> policy (CompressionPolicy): The connection's compression policy, used to decompress the message.
+    #[*] Returns:
+    #   -> Packet: The reply packet.
+    def receiveMessage(self, data:bytes, policy:CompressionPolicy) -> Packet:
+        log.debug("Received message! %d bytes (compressed)", len(data))
+        start = perf_counter()
+        try:
+            packet = decodeFrom(data, policy)
+        except DECOMPRESSION_ERRORS: # includes UnicodeDecodeError, a ValueError
+            self.metrics.increment("errors.decode")
+            return Packet("", "Invalid packet received by server", unpackHeader(data)[2])
+        decoded = perf_counter()
+        command = packet.getCommand()
+        self.metrics.observe("decode", command, decoded - start)
+        handler = self.commands.get(command)
+        if handler is None:
+            self.metrics.increment("errors.command")
+            return Packet("", "Invalid command received by server", packet.getRequestId())
+        log.debug("Message Contents\n -> Command: %s\n -> Request ID: %d\n -> Contents: %s\n -> Size (uncompressed): %d bytes",
+                  command, packet.getRequestId(), packet.getContents(), packet.getSize())
+        reply = self.callHandler(handler, packet.getContents(), policy)
+        self.metrics.observe("lookup", command, perf_counter() - decoded)
+        return Packet("", reply, packet.getRequestId())
+
+
+    #Checks whether a command is run inline, as its frame is handled: plain functions that do not block the event loop,
+    #and in thread-pool mode, where every connection has a thread of its own, blocking ones too. The others are run through
+    #runCommand, or runCommandThreaded.
+    #[*] Parameters:
+    #   -> command (Command): The command.
+    #[*] Returns:
+    #   -> bool: True if the command is run inline.
+    def runsInline(self, command) -> bool:
+        return command.isSync() and (not command.blocking or self.mode == "threads")
+
+
+    #Calls the handler of a command run inline (see runsInline).
+    #   -> If the handler raises, the failure is recorded (see handlerFailed) and the reply is HANDLER_ERROR_REPLY.
+    #[*] Parameters:
+    #   -> command (Command): The command.
+    #   -> contents (str): The contents of the request.
+    #   -> policy (CompressionPolicy): The connection's compression policy, passed to the handlers of connection commands.
+    #[*] Returns:
+    #   -> str: The contents of the reply.
+    def callHandler(self, command:Command, contents:str, policy:CompressionPolicy) -> str:
+        try:
+            if(command.connection):
+                return command.handler(contents, policy)
+            return command.handler(contents)
+        except Exception:
+            return self.handlerFailed(command)
+
+
+    #Records that a command's handler raised: logs the exception and counts it in errors.handler. The request gets an error
+    #reply instead, and the connection carries on, whichever way the command was run.
+    #[*] Parameters:
+    #   -> command (Command): The command.
+    #[*] Returns:
+    #   -> str: The contents of the error reply, HANDLER_ERROR_REPLY.
+    def handlerFailed(self, command:Command) -> str:
+        log.exception("Command %s failed", command.name)
+        self.metrics.increment("errors.handler")
+        return HANDLER_ERROR_REPLY
+
+
+    #Runs a command that is not run inline, and yields its reply packets: one for each chunk of a streamed reply, all but
+    #the last flagged FLAG_MORE, or a single one otherwise. A chunk is held back until the next one comes, so that the last
+    #frame of the reply is known to be the last. A streamed reply without chunks gets a single empty frame.
+    #   -> Decoding and the whole of the command's handler (lookup) are timed for the metrics, as in receiveMessage.
+    #   -> If the handler fails, the reply is ended with an error frame (see handlerFailed), and the connection carries on.
+    #[*] Parameters:
+    #   -> frame (memoryview): The frame received from the client.
+    #   -> policy (CompressionPolicy): The connection's compression policy.
+    #[*] Returns:
+    #   -> async generator of Packet: The reply packets.
+    async def commandReplies(self, frame, policy:CompressionPolicy):
+        start = perf_counter()
+        try:
+            packet = decodeFrom(frame, policy)
+        except DECOMPRESSION_ERRORS:
+            self.metrics.increment("errors.decode")
+            yield Packet("", "Invalid packet received by server", unpackHeader(frame)[2])
+            return
+        decoded = perf_counter()
+        command = self.commands.get(packet.getCommand())
+        requestId = packet.getRequestId()
+        self.metrics.observe("decode", command.key, decoded - start)
+        arguments = (packet.getContents(), policy) if command.connection else (packet.getContents(),)
+        chunk = None
+        try:
+            async for nextChunk in command.results(*arguments):
+                if(chunk is not None):
+                    yield Packet("", chunk, requestId, FLAG_MORE)
+                chunk = nextChunk
+        except Exception:
+            yield Packet("", self.handlerFailed(command), requestId)
+            return
+        self.metrics.observe("lookup", command.key, perf_counter() - decoded)
+        yield Packet("", chunk if chunk is not None else "", requestId)
+
+
+    #Runs a command that is not run inline in asyncio mode, writing each frame of its reply as it comes.
+    #[*] Parameters:
+    #   -> writer (asyncio.StreamWriter): Stream to write replies to.
+    #   -> frame (memoryview): The frame received from the client.
+    #   -> policy (CompressionPolicy): The connection's compression policy.
+    #[*] Returns: None
+    #[*] Raises:
+    #   -> asyncio.TimeoutError: If the client leaves its replies unread for the send timeout.
+    async def runCommand(self, writer:asyncio.StreamWriter, frame, policy:CompressionPolicy):
+        replies = self.commandReplies(frame, policy)
+        try:
+            async for reply in replies:
+                await self.writeReplies(writer, encodePacket(reply, policy))
+        finally:
+            await replies.aclose()
+
+
+    #Runs a command that is not run inline in thread-pool mode, on the background event loop, sending each frame of its
+    #reply as it comes.
+    #[*] Parameters:
+    #   -> conn (socket.socket): The socket connection to the client.
+    #   -> sending (threading.Lock): Lock serialising the sends to the connection.
+    #   -> frame (memoryview): The frame received from the client.
+    #   -> policy (CompressionPolicy): The connection's compression policy.
+    #[*] Returns: None
+    def runCommandThreaded(self, conn:socket.socket, sending:threading.Lock, frame, policy:CompressionPolicy):
+        for reply in self.background.iterate(self.commandReplies(frame, policy)):
+            message = encodePacket(reply, policy)
+            with sending:
+                self.transmitMessage(conn, message)
+
+
+    #Transmits a reply to a client using the provided socket connection.
+    #[*] Parameters:
+    #   -> conn (socket.socket): The socket connection to the client.
+    #   -> message (bytes | memoryview): The encoded reply frames to be transmitted.
+    #[*] Returns:
+    #   -> None: This function does not return any value. It sends the message to the client.
+    def transmitMessage(self, conn:socket.socket, message:bytes):
+        start = perf_counter()
+        conn.sendall(message)
+        self.metrics.observe("send", "*", perf_counter() - start)
+        self.metrics.increment("bytes.sent", len(message))
+        log.debug("Message Transmitted!")
+
+
+    #Sends a keepalive ping to a connection that has been silent for the ping interval.
+    #   -> In thread-pool mode, the ping is skipped while a reply is being sent, as the keepalive thread must not wait on
+    #      one connection. If the ping itself times out, part of it may have been sent, so the connection is shut down.
+    #[*] Parameters:
+    #   -> send (callable): Sends bytes to the connection (socket.sendall, or StreamWriter.write in asyncio mode).
+    #   -> lock (threading.Lock | None): Lock serialising the sends to the connection, in thread-pool mode. Default is None.
+    #   -> close (callable | None): Shuts the connection down, in thread-pool mode. Default is None.
+    #   -> *arguments: Arguments of close.
+    #[*] Returns: None
+    def sendPing(self, send, lock:threading.Lock=None, close=None, *arguments):
+        if(lock is not None and not lock.acquire(blocking=False)):
+            return
+        try:
+            send(PING_FRAME)
+        except socket.timeout:
+            close(*arguments)
+            return
+        except OSError: # the connection is failing, which its own handler finds out
+            return
+        finally:
+            if(lock is not None):
+                lock.release()
+        self.metrics.increment("keepalive.pings")
+
+
+    #Checks whether a new connection can be served, or must be turned away as the server is at its connection limit.
+    #   -> A connection turned away is sent a busy frame with the reserved request id 0, so that the client knows to back
+    #      off rather than take it for a failure. The frame is small enough for the empty socket buffer, so it never blocks.
+    #[*] Parameters:
+    #   -> address (tuple): The address of the client.
+    #   -> send (callable): Sends bytes to the connection (socket.send, or StreamWriter.write in asyncio mode).
+    #[*] Returns:
+    #   -> bool: True if the connection is admitted, False if the caller must close it.
+    def admitConnection(self, address:tuple, send) -> bool:
+        if(not self.maxConnections or len(self.connections) < self.maxConnections):
+            return True
+        log.debug("Turning away connection from %s: %d connections open", address, len(self.connections))
+        self.metrics.increment("rejected.admission")
+        try:
+            send(BUSY_FRAME)
+        except OSError: # already closed by the client
+            pass
+        return False
+
+
+    #Records the disconnection of a client that left its replies unread for the send timeout.
+    #[*] Parameters:
+    #   -> address (tuple): The address of the client.
+    #[*] Returns: None
+    def dropSlowClient(self, address:tuple):
+        log.warning("Client %s did not read its replies for %.0f seconds. Closing connection.", address, self.sendTimeout)
+        self.metrics.increment("errors.sendtimeout")
+
+
+    #Closes a connection that has been silent for the idle timeout, e.g. a dead or half-open peer.
+    #   -> The connection is shut down rather than closed, so that its handler sees the end of the stream and cleans up.
+    #[*] Parameters:
+    #   -> address (tuple): The address of the client.
+    #   -> close (callable): Shuts the connection down.
+    #   -> *arguments: Arguments of close.
+    #[*] Returns: None
+    def reapConnection(self, address:tuple, close, *arguments):
+        log.info("Closing idle connection from %s", address)
+        self.metrics.increment("keepalive.reaped")
+        try:
+            close(*arguments)
+        except OSError: # already closed by the client
+            pass
+
+
+    #Retrieves the capital city of a given country from the in-memory country store.
+    #[*] Parameters:
+    #   -> country (str): The name of the country for which the capital city is to be retrieved.
+    #[*] Returns:
+    #   -> str: The capital city of the given country. If the country is not found in the store,
+    #           the function returns "No country found."
+    def getCity(self, country:str) -> str:
+        log.debug("Retrieving capital city for %s...", country)
+        city = self.store.getCity(country)
+        if(city is not None):
+            log.debug("Found capital city %s", city)
+            return city
+        return "No country found."
+
+
+    #Retrieves the capital cities of a list of countries in a single pass over the country store.
+    #[*] Parameters:
+    #   -> countries (str): The names of the countries, one per line.
+    #[*] Returns:
+    #   -> str: The capital city of each country, one per line and in the same order as the countries.
+    #           Countries that are not found get "No country found." on their line.
+    def getCities(self, countries:str) -> str:
+        countries = countries.split("\n")
+        log.debug("Retrieving capital cities for %d countries...", len(countries))
+        return "\n".join(city if city is not None else "No country found." for city in self.store.getCities(countries))
+
+
+    #Retrieves the capital city of a given country, matching its name case-insensitively: casefolded, Unicode-normalised and
+    #with runs of whitespace collapsed (e.g. "UNITED  kingdom" for "United Kingdom"), rather than through str.capitalize.
+    #   -> Until the search index is built (or if it is off), the country is looked up in the store as by getCity.
+    #[*] Parameters:
+    #   -> country (str): The name of the country for which the capital city is to be retrieved.
+    #[*] Returns:
+    #   -> str: The capital city of the given country, or "No country found." if the country is not found.
+    def getCityAnyCase(self, country:str) -> str:
+        log.debug("Retrieving capital city for %s, ignoring case...", country)
+        if(not self.searchReady()):
+            return self.getCity(country.strip())
+        entry = self.search.get(country)
+        return entry[1] if entry is not None else "No country found."
+
+
+    #Finds the countries best matching a partial or misspelt name: completions of it, then fuzzy matches within a couple of
+    #edits, best first (see SearchIndex.find).
+    #   -> Until the search index is built (or if it is off), only the countries whose names start with the query are found.
+    #[*] Parameters:
+    #   -> query (str): The partial name, optionally followed by a newline and the maximum number of matches (default 10,
+    #                   at most 100).
+    #[*] Returns:
+    #   -> str: "Country,Capital" of each match, one per line, or "No country found." if nothing matches.
+    def findCountries(self, query:str) -> str:
+        query, _, limit = query.partition("\n")
+        limit = min(int(limit), MAX_SEARCH_LIMIT) if limit.strip().isdecimal() else DEFAULT_SEARCH_LIMIT
+        log.debug("Searching for %d countries matching %s...", limit, query)
+        if(self.searchReady()):
+            matches = self.search.find(query, limit)
+        else:
+            matches = self.store.findPrefix(query.strip(), limit) if query.strip() else list()
+        if(not matches):
+            return "No country found."
+        return "\n".join(f"{country},{city}" for country, city in matches)
+
+
+    #Retrieves the estimated population of a given country from the in-memory country store.
+    #The population is calculated as a random number between 1 and 10 times the student number.
+    #[*] Parameters:
+    #   -> country (str): The name of the country for which the population is to be retrieved.
+    #[*] Returns:
+    #   -> str: The estimated population of the given country. If the country is not found in the store,
+    #           the function returns "Country not found."
+    def getPopulation(self, country:str) -> str:
+        log.debug("Retrieving estimated population for %s...", country)
+        if(self.store.contains(country)): return str(randint(1,10) * self.studentNumber)
+        return "No country found"
+
+
+    #Adds a new entry to the country store, which logs it to the write-ahead log of the 'countries_capitals.csv' file.
+    #[*] Parameters:
+    #   -> countryCityPair (str): A string containing the country and city separated by a comma.
+    #                             The country and city names are expected to be in lowercase.
+    #[*] Returns:
+    #   -> str: A message indicating the success or failure of the operation.
+    #           If the country does not exist in the file, the new entry is added and a success message is returned.
+    #           If the country already exists in the file, a failure message is returned.
+    #           If the entry is not a non-empty country and city separated by a single comma, an error message is returned.
+    def addNewEntry(self, countryCityPair:str) -> str:
+        country, separator, city = countryCityPair.partition(",")
+        if(not separator or not country.strip() or not city.strip() or "," in city or "\n" in countryCityPair):
+            return INVALID_ENTRY_REPLY
+        country = country.capitalize() # normalise the input
+        city = city.capitalize() # normalise the input
+        log.debug("Adding new entry for %s with %s...", country, city)
+        if(self.store.add(country, city)): # which tells countryAdded about it
+            log.info("%s and %s successfully added to database", country, city)
+            return f"{country} and {city} successfully added to database"
+        return "Country already exists"
+
+
+    #Exports every country and its capital city, in chunks of EXPORT_CHUNK_SIZE countries, each sent as a frame of its own.
+    #   -> The countries are those in the store when the export starts.
+    #[*] Parameters:
+    #   -> *externalMessage (tuple): This parameter is not used in this function. It is included to maintain consistency with other command execution functions.
+    #[*] Returns:
+    #   -> generator of str: "Country,Capital" of each country, one per line.
+    def exportCountries(self, *externalMessage):
+        entries = self.store.items()
+        log.debug("Exporting %d countries...", len(entries))
+        for start in range(0, len(entries), EXPORT_CHUNK_SIZE):
+            yield "\n".join(f"{country},{city}" for country, city in entries[start:start + EXPORT_CHUNK_SIZE])
+
+
+    #Starts bringing the search index up to date with the store, unless it is off (see SearchIndex.sync).
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> bool: True if the index can be searched, False if it has not been built yet.
+    def searchReady(self) -> bool:
+        if(self.searchMode == "off"):
+            return False
+        self.search.sync(self.store)
+        return self.search.isReady()
+
+
+    #Updates what is derived from the store once a country has been added (by this process or, in prefork mode, another
+    #worker): drops its cached replies, and adds it to the search index.
+    #[*] Parameters:
+    #   -> country (str): The country.
+    #   -> city (str): Its capital city.
+    #[*] Returns: None
+    def countryAdded(self, country:str, city:str):
+        self.cache.invalidate(CACHED_COMMANDS, normaliseCountry(country))
+        if(self.searchMode != "off"):
+            self.search.add(country, city)
+
+
+    #Negotiates the compression codec of a connection. The client offers the codecs it supports in its order of preference,
+    #and the server keeps its configured codec if it was offered, or otherwise picks the client's first supported choice.
+    #[*] Parameters:
+    #   -> codecs (str): Comma separated names of the codecs the client supports.
+    #   -> policy (CompressionPolicy): The connection's compression policy, which is switched to the chosen codec.
+    #[*] Returns:
+    #   -> str: Name of the codec chosen, which both sides use for the rest of the connection.
+    #           For the zdict and zstream codecs, it is followed by a newline and the preset dictionary.
+    def negotiateCompression(self, codecs:str, policy:CompressionPolicy) -> str:
+        codec = policy.negotiate([codec.strip() for codec in codecs.split(",")])
+        log.debug("Compression negotiated: %s", codec)
+        if(policy.nextCodec in DICTIONARY_CODECS and policy.getDictionary()):
+            return codec + "\n" + policy.getDictionary().decode("utf-8")
+        return codec
+
+
+    #This function serves as a heartbeat mechanism for the server. It is called periodically to check the server's status.
+    #[*] Parameters:
+    #   -> *externalMessage (tuple): This parameter is not used in this function. It is included to maintain consistency with other command execution functions.
+    #[*] Returns:
+    #   -> str: A string indicating the success of the heartbeat. In this case, it always returns "beat".
+    def heartbeat(self, *externalMessage) -> str:
+            log.debug("Heart -> beat")
+            return "beat"
+
+
+    #Reports the server's metrics: request counters and the latency of each stage of handling each command, compression
+    #stats in each direction, and the size of the country store.
+    #[*] Parameters:
+    #   -> *externalMessage (tuple): This parameter is not used in this function. It is included to maintain consistency with other command execution functions.
+    #[*] Returns:
+    #   -> str: The stats as a JSON object.
+    def getStats(self, *externalMessage) -> str:
+        stats = self.metrics.getStats()
+        counters = stats["counters"]
+        stats["connections"] = counters.get("connections.opened", 0) - counters.get("connections.closed", 0)
+        stats["countries"] = len(self.store)
+        stats["searchable"] = len(self.search)
+        stats["backend"] = self.backend
+        stats["worker"] = self.workerId # stats are those of the process that served the request
+        stats["pid"] = os.getpid()
+        stats["cache"] = self.cache.getStats()
+        stats["compression"] = {"sent":self.compression.getStats().getStats(), "received":self.compression.getReceivedStats().getStats()}
+        return json.dumps(stats)
+
+
+    #This function stops the server and closes the listening socket. It also prints a shutdown message and exits the program.
+    #[*] Parameters:
+    #   -> message (str): A custom message to be printed when the server is shut down. Default is "Server has been shut down successfully."
+    #   -> *error (str): Variable length argument list to capture any error messages. This argument is not used in the function's logic.
+    #[*] Returns:
+    #   -> None: This function does not return any value. It closes the server socket, prints a shutdown message, and exits the program.
+    def stopProgram(self, message="Server has been shut down successfully.", *error:str) -> None:
+        self.stopServer = True
+        self.serverSocket.close()
+        if(self.profiler is not None):
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile)
+            log.info("Profile written to %s", self.profile)
+            self.profiler = None
+        if(self.store is not None):
+            self.store.close() # compacts logged entries into the countries file
+        log.info("Server connection closed.")
+        if(error):
+            sys.exit(f"[!] {error[0]} detected: {message}")
+        else:
+            sys.exit(f"[!] {message}")
+
+#Parses the command line arguments and runs the server.
+#[*] Parameters: None
+#[*] Returns: None
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--port", type=int, default=6000)
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--file", default="countries_capitals.csv")
+    parser.add_argument("--mode", choices=["async", "threads", "prefork"], default="async")
+    parser.add_argument("--threads", type=int, default=256)
+    parser.add_argument("--codec", choices=list(CODECS), default="zlib")
+    parser.add_argument("--compression-level", type=int)
+    parser.add_argument("--compression-threshold", type=int)
+    parser.add_argument("--durable", action="store_true")
+    parser.add_argument("--log-level", choices=list(LOG_LEVELS), default="info")
+    parser.add_argument("--profile")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--backend", choices=["memory", "mmap"], default="memory")
+    parser.add_argument("--ping-interval", type=float, default=DEFAULT_PING_INTERVAL)
+    parser.add_argument("--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT)
+    parser.add_argument("--rate-limits", type=parseLimits, default=dict(), help="requests per second per client, e.g. a=5,*=1000")
+    parser.add_argument("--max-connections", type=int, default=0)
+    parser.add_argument("--send-timeout", type=float, default=DEFAULT_SEND_TIMEOUT)
+    parser.add_argument("--search", choices=["eager", "lazy", "off"])
+    args = parser.parse_args()
+    setupLogging(args.log_level)
+    Server(args.address, args.port, args.file, args.mode, args.threads, args.codec,
+           args.compression_level, args.compression_threshold, args.durable, args.profile, args.cache_size, args.workers,
+           args.backend, args.ping_interval, args.idle_timeout, args.rate_limits, args.max_connections, args.send_timeout,
+           args.search).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,451 @@
+# In-memory index of the countries file, so that lookups no longer re-read and re-parse the CSV on every request
+# The file is loaded once into a dictionary keyed by the normalised country name, then watched for external edits
+# (inode, size, mtime and the bytes just before the last read position) so that changes are picked up without a restart
+# With a write-ahead log (see persistence.py), new entries are logged rather than appended to the file, and are written
+# into it when the log is compacted
+# The parsed and normalised index is cached in a pickle snapshot next to the countries file, keyed by the file's
+# size, mtime and hash, so that a restart with an unchanged file loads the snapshot instead of parsing the CSV again
+# For datasets too large to hold in memory, the store can instead keep its index in a memory-mapped, sorted index file
+# (see mapped.py), which takes the place of the snapshot
+
+import csv, hashlib, logging, os, pickle, threading
+from itertools import chain
+from time import monotonic
+from persistence import WriteAheadLog, BLOCK_SIZE, atomicWrite, atomicWriteChunks, encodeRows
+from mapped import MappedIndex, INDEX_ERRORS, writeIndex
+
+TAIL_FINGERPRINT_SIZE = 64 # bytes kept from just before the read offset to detect in-place rewrites
+SNAPSHOT_VERSION = 1 # bumped whenever the snapshot layout or the normalisation rules change
+SNAPSHOT_ERRORS = (OSError, EOFError, pickle.UnpicklingError, AttributeError, KeyError, TypeError, ValueError)
+
+log = logging.getLogger("store")
+
+
+#Normalises a country name into the key used by the index.
+#   -> Uses the same rule the server has always applied to client input (str.capitalize), applied to both sides.
+#[*] Parameters:
+#   -> country (str): The country name to normalise.
+#[*] Returns:
+#   -> str: The normalised key.
+def normaliseCountry(country:str) -> str:
+    return country.strip().capitalize()
+
+
+#Splits a row of the countries file into its entries.
+#   -> A row naming several countries separated by " and " (e.g. "Antigua and Barbuda") becomes one entry per country,
+#      each with the shared capital city.
+#[*] Parameters:
+#   -> row (list): A [Country, Capital] row.
+#[*] Returns:
+#   -> list: (country, capital) entries.
+def splitEntry(row:list) -> list:
+    return [(country, row[1]) for country in row[0].split(" and ")]
+
+
+#Hashes the contents of the countries file, to tell whether a snapshot was taken of the same file.
+#[*] Parameters:
+#   -> data (bytes): The contents of the file.
+#[*] Returns:
+#   -> bytes: The digest.
+def hashContents(data:bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+#Reads the start of a file a block at a time, adding each block to a running hash of the file's contents.
+#[*] Parameters:
+#   -> binaryFile (file): The file, opened in binary mode and positioned at its start.
+#   -> length (int): Number of bytes to read.
+#   -> digest (hashlib.blake2b): The running hash, as hashContents would hash the bytes read.
+#[*] Returns:
+#   -> generator: The blocks, as bytes.
+def readBlocks(binaryFile, length:int, digest):
+    while(length > 0):
+        block = binaryFile.read(min(BLOCK_SIZE, length))
+        if(not block):
+            return
+        digest.update(block)
+        length -= len(block)
+        yield block
+
+
+#Hashes the start of a file like hashContents, without reading it into memory all at once.
+#[*] Parameters:
+#   -> binaryFile (file): The file, opened in binary mode and positioned at its start.
+#   -> length (int): Number of bytes to hash.
+#[*] Returns:
+#   -> bytes: The digest.
+def hashFile(binaryFile, length:int) -> bytes:
+    digest = hashlib.blake2b(digest_size=16)
+    for block in readBlocks(binaryFile, length, digest):
+        pass
+    return digest.digest()
+
+
+class CountryStore():
+    #Initialises the store and loads the countries file into memory.
+    #[*] Parameters:
+    #   -> countriesFile (str): Path to the CSV file of [Country, Capital] rows. The first row is a header.
+    #   -> checkInterval (float): Minimum number of seconds between checks of the file for external edits. Default is 1 second.
+    #   -> log (WriteAheadLog | None): Log that new entries are written to. Default is None, which appends them to the file.
+    #   -> durable (bool): Wait for each logged entry to be synced to disk before add returns. Default is False (write-behind).
+    #   -> mapped (bool): Keep the index in a memory-mapped index file rather than in a dictionary. Default is False.
+    #[*] Returns: None
+    def __init__(self, countriesFile:str, checkInterval:float=1.0, log:WriteAheadLog=None, durable:bool=False, mapped:bool=False):
+        self.countriesFile = countriesFile
+        self.checkInterval = checkInterval
+        self.log = log
+        self.durable = durable
+        self.mapped = mapped
+        self.lock = threading.RLock()
+        self.index = dict() # normalised country -> (country, capital), or a MappedIndex behaving like one
+        self.inode = None
+        self.mtime = 0
+        self.offset = 0 # number of bytes of the file already indexed
+        self.tail = b""
+        self.digest = None # hash of the indexed part of the file, when the whole file was read in one go
+        self.snapshotFile = countriesFile + ".snapshot"
+        self.indexFile = countriesFile + ".index"
+        self.generation = 0 # bumped whenever entries are read from the file, so that caches of lookups know to clear
+        self.insertListener = None # called with (country, city) once an entry has been added
+        self.lastCheck = monotonic()
+        self.load()
+        if(self.log is not None):
+            self.log.setCompactor(self.compact)
+
+
+    #Rebuilds the index from scratch: from the snapshot if it matches the countries file, otherwise by reading the whole
+    #file in a single pass (and saving a new snapshot of it), then replays the write-ahead log.
+    #   -> The new index is built aside and swapped in, so concurrent lookups never see a partially loaded index.
+    #[*] Parameters: None
+    #[*] Returns: None
+    #[*] Raises:
+    #   -> FileNotFoundError: If the countries file does not exist.
+    def load(self):
+        with self.lock:
+            index = self.loadSnapshot()
+            if(index is None):
+                index = dict()
+                self.tail = b""
+                self.readFrom(0, index)
+                index = self.saveSnapshot(index)
+            for country, city in self.loggedEntries():
+                index.setdefault(normaliseCountry(country), (country, city))
+            self.index = index
+            self.generation += 1
+
+
+    #Returns the entries of the write-ahead log, which are not in the countries file yet.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> list: (country, city) entries, in the order they were logged.
+    def loggedEntries(self) -> list:
+        if(self.log is None):
+            return list()
+        return self.log.replay()
+
+
+    #Indexes every complete line of the file from the given byte offset onwards.
+    #   -> A trailing line without a newline is left for the next refresh, as it may still be being written.
+    #[*] Parameters:
+    #   -> offset (int): Byte offset to start reading from. Offset 0 skips the header row.
+    #   -> index (dict): The index to add the rows to. Defaults to the live index.
+    #[*] Returns: None
+    def readFrom(self, offset:int, index:dict=None):
+        if(index is None):
+            index = self.index
+        with open(self.countriesFile, "rb") as csvFile:
+            stat = os.fstat(csvFile.fileno())
+            csvFile.seek(offset)
+            data = csvFile.read()
+        end = data.rfind(b"\n") + 1
+        rows = csv.reader(data[:end].decode("utf-8").splitlines())
+        if(offset == 0):
+            next(rows, None) # skip the header [Country, City]
+        for row in rows:
+            if(len(row) >= 2):
+                for country, city in splitEntry(row):
+                    index.setdefault(normaliseCountry(country), (country, city)) # first entry wins, as with the old linear scan
+        self.digest = hashContents(data[:end]) if(offset == 0) else None
+        self.offset = offset + end
+        self.tail = (self.tail + data[:end])[-TAIL_FINGERPRINT_SIZE:]
+        self.inode = stat.st_ino
+        self.mtime = stat.st_mtime_ns
+        self.generation += 1
+
+
+    #Loads the index from the snapshot, if the snapshot was taken of the current countries file.
+    #   -> A snapshot matches if the file has the same size and mtime as when it was taken, or failing that (e.g. the file
+    #      was copied or touched), if the file has the same size and hash.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> dict | MappedIndex | None: The index, or None if there is no usable snapshot.
+    def loadSnapshot(self):
+        if(self.mapped):
+            return self.loadIndexFile()
+        try:
+            with open(self.snapshotFile, "rb") as snapshotFile:
+                snapshot = pickle.load(snapshotFile)
+            with open(self.countriesFile, "rb") as csvFile:
+                stat = os.fstat(csvFile.fileno())
+                if(snapshot["version"] != SNAPSHOT_VERSION or stat.st_size != snapshot["offset"]):
+                    return None
+                if(stat.st_mtime_ns != snapshot["mtime"] and hashContents(csvFile.read()) != snapshot["digest"]):
+                    return None
+            index = snapshot["index"]
+            if(not isinstance(index, dict)):
+                return None
+        except FileNotFoundError:
+            return None
+        except SNAPSHOT_ERRORS as e:
+            log.warning("Ignoring unreadable snapshot %s (%s)", self.snapshotFile, type(e).__name__)
+            return None
+        self.offset = snapshot["offset"]
+        self.tail = snapshot["tail"]
+        self.digest = snapshot["digest"]
+        self.inode = stat.st_ino
+        self.mtime = stat.st_mtime_ns
+        log.info("Loaded %d countries from snapshot %s", len(index), self.snapshotFile)
+        return index
+
+
+    #Saves the index freshly read from the countries file as a snapshot, replacing the previous one atomically.
+    #   -> The snapshot is only a cache, so failing to write it is reported but not fatal.
+    #[*] Parameters:
+    #   -> index (dict): The index read from the file.
+    #[*] Returns:
+    #   -> dict | MappedIndex: The index to serve lookups from.
+    def saveSnapshot(self, index:dict):
+        if(self.mapped):
+            return self.saveIndexFile(index)
+        snapshot = {"version":SNAPSHOT_VERSION, "offset":self.offset, "mtime":self.mtime, "digest":self.digest, "tail":self.tail, "index":index}
+        try:
+            atomicWrite(self.snapshotFile, pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL))
+        except OSError as e:
+            log.warning("Could not save snapshot %s (%s)", self.snapshotFile, type(e).__name__)
+            return index
+        log.info("Indexed %d countries from %s and saved a snapshot", len(index), self.countriesFile)
+        return index
+
+
+    #Maps the index file, if it was built from the current countries file or from the start of it.
+    #   -> The index file matches if the countries file has the same size and mtime as when it was built, or failing that,
+    #      if the part of the file it was built from has the same hash. Lines appended since are read and merged into
+    #      a new index file, without parsing the rest of the countries file again.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> MappedIndex | None: The index, or None if there is no usable index file.
+    def loadIndexFile(self):
+        try:
+            index = MappedIndex(self.indexFile)
+            with open(self.countriesFile, "rb") as csvFile:
+                stat = os.fstat(csvFile.fileno())
+                if(stat.st_size < index.offset):
+                    return None
+                if(stat.st_size != index.offset or stat.st_mtime_ns != index.mtime):
+                    if(hashFile(csvFile, index.offset) != index.digest):
+                        return None
+        except FileNotFoundError:
+            return None
+        except INDEX_ERRORS as e:
+            log.warning("Ignoring unreadable index file %s (%s)", self.indexFile, type(e).__name__)
+            return None
+        self.offset = index.offset
+        self.tail = index.tail
+        self.digest = index.digest
+        self.inode = stat.st_ino
+        self.mtime = stat.st_mtime_ns
+        log.info("Mapped %d countries from index file %s", len(index), self.indexFile)
+        if(stat.st_size > self.offset):
+            self.readFrom(self.offset, index)
+            if(index.delta):
+                index = self.saveSnapshot(index)
+        return index
+
+
+    #Writes the index to the index file and maps it: in full from a dictionary freshly read from the countries file, or
+    #by merging the delta of a mapped index into a new file.
+    #   -> The index file is only a cache, so failing to write it is reported but not fatal.
+    #[*] Parameters:
+    #   -> index (dict | MappedIndex): The index read from the file.
+    #[*] Returns:
+    #   -> dict | MappedIndex: The mapped index, or the given one if the index file could not be written.
+    def saveIndexFile(self, index):
+        base = index if isinstance(index, MappedIndex) else None
+        entries = base.delta.items() if base is not None else index.items()
+        try:
+            digest = self.digest
+            if(digest is None): # the file was read in several goes, so hash what has been indexed of it
+                with open(self.countriesFile, "rb") as csvFile:
+                    digest = hashFile(csvFile, self.offset)
+            writeIndex(self.indexFile, [(key, country, city) for key, (country, city) in entries], self.offset, self.mtime,
+                       digest, self.tail, base)
+            mapped = MappedIndex(self.indexFile)
+        except INDEX_ERRORS as e:
+            log.warning("Could not save index file %s (%s)", self.indexFile, type(e).__name__)
+            return index
+        self.digest = digest
+        log.info("Indexed %d countries from %s into %s", len(mapped), self.countriesFile, self.indexFile)
+        return mapped
+
+
+    #Checks the countries file for external edits and updates the index if it changed.
+    #   -> Appended lines are read incrementally. A replaced, truncated or rewritten file is reloaded in full.
+    #   -> Checks are rate limited by checkInterval unless forced.
+    #[*] Parameters:
+    #   -> force (bool): Check the file even if checkInterval has not elapsed. Default is False.
+    #[*] Returns: None
+    def refresh(self, force:bool=False):
+        now = monotonic()
+        if(not force and now - self.lastCheck < self.checkInterval):
+            return
+        self.lastCheck = now
+        try:
+            stat = os.stat(self.countriesFile)
+        except FileNotFoundError: # keep serving the last known data until the file comes back
+            return
+        with self.lock:
+            if(stat.st_ino == self.inode and stat.st_mtime_ns == self.mtime and stat.st_size == self.offset):
+                return
+            if(stat.st_ino != self.inode or stat.st_size < self.offset or not self.tailMatches()):
+                self.load()
+            else:
+                self.readFrom(self.offset)
+
+
+    #Checks whether the bytes just before the read offset are still the ones that were indexed.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> bool: True if the already indexed part of the file appears unchanged.
+    def tailMatches(self) -> bool:
+        with open(self.countriesFile, "rb") as csvFile:
+            csvFile.seek(self.offset - len(self.tail))
+            return csvFile.read(len(self.tail)) == self.tail
+
+
+    #Retrieves the capital city of the given country.
+    #[*] Parameters:
+    #   -> country (str): The country to look up. It is normalised before the lookup.
+    #[*] Returns:
+    #   -> str | None: The capital city, or None if the country is not in the store.
+    def getCity(self, country:str):
+        self.refresh()
+        entry = self.index.get(normaliseCountry(country))
+        return entry[1] if entry else None
+
+
+    #Retrieves the capital cities of several countries at once, checking the file for edits only once.
+    #[*] Parameters:
+    #   -> countries (list): The countries to look up. They are normalised before the lookup.
+    #[*] Returns:
+    #   -> list: The capital city of each country (None if it is not in the store), in the same order as the countries.
+    def getCities(self, countries:list) -> list:
+        self.refresh()
+        index = self.index
+        return [entry[1] if entry else None for entry in (index.get(normaliseCountry(country)) for country in countries)]
+
+
+    #Finds the countries whose names start with the given prefix.
+    #[*] Parameters:
+    #   -> prefix (str): The prefix. It is normalised like a country name.
+    #   -> limit (int): Maximum number of countries returned. Default is 10.
+    #[*] Returns:
+    #   -> list: (country, capital) entries, in order of their normalised names.
+    def findPrefix(self, prefix:str, limit:int=10) -> list:
+        self.refresh()
+        index = self.index
+        key = normaliseCountry(prefix)
+        if(isinstance(index, MappedIndex)):
+            return index.prefix(key, limit)
+        return [index[country] for country in sorted(country for country in index if country.startswith(key))[:limit]]
+
+
+    #Checks whether the given country is in the store.
+    #[*] Parameters:
+    #   -> country (str): The country to look up. It is normalised before the lookup.
+    #[*] Returns:
+    #   -> bool: True if the country exists.
+    def contains(self, country:str) -> bool:
+        self.refresh()
+        return normaliseCountry(country) in self.index
+
+
+    #Adds a new country to the store, and writes it to the write-ahead log, or appends it to the countries file without one.
+    #   -> The insert listener, if any, is told about the entry once it has been added (and synced, if the store is durable).
+    #[*] Parameters:
+    #   -> country (str): The country to add.
+    #   -> city (str): The capital city of the country.
+    #[*] Returns:
+    #   -> bool: True if the entry was added, False if the country already exists.
+    #[*] Raises:
+    #   -> OSError: If the store is durable and the entry could not be synced to the write-ahead log.
+    def add(self, country:str, city:str) -> bool:
+        with self.lock:
+            self.refresh(force=True)
+            key = normaliseCountry(country)
+            if(key in self.index):
+                return False
+            if(self.log is None):
+                with open(self.countriesFile, "a", newline="", encoding="utf-8") as csvFile:
+                    csv.writer(csvFile).writerow([country, city])
+                self.readFrom(self.offset) # picks up the new row and moves the offset past it
+            else:
+                sequence = self.log.append(country, city)
+                self.index[key] = (country, city)
+        if(self.log is not None and self.durable): # waited for outside the lock, as the commit thread may need the lock to compact
+            self.log.waitForSync(sequence)
+        if(self.insertListener is not None):
+            self.insertListener(country, city)
+        return True
+
+
+    #Compacts the write-ahead log: writes the countries file with the logged entries appended to it into a new file that
+    #atomically replaces the old one, then empties the log.
+    #   -> The rows already in the file are copied as they are, a block at a time, so that they are read back as the same
+    #      entries: only the new rows are read into the index, and a mapped index merges them into a new index file
+    #      rather than being rebuilt. A trailing line that is not complete yet is dropped.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def compact(self):
+        with self.lock:
+            self.refresh(force=True) # keep any external edits that have not been picked up yet
+            offset = self.offset
+            rows = encodeRows(([["Country", "Capital"]] if offset == 0 else []) + [list(entry) for entry in self.loggedEntries()])
+            digest = hashlib.blake2b(digest_size=16)
+            with open(self.countriesFile, "rb") as csvFile:
+                atomicWriteChunks(self.countriesFile, chain(readBlocks(csvFile, offset, digest), (rows,)))
+            digest.update(rows)
+            self.log.truncate()
+            self.readFrom(offset)
+            self.digest = digest.digest() # of the whole file, which readFrom only hashes when it reads all of it
+            self.index = self.saveSnapshot(self.index)
+        log.info("Compacted %s (%d entries)", self.countriesFile, len(self.index))
+
+
+    #Compacts any logged entries into the countries file and closes the write-ahead log.
+    #[*] Parameters: None
+    #[*] Returns: None
+    def close(self):
+        if(self.log is None):
+            return
+        if(self.log.getRecords() > 0):
+            self.compact()
+        self.log.close()
+
+
+    #Returns every entry of the store.
+    #[*] Parameters: None
+    #[*] Returns:
+    #   -> list: (country, capital) pairs, in the order they were indexed.
+    def items(self) -> list:
+        self.refresh()
+        return list(self.index.values())
+
+
+    def getGeneration(self) -> int:
+        return self.generation
+
+    def setInsertListener(self, listener):
+        self.insertListener = listener
+
+    def __len__(self) -> int:
+        return len(self.index)
@@ -0,0 +1,96 @@
+# Tests of the response cache: LRU eviction, invalidation of the replies about an added country, and clearing on reloads
+
+import os, tempfile, unittest
+from cache import ResponseCache
+from compression import CompressionPolicy, CODEC_NONE, CODEC_NAMES
+from packet import Packet, encodePacket, decodeFrom
+from persistence import WriteAheadLog
+from store import CountryStore
+from server import Server
+
+ENTRY = (b"frame", 5, CODEC_NONE)
+
+
+class ResponseCacheTest(unittest.TestCase):
+    #A full cache evicts the least recently used frame, a hit counting as a use.
+    def testEviction(self):
+        cache = ResponseCache(2)
+        cache.put(("c", "Albania", 0), ENTRY, cache.getEpoch())
+        cache.put(("c", "Andorra", 0), ENTRY, cache.getEpoch())
+        self.assertEqual(cache.get(("c", "Albania", 0)), ENTRY)
+        cache.put(("c", "Angola", 0), ENTRY, cache.getEpoch())
+        self.assertIsNone(cache.get(("c", "Andorra", 0)))
+        self.assertEqual(cache.get(("c", "Albania", 0)), ENTRY)
+        stats = cache.getStats()
+        self.assertEqual((stats["size"], stats["hits"], stats["misses"], stats["evictions"]), (2, 2, 1, 1))
+        self.assertAlmostEqual(stats["hitRatio"], 2 / 3)
+
+    #The replies about a country are dropped for every codec, and a reply worked out before that is not cached after it.
+    def testInvalidate(self):
+        cache = ResponseCache()
+        for codec in CODEC_NAMES:
+            cache.put(("c", "Albania", codec), ENTRY, cache.getEpoch())
+        cache.put(("c", "Andorra", CODEC_NONE), ENTRY, cache.getEpoch())
+        epoch = cache.getEpoch()
+        cache.invalidate(("c",), "Albania")
+        self.assertEqual(cache.getStats()["invalidations"], len(CODEC_NAMES))
+        self.assertEqual(cache.getStats()["size"], 1)
+        cache.put(("c", "Albania", CODEC_NONE), ENTRY, epoch) # a stale reply
+        self.assertIsNone(cache.get(("c", "Albania", CODEC_NONE)))
+
+    #A new generation of the store clears the cache, and with it the replies worked out from the previous one.
+    def testSync(self):
+        cache = ResponseCache()
+        cache.sync(1)
+        epoch = cache.getEpoch()
+        cache.put(("c", "Albania", CODEC_NONE), ENTRY, epoch)
+        cache.sync(1)
+        self.assertEqual(cache.get(("c", "Albania", CODEC_NONE)), ENTRY)
+        cache.sync(2)
+        self.assertIsNone(cache.get(("c", "Albania", CODEC_NONE)))
+        cache.put(("c", "Albania", CODEC_NONE), ENTRY, epoch)
+        self.assertEqual(cache.getStats()["size"], 0)
+
+    def testDisabled(self):
+        cache = ResponseCache(0)
+        self.assertFalse(cache.isEnabled())
+        cache.put(("c", "Albania", CODEC_NONE), ENTRY, cache.getEpoch())
+        self.assertEqual(cache.getStats()["size"], 0)
+
+
+class ServerCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, "countries.csv")
+        with open(path, "w", newline="", encoding="utf-8") as csvFile:
+            csvFile.write("Country,Capital\nAlbania,Tirana\n")
+        self.server = Server(countriesFile=path, cacheSize=16)
+        self.server.serverSocket.close()
+        # with a write-ahead log, an insert does not change the generation of the store, so only the invalidation drops the reply
+        self.server.store = CountryStore(path, log=WriteAheadLog(path + ".wal"))
+        self.server.store.setInsertListener(self.server.countryAdded)
+        self.policy = CompressionPolicy("none")
+
+    def tearDown(self):
+        self.server.store.log.close()
+        self.directory.cleanup()
+
+    #Sends a request through the server's inline path, and returns the contents of the reply.
+    def request(self, command:str, contents:str) -> str:
+        output = bytearray()
+        end = self.server.handleFrame(encodePacket(Packet(command, contents, 1), self.policy), self.server.compression, output, 0)
+        return decodeFrom(output[:end], self.policy).getContents()
+
+    #The cached reply about a missing country is dropped once it is added.
+    def testInsertInvalidatesReply(self):
+        missing = self.request("c", "Atlantis")
+        self.assertEqual(self.request("c", "atlantis"), missing)
+        self.assertEqual(self.server.cache.getStats()["hits"], 1)
+        generation = self.server.store.getGeneration()
+        self.assertIn("successfully added", self.server.addNewEntry("Atlantis,Poseidonia"))
+        self.assertEqual(self.server.store.getGeneration(), generation)
+        self.assertEqual(self.request("c", "Atlantis"), "Poseidonia")
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,145 @@
+# Tests of the command registry: registration, the advertised capabilities, running handlers of every kind, and the
+# dispatch of requests and streamed replies by the server
+
+import asyncio, json, unittest
+from commands import Command, CommandRegistry, BackgroundLoop
+from compression import CompressionPolicy
+from framing import FLAG_MORE, PROTOCOL_VERSION, unpackHeader
+from packet import Packet, encodePacket, decodeFrom
+from server import Server, HANDLER_ERROR_REPLY
+
+
+def upper(contents:str) -> str:
+    return contents.upper()
+
+async def upperAsync(contents:str) -> str:
+    return contents.upper()
+
+def letters(contents:str):
+    yield from contents
+
+async def lettersAsync(contents:str):
+    for letter in contents:
+        yield letter
+
+def failing(contents:str):
+    yield contents
+    raise RuntimeError("handler failed")
+
+
+#Collects the chunks of the reply of a command.
+def results(command:Command, *arguments) -> list:
+    async def collect():
+        return [chunk async for chunk in command.results(*arguments)]
+    return asyncio.run(collect())
+
+
+class CommandTest(unittest.TestCase):
+    def testKinds(self):
+        kinds = {upper:"sync", upperAsync:"async", letters:"stream", lettersAsync:"async-stream"}
+        for handler, kind in kinds.items():
+            with self.subTest(kind=kind):
+                command = Command("x", "X", handler)
+                self.assertEqual(command.kind, kind)
+                self.assertEqual(command.isSync(), kind == "sync")
+                self.assertEqual(command.isStreaming(), kind.endswith("stream"))
+
+    #Every kind of handler yields the chunks of its reply, in an executor or not.
+    def testResults(self):
+        for handler, expected in ((upper, ["AB"]), (upperAsync, ["AB"]), (letters, ["a", "b"]), (lettersAsync, ["a", "b"])):
+            for blocking in (False, True):
+                with self.subTest(handler=handler.__name__, blocking=blocking):
+                    self.assertEqual(results(Command("x", "X", handler, blocking=blocking), "ab"), expected)
+
+
+class CommandRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = CommandRegistry()
+        self.registry.register("u", "UPPER", upper, "Upper-case the contents")
+
+    def testRegister(self):
+        self.assertIn("u", self.registry)
+        self.assertEqual(self.registry.get("u").handler, upper)
+        self.assertIsNone(self.registry.get("v"))
+        with self.assertRaises(ValueError):
+            self.registry.register("u", "AGAIN", upper)
+        for key in ("", "uv", "\x00", "Ā"):
+            with self.subTest(key=key), self.assertRaises(ValueError):
+                self.registry.register(key, "INVALID", upper)
+        self.registry.unregister("u")
+        self.registry.unregister("u")
+        self.assertNotIn("u", self.registry)
+
+    def testDecorator(self):
+        @self.registry.command("l", "LETTERS", "Stream the letters", blocking=True)
+        def handler(contents):
+            yield from contents
+        self.assertTrue(callable(handler))
+        self.assertTrue(self.registry.get("l").blocking)
+        self.assertEqual([command.key for command in self.registry], ["u", "l"])
+
+    #Clients are sent the capabilities on connecting, in a frame rebuilt only when the commands change.
+    def testCapabilities(self):
+        capabilities = json.loads(self.registry.getCapabilities())
+        self.assertEqual(capabilities["protocol"], PROTOCOL_VERSION)
+        self.assertEqual(capabilities["commands"], {"u":{"name":"UPPER", "description":"Upper-case the contents", "streaming":False}})
+        advertisement = self.registry.getAdvertisement()
+        self.assertIs(self.registry.getAdvertisement(), advertisement)
+        self.assertEqual(unpackHeader(advertisement)[2], 0) # the reserved request id
+        self.assertEqual(json.loads(decodeFrom(advertisement, CompressionPolicy()).getContents()), capabilities)
+        self.registry.register("l", "LETTERS", letters)
+        self.assertIn("LETTERS", decodeFrom(self.registry.getAdvertisement(), CompressionPolicy()).getContents())
+
+    #Outside asyncio mode, async generators are iterated a step at a time on the background loop.
+    def testBackgroundLoop(self):
+        loop = BackgroundLoop()
+        self.assertEqual(loop.run(upperAsync("ab")), "AB")
+        self.assertEqual(list(loop.iterate(lettersAsync("abc"))), ["a", "b", "c"])
+
+
+class DispatchTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.server.serverSocket.close()
+        self.server.commands.register("u", "UPPER", upper)
+        self.server.commands.register("l", "LETTERS", letters)
+        self.server.commands.register("L", "LETTERS_ASYNC", lettersAsync)
+        self.server.commands.register("x", "FAILING", failing)
+        self.policy = CompressionPolicy("none")
+
+    def frame(self, command:str, contents:str, requestId:int=5):
+        return memoryview(encodePacket(Packet(command, contents, requestId), self.policy))
+
+    #Collects the reply packets of a command that is not run inline.
+    def replies(self, command:str, contents:str) -> list:
+        async def collect():
+            return [packet async for packet in self.server.commandReplies(self.frame(command, contents), self.policy)]
+        return asyncio.run(collect())
+
+
+    #Plain functions are answered inline, and unknown commands get an error reply.
+    def testInlineDispatch(self):
+        self.assertEqual(self.server.receiveMessage(self.frame("u", "ab"), self.policy), Packet("", "AB", 5))
+        self.assertEqual(self.server.receiveMessage(self.frame("h", ""), self.policy), Packet("", "beat", 5))
+        self.assertEqual(self.server.receiveMessage(self.frame("z", ""), self.policy).getContents(), "Invalid command received by server")
+        self.assertTrue(self.server.runsInline(self.server.commands.get("u")))
+        self.assertFalse(self.server.runsInline(self.server.commands.get("l")))
+        self.assertFalse(self.server.runsInline(self.server.commands.get("a"))) # adds run in an executor
+
+    #Every frame of a streamed reply but the last is flagged FLAG_MORE, and all carry the request id.
+    def testStreamedReply(self):
+        for command in ("l", "L"):
+            with self.subTest(command=command):
+                self.assertEqual(self.replies(command, "abc"), [Packet("", "a", 5, FLAG_MORE), Packet("", "b", 5, FLAG_MORE), Packet("", "c", 5)])
+                self.assertEqual(self.replies(command, ""), [Packet("", "", 5)])
+        self.assertEqual(self.replies("u", "ab"), [Packet("", "AB", 5)])
+
+    #A handler that fails partway through ends its reply with an error frame, and is counted.
+    def testFailedStream(self):
+        with self.assertLogs("server", "ERROR"):
+            self.assertEqual(self.replies("x", "ab"), [Packet("", HANDLER_ERROR_REPLY, 5)])
+        self.assertEqual(self.server.metrics.getStats()["counters"]["errors.handler"], 1)
+
+
+if(__name__ == "__main__"):
+    unittest.main()
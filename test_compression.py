@@ -0,0 +1,147 @@
+# Tests of the compression policy: codecs, the size threshold, negotiation, the cap on decompressed payloads, and the
+# preset-dictionary and streaming zlib codecs
+
+import bz2, lzma, unittest, zlib
+from compression import (CompressionPolicy, CODECS, CODEC_NONE, CODEC_ZLIB, CODEC_ZDICT, CODEC_ZSTREAM, DEFAULT_THRESHOLD,
+                         DICTIONARY_THRESHOLD, DECOMPRESSION_ERRORS, MAX_DICTIONARY_SIZE, SYNC_FLUSH_TRAILER, buildDictionary,
+                         compressWith, decompressWith)
+from framing import FrameError, MAX_PAYLOAD_SIZE
+
+TEXT = "Albania,Tirana\n".encode("utf-8") * 20
+
+
+class CodecTest(unittest.TestCase):
+    def testRoundTrips(self):
+        for name in ("none", "zlib", "lzma", "bz2"):
+            with self.subTest(codec=name):
+                self.assertEqual(bytes(decompressWith(CODECS[name], compressWith(CODECS[name], TEXT))), TEXT)
+
+    def testUnknownCodec(self):
+        with self.assertRaises(ValueError):
+            decompressWith(9, b"")
+        with self.assertRaises(ValueError):
+            CompressionPolicy("brotli")
+
+    def testTruncatedData(self):
+        for name in ("zlib", "lzma", "bz2"):
+            with self.subTest(codec=name), self.assertRaises(DECOMPRESSION_ERRORS):
+                decompressWith(CODECS[name], compressWith(CODECS[name], TEXT)[:-4])
+
+    #A payload that would decompress past MAX_PAYLOAD_SIZE is a FrameError, and is never expanded in full.
+    def testDecompressionBombs(self):
+        zeros = bytes(MAX_PAYLOAD_SIZE + 1)
+        bombs = {"zlib":zlib.compress(zeros), "lzma":lzma.compress(zeros, format=lzma.FORMAT_ALONE), "bz2":bz2.compress(zeros)}
+        for name, bomb in bombs.items():
+            with self.subTest(codec=name), self.assertRaises(FrameError):
+                CompressionPolicy().decompress(CODECS[name], bomb)
+        sender, receiver = CompressionPolicy("zstream"), CompressionPolicy("zstream")
+        flags, payload = sender.compress(zeros)
+        with self.assertRaises(FrameError):
+            receiver.decompress(flags, payload)
+
+
+class ThresholdTest(unittest.TestCase):
+    #Payloads below the threshold are sent as they are, and larger ones compressed.
+    def testThreshold(self):
+        policy = CompressionPolicy("zlib")
+        self.assertEqual(policy.compress(b"Tirana"), (CODEC_NONE, b"Tirana"))
+        flags, payload = policy.compress(TEXT)
+        self.assertEqual(flags, CODEC_ZLIB)
+        self.assertEqual(policy.decompress(flags, payload), TEXT)
+        self.assertEqual(policy.getThreshold(), DEFAULT_THRESHOLD)
+        self.assertEqual(CompressionPolicy("zlib", threshold=1000).compress(TEXT), (CODEC_NONE, TEXT))
+
+    #A payload the codec would make bigger is sent as it is.
+    def testIncompressiblePayload(self):
+        noise = bytes(range(256))
+        self.assertEqual(CompressionPolicy("zlib", threshold=0).compress(noise), (CODEC_NONE, noise))
+
+    def testStats(self):
+        policy = CompressionPolicy("zlib")
+        flags, payload = policy.compress(TEXT)
+        stats = policy.getStats().getStats()
+        self.assertEqual((stats["messages"], stats["rawBytes"], stats["wireBytes"]), (1, len(TEXT), len(payload)))
+        self.assertEqual(stats["codecs"]["zlib"]["messages"], 1)
+
+
+class NegotiationTest(unittest.TestCase):
+    #The configured codec is kept if the peer offers it, otherwise the peer's first supported choice is taken.
+    def testChoice(self):
+        self.assertEqual(CompressionPolicy("lzma").negotiate(["zlib", "lzma"]), "lzma")
+        self.assertEqual(CompressionPolicy("lzma").negotiate(["snappy", "bz2", "zlib"]), "bz2")
+        self.assertEqual(CompressionPolicy("lzma").negotiate(["snappy"]), "none")
+        self.assertEqual(CompressionPolicy("zdict").negotiate(["zdict", "zlib"]), "zlib") # no dictionary to share
+
+    #The codec chosen takes over after the reply to the negotiation, which the peer must still be able to read.
+    def testSwitchAfterReply(self):
+        policy = CompressionPolicy("zlib").copy()
+        self.assertEqual(policy.negotiate(["bz2"]), "bz2")
+        self.assertFalse(policy.isStateless())
+        self.assertEqual(policy.compress(TEXT)[0], CODEC_ZLIB)
+        self.assertEqual(policy.getCodecName(), "bz2")
+        self.assertTrue(policy.isStateless())
+
+    #Copies negotiate on their own, and add their counters to those of the policy they were copied from.
+    def testCopies(self):
+        policy = CompressionPolicy("zlib")
+        first, second = policy.copy(), policy.copy()
+        first.negotiate(["none"])
+        first.compress(TEXT)
+        second.compress(TEXT)
+        self.assertEqual((first.getCodecName(), second.getCodecName()), ("none", "zlib"))
+        self.assertEqual(policy.getStats().getStats()["messages"], 2)
+
+
+class DictionaryTest(unittest.TestCase):
+    def setUp(self):
+        self.dictionary = buildDictionary([("Albania", "Tirana"), ("Andorra", "Andorra la Vella"), ("Angola", "Luanda")])
+
+    #The dictionary is the end of the entries, cut on a character boundary to fit the deflate window.
+    def testBuildDictionary(self):
+        self.assertEqual(self.dictionary, "Albania\nTirana\nAndorra\nAndorra la Vella\nAngola\nLuanda\n".encode("utf-8"))
+        dictionary = buildDictionary([("Česko", "Praha")] * 10000)
+        self.assertLessEqual(len(dictionary), MAX_DICTIONARY_SIZE)
+        self.assertTrue(dictionary.decode("utf-8").endswith("Česko\nPraha\n"))
+
+    #Even the smallest payloads shrink against the dictionary, each compressed on its own so it decodes in any order.
+    def testZdict(self):
+        sender, receiver = CompressionPolicy("zdict", dictionary=self.dictionary), CompressionPolicy(dictionary=self.dictionary)
+        self.assertEqual(sender.getThreshold(), DICTIONARY_THRESHOLD)
+        frames = [sender.compress(city) for city in (b"Tirana", b"Andorra la Vella")]
+        for (flags, payload), city in reversed(list(zip(frames, (b"Tirana", b"Andorra la Vella")))):
+            self.assertEqual(flags, CODEC_ZDICT)
+            self.assertLess(len(payload), len(city))
+            self.assertEqual(receiver.decompress(flags, payload), city)
+        self.assertTrue(sender.isStateless())
+
+    #The stream carries its history over between payloads, which must be decoded in the order they were sent.
+    def testZstream(self):
+        sender, receiver = CompressionPolicy("zstream", dictionary=self.dictionary), CompressionPolicy(dictionary=self.dictionary)
+        self.assertFalse(sender.isStateless())
+        sizes = list()
+        for city in (b"Kuala Lumpur", b"Kuala Lumpur", b"Tirana"):
+            flags, payload = sender.compress(city)
+            self.assertEqual(flags, CODEC_ZSTREAM)
+            self.assertFalse(payload.endswith(SYNC_FLUSH_TRAILER))
+            self.assertEqual(receiver.decompress(flags, payload), city)
+            sizes.append(len(payload))
+        self.assertLess(sizes[1], sizes[0]) # the repeat refers back to the first one
+        other = CompressionPolicy(dictionary=self.dictionary) # a decompressor that missed the history
+        self.assertNotEqual(other.decompress(*sender.compress(b"Kuala Lumpur")), b"Kuala Lumpur")
+
+    #Copies are limited to zlib until the dictionary codecs are negotiated, and each keeps its own stream.
+    def testCopies(self):
+        policy = CompressionPolicy("zstream", dictionary=self.dictionary)
+        first, second = policy.copy(), policy.copy()
+        self.assertEqual(first.getCodecName(), "zlib")
+        self.assertEqual(first.negotiate(["zstream", "zlib"]), "zstream")
+        self.assertEqual(second.negotiate(["zstream", "zlib"]), "zstream")
+        first.compress(b"") # the replies to the negotiations
+        second.compress(b"")
+        receiver = CompressionPolicy(dictionary=self.dictionary)
+        self.assertEqual(receiver.decompress(*first.compress(b"Tirana")), b"Tirana")
+        self.assertEqual(CompressionPolicy(dictionary=self.dictionary).decompress(*second.compress(b"Tirana")), b"Tirana")
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,93 @@
+# Tests of the length-prefixed framing: headers, and frames reassembled however the stream is split
+
+import socket, unittest
+from framing import (FrameReader, FrameError, HEADER, MAX_PAYLOAD_SIZE, MAX_REQUEST_ID, PROTOCOL_VERSION, PING_FRAME,
+                     PONG_FRAME, packHeader, unpackHeader, nextRequestId, setRequestId, isPing)
+
+
+#Builds a frame with the given payload.
+def makeFrame(command:str, payload:bytes, requestId:int=1) -> bytes:
+    return packHeader(command, 0, len(payload), requestId) + payload
+
+
+class HeaderTest(unittest.TestCase):
+    def testRoundTrip(self):
+        header = packHeader("c", 0x0021, 5, 42)
+        self.assertEqual(len(header), HEADER.size)
+        self.assertEqual(unpackHeader(header), ("c", 0x0021, 42, 5))
+        self.assertEqual(unpackHeader(b"xx" + header, 2), ("c", 0x0021, 42, 5))
+
+    def testInvalidHeaders(self):
+        with self.assertRaises(FrameError):
+            unpackHeader(HEADER.pack(PROTOCOL_VERSION + 1, 0, 0, 0, 0))
+        with self.assertRaises(FrameError):
+            unpackHeader(HEADER.pack(PROTOCOL_VERSION, 0, 0, 0, MAX_PAYLOAD_SIZE + 1))
+
+    def testRequestIds(self):
+        self.assertEqual(nextRequestId(0), 1)
+        self.assertEqual(nextRequestId(MAX_REQUEST_ID), 1) # 0 is reserved
+        buffer = bytearray(b"xx" + makeFrame("c", b"abc", 7))
+        setRequestId(buffer, 2, 9)
+        self.assertEqual(unpackHeader(buffer, 2)[2], 9)
+
+    def testKeepaliveFrames(self):
+        self.assertTrue(isPing(PING_FRAME))
+        self.assertFalse(isPing(makeFrame("h", b"", 3))) # a heartbeat request, not a ping
+        self.assertEqual(unpackHeader(PONG_FRAME), ("", 0, 0, 0))
+
+
+class FrameReaderTest(unittest.TestCase):
+    #Frames split anywhere, byte by byte, come out whole and in order.
+    def testPartialFrames(self):
+        stream = makeFrame("c", b"Albania", 1) + makeFrame("p", b"", 2) + makeFrame("c", b"Andorra", 3)
+        reader = FrameReader(16)
+        received = list()
+        for byte in stream:
+            reader.feed(bytes([byte]))
+            received.extend(bytes(frame) for frame in reader.frames())
+        self.assertEqual(received, [makeFrame("c", b"Albania", 1), makeFrame("p", b"", 2), makeFrame("c", b"Andorra", 3)])
+
+    #Several frames received in one go are all handed out, and a trailing partial one is kept for the next read.
+    def testCoalescedFrames(self):
+        stream = makeFrame("c", b"a" * 10, 1) + makeFrame("c", b"b" * 10, 2)
+        reader = FrameReader(8)
+        reader.feed(stream + stream[:5])
+        self.assertEqual([unpackHeader(frame)[2] for frame in reader.frames()], [1, 2])
+        reader.feed(stream[5:len(stream) // 2])
+        self.assertEqual([bytes(frame) for frame in reader.frames()], [stream[:len(stream) // 2]])
+
+    #The buffer grows to fit frames larger than it, and shrinks back once they are handled.
+    def testOversizedFrames(self):
+        reader = FrameReader(16)
+        large = makeFrame("b", b"x" * 1000)
+        reader.feed(large[:500])
+        self.assertEqual(list(reader.frames()), list())
+        reader.feed(large[500:])
+        self.assertEqual([bytes(frame) for frame in reader.frames()], [large])
+        reader.feed(makeFrame("c", b"y"))
+        self.assertEqual(len(list(reader.frames())), 1)
+        self.assertLessEqual(len(reader.buffer), 4 * 16)
+
+    #A header announcing a payload over the maximum is a FrameError, rather than a huge buffer.
+    def testFrameTooLarge(self):
+        reader = FrameReader()
+        reader.feed(HEADER.pack(PROTOCOL_VERSION, ord("c"), 0, 1, MAX_PAYLOAD_SIZE + 1))
+        with self.assertRaises(FrameError):
+            list(reader.frames())
+
+    def testRecvFrom(self):
+        left, right = socket.socketpair()
+        with left, right:
+            left.sendall(makeFrame("c", b"Albania") + makeFrame("c", b"Andorra"))
+            reader = FrameReader(4)
+            frames = list()
+            while(len(frames) < 2):
+                self.assertGreater(reader.recvFrom(right), 0)
+                frames.extend(bytes(frame) for frame in reader.frames())
+            left.close()
+            self.assertEqual(reader.recvFrom(right), 0)
+        self.assertEqual(frames, [makeFrame("c", b"Albania"), makeFrame("c", b"Andorra")])
+
+
+if(__name__ == "__main__"):
+    unittest.main()
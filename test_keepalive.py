@@ -0,0 +1,75 @@
+# Tests of the keepalive scheduler: silent connections are pinged once, and reaped once they reach the idle timeout
+
+import unittest
+from keepalive import KeepaliveScheduler
+
+
+class KeepaliveSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.events = list()
+        self.scheduler = KeepaliveScheduler(pingInterval=30, idleTimeout=90)
+
+    #Registers a connection whose pings and closes are recorded, and returns it with the time it was last active.
+    def register(self, name:str):
+        peer = self.scheduler.register(lambda: self.events.append(("ping", name)), lambda: self.events.append(("close", name)))
+        return peer, peer.lastActivity
+
+    def testDisabled(self):
+        scheduler = KeepaliveScheduler(0, 0)
+        self.assertFalse(scheduler.isEnabled())
+        self.assertIsNone(scheduler.register(lambda: None, lambda: None))
+        self.assertIsNone(scheduler.runDue(0))
+
+
+    #A silent connection is pinged once at the ping interval, and closed at the idle timeout.
+    def testPingThenReap(self):
+        peer, start = self.register("a")
+        self.assertAlmostEqual(self.scheduler.runDue(start + 10), 20)
+        self.assertEqual(self.events, list())
+        self.scheduler.runDue(start + 30)
+        self.scheduler.runDue(start + 60)
+        self.assertEqual(self.events, [("ping", "a")])
+        self.assertAlmostEqual(self.scheduler.runDue(start + 60), 30)
+        self.scheduler.runDue(start + 90)
+        self.assertEqual(self.events, [("ping", "a"), ("close", "a")])
+        self.assertTrue(peer.closed)
+        self.assertIsNone(self.scheduler.runDue(start + 200))
+
+
+    #Activity pushes the deadlines back, and a connection that answers a ping can be pinged again after another silence.
+    def testActivityReschedules(self):
+        peer, start = self.register("a")
+        peer.lastActivity = start + 20
+        self.scheduler.runDue(start + 30)
+        self.assertEqual(self.events, list())
+        self.scheduler.runDue(start + 50)
+        peer.lastActivity = start + 55 # the answer to the ping
+        self.scheduler.runDue(start + 85)
+        self.scheduler.runDue(start + 110)
+        self.assertEqual(self.events, [("ping", "a"), ("ping", "a")])
+        self.assertFalse(peer.closed)
+
+
+    #Connections that closed are dropped from the heap when their deadline comes, without being pinged.
+    def testUnregister(self):
+        first, start = self.register("a")
+        second = self.register("b")[0]
+        self.scheduler.unregister(first)
+        self.scheduler.unregister(None)
+        self.scheduler.runDue(start + 100)
+        self.assertEqual(self.events, [("close", "b")])
+        self.assertTrue(second.closed)
+
+
+    #Without an idle timeout, a connection is pinged once per silence, and never closed.
+    def testPingOnly(self):
+        self.scheduler = KeepaliveScheduler(pingInterval=30, idleTimeout=0)
+        peer, start = self.register("a")
+        for seconds in range(30, 300, 30):
+            self.scheduler.runDue(start + seconds)
+        self.assertEqual(self.events, [("ping", "a")])
+        self.assertFalse(peer.closed)
+
+
+if(__name__ == "__main__"):
+    unittest.main()
@@ -0,0 +1,123 @@
+# Tests of the token-bucket rate limits of each client, and of the admission of connections at the connection limit
+
+import unittest
+from unittest import mock
+from limits import RateLimiter, TokenBucket, parseLimits
+from framing import FLAG_BUSY
+from compression import CompressionPolicy
+from packet import Packet, encodePacket, decodeFrom
+from server import Server, BUSY_FRAME, BUSY_REPLY
+
+
+class ParseLimitsTest(unittest.TestCase):
+    def testParse(self):
+        self.assertEqual(parseLimits("a=5, c=500,*=1000"), {"a":5.0, "c":500.0, "*":1000.0})
+        self.assertEqual(parseLimits(""), dict())
+        for limits in ("a", "ab=5", "a=", "a=x", "a=0", "a=-1"):
+            with self.subTest(limits=limits), self.assertRaises(ValueError):
+                parseLimits(limits)
+
+
+class TokenBucketTest(unittest.TestCase):
+    #A bucket starts full, refills at its rate, and never holds more than its capacity.
+    def testRefill(self):
+        bucket = TokenBucket(rate=2, capacity=4, now=10)
+        bucket.tokens = 0
+        self.assertEqual(bucket.refill(11), 2)
+        self.assertFalse(bucket.isFull(11.5))
+        self.assertTrue(bucket.isFull(12))
+        self.assertEqual(bucket.refill(20), 4)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch("limits.time.monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def allowed(self, limiter:RateLimiter, client:str, command:str, requests:int) -> int:
+        return sum(limiter.allow(client, command) for request in range(requests))
+
+
+    #A burst of a second's worth of requests is allowed, then requests are allowed at the rate, per client.
+    def testBurstAndRefill(self):
+        limiter = RateLimiter({"a":2})
+        self.assertTrue(limiter.isEnabled())
+        self.assertEqual(self.allowed(limiter, "10.0.0.1", "a", 5), 2)
+        self.assertEqual(self.allowed(limiter, "10.0.0.2", "a", 5), 2)
+        self.assertEqual(self.allowed(limiter, "10.0.0.1", "c", 50), 50) # not limited
+        self.now += 0.5
+        self.assertEqual(self.allowed(limiter, "10.0.0.1", "a", 5), 1)
+
+    #Slow rates still allow a request at once, rather than a burst of less than one token.
+    def testSlowRate(self):
+        limiter = RateLimiter({"a":0.1})
+        self.assertEqual(self.allowed(limiter, "10.0.0.1", "a", 3), 1)
+        self.now += 10
+        self.assertEqual(self.allowed(limiter, "10.0.0.1", "a", 3), 1)
+
+
+    #A request takes a token from the bucket of its command and from the one of all commands, or from neither.
+    def testAllCommands(self):
+        limiter = RateLimiter({"a":1, "*":3})
+        self.assertTrue(limiter.allow("10.0.0.1", "a"))
+        self.assertFalse(limiter.allow("10.0.0.1", "a"))
+        self.assertEqual(self.allowed(limiter, "10.0.0.1", "c", 5), 2)
+        self.assertFalse(limiter.allow("10.0.0.1", "a"))
+
+    def testNoLimits(self):
+        limiter = RateLimiter()
+        self.assertFalse(limiter.isEnabled())
+        self.assertEqual(self.allowed(limiter, "10.0.0.1", "a", 100), 100)
+        self.assertEqual(limiter.clients, dict())
+
+
+    #Clients whose buckets are full again are dropped once there are too many, and start afresh if they come back.
+    def testPrune(self):
+        limiter = RateLimiter({"a":1})
+        limiter.pruneAt = 2
+        limiter.allow("10.0.0.1", "a")
+        self.now += 5
+        limiter.allow("10.0.0.2", "a")
+        limiter.allow("10.0.0.3", "a")
+        self.assertEqual(sorted(limiter.clients), ["10.0.0.2", "10.0.0.3"])
+
+
+class AdmissionTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server(maxConnections=2, rateLimits={"c":1})
+        self.server.serverSocket.close()
+
+    #Connections over the limit are sent a busy frame, and admitted again once a connection closes.
+    def testConnectionLimit(self):
+        sent = list()
+        self.server.connections.update(("first", "second"))
+        self.assertFalse(self.server.admitConnection(("127.0.0.1", 1), sent.append))
+        self.assertEqual(sent, [BUSY_FRAME])
+        self.assertEqual(self.server.metrics.getStats()["counters"]["rejected.admission"], 1)
+        self.server.connections.discard("first")
+        self.assertTrue(self.server.admitConnection(("127.0.0.1", 2), sent.append))
+        self.assertEqual(len(sent), 1)
+
+    #In thread-pool mode, connections beyond the pool's size are turned away rather than queued.
+    def testThreadPoolLimit(self):
+        for maxConnections, expected in ((0, 4), (2, 2), (8, 4)):
+            server = Server(mode="threads", threads=4, maxConnections=maxConnections)
+            server.serverSocket.close()
+            self.assertEqual(server.maxConnections, expected)
+
+    #A request over its client's rate limit gets a busy reply carrying its request id, without being carried out.
+    def testRateLimitedRequest(self):
+        policy = CompressionPolicy("none")
+        output = bytearray()
+        frame = encodePacket(Packet("c", "Albania", 7), policy)
+        with mock.patch.object(self.server, "receiveMessage", side_effect=AssertionError("carried out")):
+            self.server.limiter.allow("10.0.0.1", "c") # the only token of the client
+            end = self.server.handleFrame(frame, self.server.compression.copy(), output, 0, "10.0.0.1")
+        self.assertEqual(decodeFrom(output[:end], policy), Packet("", BUSY_REPLY, 7, FLAG_BUSY))
+        self.assertEqual(self.server.metrics.getStats()["counters"]["rejected.ratelimit"], 1)
+
+
+if(__name__ == "__main__"):
+    unittest.main()
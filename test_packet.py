@@ -0,0 +1,70 @@
+# Tests of the immutable Packet and its encoding into, and decoding from, frames
+
+import unittest
+from packet import Packet, encodeInto, encodePacket, decodeFrom
+from framing import FrameReader, FLAG_BUSY, FLAG_MORE, HEADER, unpackHeader
+from compression import CompressionPolicy, CODEC_NONE, CODEC_ZLIB, DECOMPRESSION_ERRORS
+
+
+class PacketTest(unittest.TestCase):
+    def testImmutable(self):
+        packet = Packet("c", "Albania", 3)
+        with self.assertRaises(AttributeError):
+            packet.contents = "Andorra"
+        with self.assertRaises(AttributeError):
+            del packet.command
+        with self.assertRaises(AttributeError):
+            packet.extra = 1
+
+    def testEquality(self):
+        self.assertEqual(Packet("c", "Albania", 3), Packet("c", "Albania", 3, size=99))
+        self.assertNotEqual(Packet("c", "Albania", 3), Packet("c", "Albania", 4))
+        self.assertEqual(len({Packet("c", "Albania"), Packet("c", "Albania")}), 1)
+
+    def testSize(self):
+        self.assertEqual(Packet("c", "Česko").getSize(), HEADER.size + len("Česko".encode("utf-8")))
+
+
+class EncodingTest(unittest.TestCase):
+    #Packets come back as they were, whichever codec their payload was compressed with.
+    def testRoundTrip(self):
+        for codec in ("none", "zlib", "lzma", "bz2", "zstream"):
+            with self.subTest(codec=codec):
+                sender, receiver = CompressionPolicy(codec, threshold=0), CompressionPolicy()
+                for packet in (Packet("c", "Česko", 1), Packet("", "Tirana\n" * 100, 2, FLAG_MORE), Packet("h", "", 3)):
+                    decoded = decodeFrom(encodePacket(packet, sender), receiver)
+                    self.assertEqual(decoded, packet)
+                    self.assertEqual(decoded.getSize(), packet.getSize())
+
+    #Frames are written at the given offset, growing the buffer as needed, so several can be collected for one send.
+    def testEncodeInto(self):
+        policy = CompressionPolicy("none")
+        buffer = bytearray(4)
+        end = encodeInto(Packet("c", "Albania", 1), buffer, 0, policy)
+        end = encodeInto(Packet("", "Busy", 2, FLAG_BUSY), buffer, end, policy)
+        self.assertEqual(len(buffer), end)
+        reader = FrameReader()
+        reader.feed(bytes(buffer))
+        self.assertEqual([decodeFrom(frame, policy) for frame in reader.frames()], [Packet("c", "Albania", 1), Packet("", "Busy", 2, FLAG_BUSY)])
+
+    #The codec is recorded in the flags of the frame, without changing the flags of the packet.
+    def testCodecFlags(self):
+        frame = encodePacket(Packet("c", "Tirana " * 20, 5, FLAG_MORE), CompressionPolicy("zlib"))
+        self.assertEqual(unpackHeader(frame)[1], FLAG_MORE | CODEC_ZLIB)
+        frame = encodePacket(Packet("c", "Tirana", 5), CompressionPolicy("zlib"))
+        self.assertEqual(unpackHeader(frame)[1], CODEC_NONE) # below the threshold
+
+    #Decoding reads straight from a memoryview of the receive buffer.
+    def testDecodeFromMemoryview(self):
+        frame = bytearray(b"xx") + encodePacket(Packet("c", "Albania", 1), CompressionPolicy("none"))
+        self.assertEqual(decodeFrom(memoryview(frame)[2:], CompressionPolicy()), Packet("c", "Albania", 1))
+
+    def testInvalidPayload(self):
+        frame = encodePacket(Packet("c", "Albania", 1), CompressionPolicy("none"))
+        frame[HEADER.size] = 0xff # not UTF-8
+        with self.assertRaises(DECOMPRESSION_ERRORS):
+            decodeFrom(frame, CompressionPolicy())
+
+
+if(__name__ == "__main__"):
+    unittest.main()
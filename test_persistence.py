@@ -0,0 +1,52 @@
+# Tests of the write-ahead log's group commit thread when syncing or compacting fails
+
+import os, tempfile, threading, unittest
+from unittest import mock
+import persistence
+from persistence import WriteAheadLog
+
+
+class CommitLoopTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.log = WriteAheadLog(os.path.join(self.directory.name, "countries.wal"), flushInterval=0.01, compactThreshold=2)
+
+    def tearDown(self):
+        self.log.close()
+        self.directory.cleanup()
+
+
+    #A failed fsync fails the appends waiting for it, and the next group commit syncs the records once fsync works again.
+    def testFailedSyncWakesWaitersAndRecovers(self):
+        with mock.patch.object(persistence.os, "fsync", side_effect=OSError(5, "Input/output error")):
+            sequence = self.log.append("Atlantis", "Poseidonia")
+            with self.assertRaises(OSError):
+                self.log.waitForSync(sequence)
+        sequence = self.log.append("Lemuria", "Kumari")
+        self.log.waitForSync(sequence)
+        self.assertTrue(self.log.thread.is_alive())
+        self.assertEqual(self.log.synced, self.log.written)
+
+
+    #A compactor that raises does not stop the group commits, and is called again after the retry delay.
+    def testFailedCompactionKeepsCommitting(self):
+        calls = []
+        compacted = threading.Event()
+        def compactor():
+            calls.append(1)
+            if(len(calls) == 1):
+                raise OSError(28, "No space left on device")
+            self.log.truncate()
+            compacted.set()
+        self.log.setCompactor(compactor)
+        with mock.patch.object(persistence, "COMPACT_RETRY_DELAY", 0.05):
+            self.log.append("Atlantis", "Poseidonia")
+            self.log.waitForSync(self.log.append("Lemuria", "Kumari"))
+            self.assertTrue(compacted.wait(5))
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(self.log.thread.is_alive())
+        self.log.waitForSync(self.log.append("Mu", "Hiranyapura"))
+
+
+if(__name__ == "__main__"):
+    unittest.main()
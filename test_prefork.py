@@ -0,0 +1,47 @@
+# Tests of the replicas of the country store in prefork workers, which forward inserts to the supervisor
+
+import os, tempfile, unittest
+from prefork import ReplicaStore
+from store import CountryStore
+
+
+class BroadcastingLink():
+    #Stands in for the pipe to the supervisor, which broadcasts an insert to every worker before answering the one that
+    #forwarded it.
+    def __init__(self):
+        self.replicas = list()
+
+    def add(self, country:str, city:str) -> bool:
+        for replica in self.replicas:
+            replica.apply(country, city)
+        return True
+
+
+class ReplicaStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, "countries.csv")
+        with open(path, "w", newline="", encoding="utf-8") as csvFile:
+            csvFile.write("Country,Capital\nAlbania,Tirana\n")
+        self.link = BroadcastingLink()
+        self.added = list()
+        # each as inherited by a worker of its own, with its own copy of the index
+        self.replicas = [ReplicaStore(CountryStore(path), self.link) for number in range(2)]
+        for number, replica in enumerate(self.replicas):
+            replica.setInsertListener(lambda country, city, number=number: self.added.append((number, country)))
+        self.link.replicas.extend(self.replicas)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    #Every worker is told about an insert once, including the one that forwarded it and also applies it itself.
+    def testListenerToldOnce(self):
+        self.assertTrue(self.replicas[0].add("Andorra", "Andorra la Vella"))
+        self.assertEqual(sorted(self.added), [(0, "Andorra"), (1, "Andorra")])
+        self.assertEqual(self.replicas[1].getCity("andorra"), "Andorra la Vella")
+        self.assertFalse(self.replicas[1].add("andorra", "Encamp"))
+        self.assertEqual(len(self.added), 2)
+
+
+if(__name__ == "__main__"):
+    unittest.main()
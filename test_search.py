@@ -0,0 +1,112 @@
+# Tests of the search of the country names: folding, edit distances, the ranking of completions and fuzzy matches, and
+# keeping the index up to date with the store
+
+import os, tempfile, unittest
+from search import SearchIndex, foldName, editDistances, maxDistance
+from store import CountryStore
+
+ROWS = ("Country,Capital\nGuinea,Conakry\nGuinea-Bissau,Bissau\nEquatorial Guinea,Malabo\nPapua New Guinea,Port Moresby\n"
+        "Niger,Niamey\nNigeria,Abuja\nCambodia,Phnom Penh\nUnited Kingdom,London\n")
+
+
+class FoldingTest(unittest.TestCase):
+    def testFoldName(self):
+        self.assertEqual(foldName("  UNITED \t kingdom "), "united kingdom")
+        self.assertEqual(foldName("Straße"), foldName("STRASSE"))
+        self.assertEqual(foldName("ｃｈａｄ"), "chad") # fullwidth letters
+
+    #Distances are to the whole name and to its closest prefix, and stop at the maximum plus one.
+    def testEditDistances(self):
+        self.assertEqual(editDistances("cambodja", "cambodia", 2), (1, 1))
+        self.assertEqual(editDistances("unitd", "united kingdom", 1), (2, 1))
+        self.assertEqual(editDistances("chad", "chad", 0), (0, 0))
+        self.assertEqual(editDistances("xyz", "albania", 1), (2, 2))
+
+    #Short queries would match almost anything, so they get fewer edits.
+    def testMaxDistance(self):
+        self.assertEqual([maxDistance("x" * length) for length in range(1, 8)], [0, 0, 1, 1, 1, 2, 2])
+
+
+class SearchIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "countries.csv")
+        self.write(ROWS)
+        self.store = CountryStore(self.path, checkInterval=0)
+        self.index = SearchIndex()
+        self.index.build(self.store)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, text:str, mode:str="w"):
+        with open(self.path, mode, newline="", encoding="utf-8") as csvFile:
+            csvFile.write(text)
+
+    def names(self, query:str, limit:int=10) -> list:
+        return [country for country, city in self.index.find(query, limit)]
+
+
+    #The whole name comes first, then completions of the start of a name, then of a later word, shorter names first.
+    def testRanking(self):
+        self.assertEqual(self.names("guinea"), ["Guinea", "Guinea-Bissau", "Papua New Guinea", "Equatorial Guinea"])
+        self.assertEqual(self.names("NIGER"), ["Niger", "Nigeria"])
+        self.assertEqual(self.names("guinea", 2), ["Guinea", "Guinea-Bissau"])
+        self.assertEqual(self.names("", 5), list())
+        self.assertEqual(self.names("guinea", 0), list())
+
+
+    #Misspelt names are found within one or two edits, of the whole name or of its start, after the exact matches.
+    def testFuzzyMatches(self):
+        self.assertEqual(self.names("cambodja"), ["Cambodia"])
+        self.assertEqual(self.names("equatorail"), ["Equatorial Guinea"])
+        self.assertEqual(self.names("nigera"), ["Niger", "Nigeria"]) # both one edit away, so the shorter first
+        self.assertEqual(self.names("zz"), list()) # too short to be fuzzy
+        self.assertEqual(self.names("atlantis"), list())
+
+
+    #The first entry of a folded name wins.
+    def testGet(self):
+        self.index.add("GUINEA", "Kankan")
+        self.assertEqual(self.index.get(" guinea "), ("Guinea", "Conakry"))
+        self.index.add("Chad", "N'Djamena")
+        self.assertEqual(self.index.get("CHAD"), ("Chad", "N'Djamena"))
+        self.assertIsNone(self.index.get("atlantis"))
+
+
+    #A few lines appended to the countries file are added to the index one by one.
+    def testIncrementalBuild(self):
+        self.write("Chad,N'Djamena\n", "a")
+        self.store.refresh(force=True)
+        with self.assertLogs("search", "INFO") as logs:
+            self.index.build(self.store)
+        self.assertIn("Search index updated", logs.output[0])
+        self.assertEqual(self.names("cha"), ["Chad", "Cambodia"]) # the completion, then the start one edit away
+        self.assertEqual(len(self.index), 9)
+
+
+    #Countries removed from the countries file are only dropped by building the index again.
+    def testRebuildOnRemoval(self):
+        self.write(ROWS.replace("Cambodia,Phnom Penh\n", ""))
+        self.store.refresh(force=True)
+        with self.assertLogs("search", "INFO") as logs:
+            self.index.build(self.store)
+        self.assertIn("Search index built", logs.output[0])
+        self.assertEqual(self.names("cambodia"), list())
+        self.assertEqual(len(self.index), 7)
+
+
+    #The index is brought up to date with the store in the background, and searches carry on meanwhile.
+    def testSyncInBackground(self):
+        index = SearchIndex()
+        self.assertFalse(index.isReady())
+        index.sync(self.store)
+        builder = index.builder # started by sync, and reset once it is done
+        if(builder is not None):
+            builder.join(5)
+        self.assertTrue(index.isReady())
+        self.assertEqual(index.find("niger", 1), [("Niger", "Niamey")])
+
+
+if(__name__ == "__main__"):
+    unittest.main()
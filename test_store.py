@@ -0,0 +1,168 @@
+# Tests of the in-memory country store: lookups, picking up edits of the countries file without a restart, the
+# snapshot of its parsed index, and the compaction of its write-ahead log
+
+import os, pickle, tempfile, unittest
+from unittest import mock
+from store import CountryStore, SNAPSHOT_VERSION, normaliseCountry
+from mapped import MappedIndex
+from persistence import WriteAheadLog
+
+ROWS = "Country,Capital\nAlbania,Tirana\nAntigua and Barbuda,Saint John's\nAlbania,Elbasan\n"
+
+
+class CountryStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "countries.csv")
+        self.write(ROWS)
+        self.store = CountryStore(self.path, checkInterval=0)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, text:str, mode:str="w"):
+        with open(self.path, mode, newline="", encoding="utf-8") as csvFile:
+            csvFile.write(text)
+
+
+    #Lookups are normalised, rows naming several countries are split, and the first row of a country wins.
+    def testLookups(self):
+        self.assertEqual(self.store.getCity("  ALBANIA "), "Tirana")
+        self.assertEqual(self.store.getCity("barbuda"), "Saint John's")
+        self.assertEqual(self.store.getCity("Antigua"), "Saint John's")
+        self.assertIsNone(self.store.getCity("Atlantis"))
+        self.assertEqual(self.store.getCities(["albania", "atlantis"]), ["Tirana", None])
+        self.assertEqual(normaliseCountry(" united KINGDOM"), "United kingdom")
+
+
+    #Lines appended to the file are read on the next refresh, without reloading the rest of it.
+    def testAppendedLinesAreRead(self):
+        generation = self.store.getGeneration()
+        self.write("Andorra,Andorra la Vella\nAngola,Lua", "a") # the last line is not complete yet
+        self.store.refresh(force=True)
+        self.assertEqual(self.store.getCity("andorra"), "Andorra la Vella")
+        self.assertIsNone(self.store.getCity("angola"))
+        self.assertGreater(self.store.getGeneration(), generation)
+        self.write("nda\n", "a")
+        self.store.refresh(force=True)
+        self.assertEqual(self.store.getCity("angola"), "Luanda")
+
+
+    #A file rewritten in place, or replaced by another one, is reloaded in full.
+    def testRewrittenFileIsReloaded(self):
+        self.write("Country,Capital\nAlbania,Durres\n")
+        self.store.refresh(force=True)
+        self.assertEqual(self.store.getCity("albania"), "Durres")
+        self.assertIsNone(self.store.getCity("antigua"))
+        replacement = self.path + ".new"
+        with open(replacement, "w", newline="", encoding="utf-8") as csvFile:
+            csvFile.write("Country,Capital\nBelgium,Brussels\n")
+        os.replace(replacement, self.path)
+        self.store.refresh(force=True)
+        self.assertEqual(self.store.getCity("belgium"), "Brussels")
+        self.assertIsNone(self.store.getCity("albania"))
+
+
+    #Without a write-ahead log, added countries are appended to the file, and countries already in it are refused.
+    def testAdd(self):
+        self.assertTrue(self.store.add("Andorra", "Andorra la Vella"))
+        self.assertFalse(self.store.add("albania", "Durres"))
+        self.assertEqual(CountryStore(self.path).getCity("andorra"), "Andorra la Vella")
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "countries.csv")
+        with open(self.path, "w", newline="", encoding="utf-8") as csvFile:
+            csvFile.write(ROWS)
+        CountryStore(self.path) # parses the file and saves the snapshot
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    #Loads a store, failing if it parses the countries file rather than loading the snapshot.
+    def loadFromSnapshot(self) -> CountryStore:
+        with mock.patch.object(CountryStore, "readFrom", side_effect=AssertionError("parsed the countries file")):
+            return CountryStore(self.path)
+
+    def testSnapshotIsUsed(self):
+        self.assertTrue(os.path.exists(self.path + ".snapshot"))
+        store = self.loadFromSnapshot()
+        self.assertEqual(store.getCity("albania"), "Tirana")
+        self.assertEqual(store.getCity("barbuda"), "Saint John's")
+
+    #A file that was only touched or copied has a new mtime, but the same hash, so the snapshot still matches.
+    def testTouchedFileKeepsSnapshot(self):
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(self.loadFromSnapshot().getCity("albania"), "Tirana")
+
+    #A file edited without changing its size has another hash, so the snapshot is dropped and the file parsed again.
+    def testEditedFileInvalidatesSnapshot(self):
+        stat = os.stat(self.path)
+        with open(self.path, "w", newline="", encoding="utf-8") as csvFile:
+            csvFile.write(ROWS.replace("Tirana", "Durres"))
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(os.stat(self.path).st_size, stat.st_size)
+        with self.assertRaises(AssertionError):
+            self.loadFromSnapshot()
+        self.assertEqual(CountryStore(self.path).getCity("albania"), "Durres")
+        self.assertEqual(self.loadFromSnapshot().getCity("albania"), "Durres") # saved again for the new file
+
+    def testUnusableSnapshots(self):
+        for contents in (b"not a pickle", pickle.dumps({"version":SNAPSHOT_VERSION + 1}), pickle.dumps([1, 2])):
+            with self.subTest(contents=contents):
+                with open(self.path + ".snapshot", "wb") as snapshotFile:
+                    snapshotFile.write(contents)
+                self.assertEqual(CountryStore(self.path).getCity("albania"), "Tirana")
+                self.assertEqual(self.loadFromSnapshot().getCity("albania"), "Tirana")
+
+
+class CompactionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "countries.csv")
+        with open(self.path, "w", newline="", encoding="utf-8") as csvFile:
+            csvFile.write(ROWS)
+        self.log = WriteAheadLog(self.path + ".wal", compactThreshold=10 ** 6) # compacted by the tests only
+
+    def tearDown(self):
+        self.log.close()
+        self.directory.cleanup()
+
+    #Adds two countries to a store and compacts its log.
+    def compact(self, mapped:bool) -> CountryStore:
+        store = CountryStore(self.path, log=self.log, mapped=mapped)
+        self.assertTrue(store.add("Andorra", "Andorra la Vella"))
+        self.assertTrue(store.add("Angola", "Luanda"))
+        store.compact()
+        self.assertEqual(self.log.getRecords(), 0)
+        with open(self.path, newline="", encoding="utf-8") as csvFile:
+            self.assertEqual(csvFile.read(), ROWS + "Andorra,Andorra la Vella\r\nAngola,Luanda\r\n") # the old rows as they were
+        return store
+
+    #Loads a store, failing if it parses the countries file rather than loading its snapshot or index file.
+    def loadWithoutParsing(self, mapped:bool) -> CountryStore:
+        with mock.patch.object(CountryStore, "readFrom", side_effect=AssertionError("parsed the countries file")):
+            return CountryStore(self.path, mapped=mapped)
+
+    #The logged entries are merged into a new index file, which still matches the countries file.
+    def testMappedIndexSurvives(self):
+        store = self.compact(mapped=True)
+        self.assertIsInstance(store.index, MappedIndex)
+        self.assertEqual(store.index.delta, dict())
+        self.assertEqual(store.getCity("barbuda"), "Saint John's")
+        self.assertEqual(store.findPrefix("An"), [("Andorra", "Andorra la Vella"), ("Angola", "Luanda"), ("Antigua", "Saint John's")])
+        loaded = self.loadWithoutParsing(mapped=True)
+        self.assertIsInstance(loaded.index, MappedIndex)
+        self.assertEqual(loaded.getCity("angola"), "Luanda")
+
+    def testSnapshotSurvives(self):
+        store = self.compact(mapped=False)
+        self.assertEqual(store.getCity("andorra"), "Andorra la Vella")
+        self.assertEqual(self.loadWithoutParsing(mapped=False).getCity("angola"), "Luanda")
+
+
+if(__name__ == "__main__"):
+    unittest.main()